@@ -30,6 +30,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so rate-limited requests are rejected before they are logged
+    'ip_tracking.ratelimit.RateLimitMiddleware',
     'ip_tracking.middleware.IPLoggingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -108,6 +110,22 @@ IPGEOLOCATION_SETTINGS = {
     'BACKEND_CACHE_TIMEOUT': 86400,  # Cache for 24 hours (86400 seconds)
 }
 
+# Geolocation backend used by IPLoggingMiddleware
+# - ip_tracking.geolocation.IPGeolocationAPIBackend: remote API (IPGEOLOCATION_SETTINGS)
+# - ip_tracking.geolocation.LocalRangeDatabaseBackend: offline lookups from a
+#   memory-mapped range database built with `manage.py compile_geolocation_db`
+IP_TRACKING_GEOLOCATION = {
+    'BACKEND': 'ip_tracking.geolocation.IPGeolocationAPIBackend',
+    'DATABASE_PATH': BASE_DIR / 'geolocation.db',
+    'RELOAD_INTERVAL': 60,  # Seconds between checks for a recompiled database
+    # Leave country/city empty in the middleware and fill them in with the
+    # backfill_geolocation Celery task, keeping lookups off the request path
+    'RESOLVE_IN_REQUEST': False,
+    'CACHE_TIMEOUT': 86400,  # Cache successful remote lookups for 24 hours
+    'NEGATIVE_CACHE_TIMEOUT': 300,  # Cache failed lookups for 5 minutes
+    'SINGLE_FLIGHT_TIMEOUT': 10,  # Max seconds to wait on an in-flight lookup for the same IP
+}
+
 # Cache configuration for geolocation data
 CACHES = {
     'default': {
@@ -120,9 +138,124 @@ CACHES = {
     }
 }
 
+# Client IP resolution
+# X-Forwarded-For / X-Real-IP are only trusted when the request comes from
+# one of these proxies; list your load balancers' networks here.
+IP_TRACKING_CLIENT_IP = {
+    'TRUSTED_PROXIES': ['127.0.0.0/8', '::1/128'],
+    'CACHE_SIZE': 4096,  # Memoized address classifications
+}
+
+# Request paths
+# Requests are logged by route (the URL pattern the path resolves to, e.g.
+# /users/<int:id>/, or '<unmatched>' for 404s), interned in RequestPath.
+# Set STORE_RAW_PATH to also keep the raw path on every RequestLog row.
+IP_TRACKING_PATHS = {
+    'NORMALIZE': True,
+    'STORE_RAW_PATH': False,
+    'CACHE_SIZE': 4096,  # Memoized path -> route resolutions
+}
+
+# Blocklist snapshot configuration
+# Each worker keeps the active blocklist in memory and reloads it when the
+# version stored in the cache changes. Use a shared cache (e.g. Redis) in
+# production so block_ip/unblock_ip take effect immediately in every worker;
+# with LocMemCache, workers pick up changes after MAX_AGE seconds.
+#
+# Alternatively, set BACKEND to 'ip_tracking.compiled_blocklist.CompiledBlocklist'
+# and COMPILED_PATH (e.g. BASE_DIR / 'blocklist.bin') to have every worker on
+# a host binary-search one shared memory-mapped file, written by
+# `manage.py compile_blocklist` and recompiled whenever BlockedIP changes.
+IP_TRACKING_BLOCKLIST = {
+    'BACKEND': 'ip_tracking.blocklist.BlocklistSnapshot',
+    'COMPILED_PATH': None,
+    'VERSION_CACHE_KEY': 'ip_tracking:blocklist_version',
+    'CHECK_INTERVAL': 1,  # Seconds between version checks
+    'MAX_AGE': 30,  # Seconds before a forced reload
+}
+
+# Buffered request logging
+# When enabled, RequestLog rows are queued in memory and written by a
+# background thread with bulk_create instead of one INSERT per request.
+# Under ASGI the middleware always uses the buffer, so the event loop
+# never waits on the database.
+IP_TRACKING_LOG_BUFFER = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,  # Maximum queued entries per worker
+    'BATCH_SIZE': 500,  # Maximum rows per bulk_create
+    'FLUSH_INTERVAL': 1.0,  # Seconds before a partial batch is written
+    'BLOCK_TIMEOUT': 0.0,  # Seconds to wait for queue space before dropping
+}
+
+# Anomaly detection thresholds, used by IPLoggingMiddleware in real time
+# (per-IP sliding-window counters in the cache) and by the hourly
+# detect_suspicious_ips reconciliation task
+IP_TRACKING_DETECTION = {
+    'ENABLED': True,
+    'REQUEST_THRESHOLD': 100,  # Requests per window
+    'WINDOW_SECONDS': 3600,
+    'SENSITIVE_PATHS': ['/admin/', '/login/', '/sensitive-data/', '/admin-dashboard/'],
+}
+
+# /metrics/ (per-worker cache and log buffer counters) is readable by staff
+# users and by clients in these networks, e.g. the metrics scraper
+IP_TRACKING_METRICS = {
+    'ALLOWED_NETWORKS': ['127.0.0.0/8', '::1/128'],
+}
+
+# Dashboard counters (TrafficCounter): request totals are written by log
+# buffer flushes, or from per-worker deltas every FLUSH_INTERVAL seconds,
+# and corrected every 5 minutes by the reconcile_counters task
+IP_TRACKING_COUNTERS = {
+    'FLUSH_INTERVAL': 5,
+}
+
+# Per-worker top-K (Space-Saving) summaries of IPs, paths and countries and
+# unique-visitor (HyperLogLog) sketches per hour, written every
+# FLUSH_INTERVAL seconds and used by the security report and dashboard
+IP_TRACKING_SKETCHES = {
+    'ENABLED': True,
+    'CAPACITY': 500,
+    'FLUSH_INTERVAL': 10,
+    'RETENTION_HOURS': 48,
+    'HLL_PRECISION': 12,
+    'MAX_PATHS': 100,
+}
+
+# Hourly request rollups (RequestRollup), updated by the update_request_rollups task
+IP_TRACKING_ROLLUPS = {
+    # Only roll up rows older than this so geolocation has been backfilled;
+    # newer rows are counted straight from RequestLog
+    'SETTLE_SECONDS': 300,
+    'BATCH_SIZE': 100000,  # Maximum RequestLog rows folded in per run
+}
+
+# Request log retention: rows older than DAYS are streamed into compressed
+# daily JSONL segments in ARCHIVE_DIR and deleted in chunks
+IP_TRACKING_RETENTION = {
+    'DAYS': 30,
+    'ARCHIVE_DIR': BASE_DIR / 'archive',
+    'CHUNK_SIZE': 5000,  # Rows per read chunk and per DELETE
+}
+
 # Rate Limiting Configuration
-RATELIMIT_USE_CACHE = 'default'
-RATELIMIT_VIEW = 'django_ratelimit.views.ratelimited'
+# RateLimitMiddleware enforces these per client IP with GCRA before the
+# request is logged and before the session middleware and views run. The first matching policy applies.
+# MemoryStore limits each worker separately; use
+# 'ip_tracking.ratelimit.RedisStore' with STORE_OPTIONS {'url': ...} to
+# share limits across workers.
+IP_TRACKING_RATELIMIT = {
+    'ENABLED': True,
+    'STORE': 'ip_tracking.ratelimit.MemoryStore',
+    'STORE_OPTIONS': {},
+    'POLICIES': [
+        {'name': 'login-post', 'path': '/login/', 'methods': ['POST'], 'rate': '5/m'},
+        {'name': 'login', 'path': '/login/', 'methods': ['GET'], 'rate': '10/m'},
+        {'name': 'admin-dashboard', 'path': '/admin-dashboard/', 'rate': '10/m'},
+        {'name': 'sensitive-data', 'path': '/sensitive-data/', 'rate': '10/m'},
+        {'name': 'default', 'path': '/', 'rate': '600/m', 'burst': 100},
+    ],
+}
 
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
@@ -1,5 +1,126 @@
+import json
+from datetime import timedelta
 from django.contrib import admin
-from .models import RequestLog, BlockedIP, SuspiciousIP
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import RequestLog, RequestPath, BlockedIP, SuspiciousIP, RequestRollup
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than COUNT_LIMIT rows exactly.
+
+    Small result sets are counted with a LIMITed subquery. Past the limit
+    the planner's row estimate is used where the database has one
+    (PostgreSQL), and the limit itself otherwise.
+    """
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        exact = queryset.order_by()[:self.COUNT_LIMIT + 1].count()
+        if exact <= self.COUNT_LIMIT:
+            return exact
+        return max(self.COUNT_LIMIT, self.estimate_count(queryset) or 0)
+
+    @staticmethod
+    def estimate_count(queryset):
+        """
+        Return the planner's row estimate for the queryset, or None.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class TimeWindowFilter(admin.SimpleListFilter):
+    """
+    Always restrict the changelist to a recent window of the log, so every
+    query is a range scan on the timestamp index. There is no "All" choice.
+    """
+    title = 'time window'
+    parameter_name = 'window'
+    default_window = '1h'
+    windows = {
+        '1h': ('Last hour', timedelta(hours=1)),
+        '6h': ('Last 6 hours', timedelta(hours=6)),
+        '24h': ('Last 24 hours', timedelta(hours=24)),
+        '7d': ('Last 7 days', timedelta(days=7)),
+        '30d': ('Last 30 days', timedelta(days=30)),
+    }
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, (label, _) in self.windows.items()]
+
+    def value(self):
+        value = super().value()
+        return value if value in self.windows else self.default_window
+
+    def choices(self, changelist):
+        # Skip the "All" choice
+        return list(super().choices(changelist))[1:]
+
+    def queryset(self, request, queryset):
+        return queryset.filter(timestamp__gte=timezone.now() - self.windows[self.value()][1])
+
+
+class CountryFilter(admin.SimpleListFilter):
+    """
+    Country filter whose choices come from the hourly rollups of the last
+    LOOKBACK, cached for CACHE_TIMEOUT seconds, instead of a DISTINCT scan
+    over the whole log.
+    """
+    title = 'country'
+    parameter_name = 'country'
+    LOOKBACK = timedelta(days=7)
+    CACHE_TIMEOUT = 600
+    CACHE_KEY = 'ip_tracking:admin:countries'
+
+    def lookups(self, request, model_admin):
+        countries = cache.get(self.CACHE_KEY)
+        if countries is None:
+            countries = list(
+                RequestRollup.objects
+                .filter(hour__gte=timezone.now() - self.LOOKBACK)
+                .exclude(country='')
+                .order_by('country')
+                .values_list('country', flat=True)
+                .distinct()
+            )
+            cache.set(self.CACHE_KEY, countries, self.CACHE_TIMEOUT)
+        return [(country, country) for country in countries]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(country=self.value())
+        return queryset
+
+
+class RouteFilter(admin.SimpleListFilter):
+    """
+    Route filter whose choices come from the RequestPath dimension table.
+    """
+    title = 'route'
+    parameter_name = 'route'
+
+    def lookups(self, request, model_admin):
+        return list(RequestPath.objects.order_by('route').values_list('id', 'route'))
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(route_id=self.value())
+        return queryset
 
 
 @admin.register(RequestLog)
@@ -7,11 +128,15 @@ class RequestLogAdmin(admin.ModelAdmin):
     """
     Admin interface for RequestLog model.
     """
-    list_display = ('ip_address', 'country', 'city', 'path', 'timestamp')
-    list_filter = ('timestamp', 'country', 'city', 'ip_address')
-    search_fields = ('ip_address', 'path', 'country', 'city')
-    readonly_fields = ('ip_address', 'path', 'timestamp', 'country', 'city')
+    list_display = ('ip_address', 'country', 'city', 'route', 'path', 'timestamp')
+    list_filter = (TimeWindowFilter, CountryFilter, RouteFilter)
+    list_select_related = ('route',)
+    # Exact IP and route-prefix matches can use indexes; icontains cannot
+    search_fields = ('=ip_address', '^route__route')
+    readonly_fields = ('ip_address', 'route', 'path', 'timestamp', 'country', 'city')
     ordering = ('-timestamp',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def has_add_permission(self, request):
         """Prevent manual addition of request logs through admin."""
@@ -27,15 +152,15 @@ class BlockedIPAdmin(admin.ModelAdmin):
     """
     Admin interface for BlockedIP model.
     """
-    list_display = ('ip_address', 'reason', 'is_active', 'created_at')
-    list_filter = ('is_active', 'created_at')
+    list_display = ('ip_address', 'prefix_length', 'reason', 'is_active', 'expires_at', 'created_at')
+    list_filter = ('is_active', 'created_at', 'expires_at')
     search_fields = ('ip_address', 'reason')
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
     
     fieldsets = (
         ('IP Information', {
-            'fields': ('ip_address', 'is_active')
+            'fields': ('ip_address', 'prefix_length', 'is_active', 'expires_at')
         }),
         ('Details', {
             'fields': ('reason', 'created_at')
@@ -65,7 +190,7 @@ class SuspiciousIPAdmin(admin.ModelAdmin):
             'fields': ('ip_address', 'is_active')
         }),
         ('Detection Details', {
-            'fields': ('reason', 'request_count', 'detected_at')
+            'fields': ('reason', 'reason_is_manual', 'request_count', 'detected_at')
         }),
         ('Sensitive Paths', {
             'fields': ('sensitive_paths',),
@@ -73,8 +198,34 @@ class SuspiciousIPAdmin(admin.ModelAdmin):
         }),
     )
     
+    def save_model(self, request, obj, form, change):
+        """Keep a reason edited here from being replaced by detection."""
+        if 'reason' in form.changed_data:
+            obj.reason_is_manual = True
+        super().save_model(request, obj, form, change)
+    
     def get_readonly_fields(self, request, obj=None):
         """Make detected_at readonly for existing objects."""
         if obj:  # editing an existing object
             return self.readonly_fields + ('detected_at',)
         return self.readonly_fields
+
+
+@admin.register(RequestRollup)
+class RequestRollupAdmin(admin.ModelAdmin):
+    """
+    Read-only admin interface for the hourly RequestRollup table.
+    """
+    list_display = ('hour', 'ip_address', 'route', 'country', 'count')
+    list_filter = ('hour',)
+    list_select_related = ('route',)
+    search_fields = ('ip_address', 'route__route')
+    ordering = ('-hour',)
+    
+    def has_add_permission(self, request):
+        """Rollups are maintained by the update_request_rollups task."""
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        """Rollups are maintained by the update_request_rollups task."""
+        return False
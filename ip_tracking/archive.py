@@ -0,0 +1,170 @@
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, time as datetime_time, timedelta, timezone as datetime_timezone
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import RequestLog
+from .paths import get_path_normalizer
+from .rollups import get_watermark
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RETENTION_SETTINGS = {
+    'DAYS': 30,  # Keep this many days of RequestLog rows in the database
+    'ARCHIVE_DIR': 'archive',  # Directory for the compressed daily segments
+    'CHUNK_SIZE': 5000,  # Rows per read chunk and per DELETE statement
+}
+
+ARCHIVE_FIELDS = ['id', 'ip_address', 'timestamp', 'route__route', 'path', 'country', 'city']
+
+
+def get_retention_settings():
+    """
+    Return the retention settings merged over the defaults.
+    """
+    return {**DEFAULT_RETENTION_SETTINGS, **getattr(settings, 'IP_TRACKING_RETENTION', {})}
+
+
+def segment_path(archive_dir, day):
+    """
+    Return an unused segment file path for the given day.
+    A day that is archived more than once gets numbered segments.
+    """
+    archive_dir = Path(archive_dir)
+    path = archive_dir / f"requestlog-{day:%Y-%m-%d}.jsonl.gz"
+    number = 1
+    while path.exists():
+        path = archive_dir / f"requestlog-{day:%Y-%m-%d}.{number}.jsonl.gz"
+        number += 1
+    return path
+
+
+def archive_request_logs(retention_days=None, archive_dir=None, chunk_size=None):
+    """
+    Move RequestLog rows older than the retention window into compressed
+    JSONL segments, one per day, then delete them in bounded chunks.
+
+    Only rows already folded into the hourly rollup are archived, so rollup
+    totals stay correct. Returns a list of (segment path, row count).
+    """
+    config = get_retention_settings()
+    retention_days = config['DAYS'] if retention_days is None else retention_days
+    archive_dir = Path(archive_dir or config['ARCHIVE_DIR'])
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    cutoff = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+    watermark = get_watermark()
+    archivable = RequestLog.objects.filter(timestamp__lt=cutoff, id__lte=watermark)
+
+    oldest = archivable.aggregate(oldest=Min('timestamp'))['oldest']
+    if oldest is None:
+        return []
+
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    segments = []
+    day = oldest.astimezone(datetime_timezone.utc).date()
+    while True:
+        day_start = datetime.combine(day, datetime_time.min, tzinfo=datetime_timezone.utc)
+        if day_start >= cutoff:
+            break
+        day_rows = archivable.filter(
+            timestamp__gte=day_start,
+            timestamp__lt=day_start + timedelta(days=1)
+        )
+        segment = archive_day(day, day_rows, archive_dir, chunk_size)
+        if segment is not None:
+            segments.append(segment)
+        day += timedelta(days=1)
+
+    return segments
+
+
+def archive_day(day, queryset, archive_dir, chunk_size):
+    """
+    Stream one day's rows into a segment file, then delete them in chunks.
+    Returns (segment path, row count), or None if there were no rows.
+    """
+    path = segment_path(archive_dir, day)
+    tmp_path = path.with_name(path.name + '.tmp')
+    count = 0
+    max_id = 0
+
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        rows = queryset.order_by('id').values(*ARCHIVE_FIELDS).iterator(chunk_size=chunk_size)
+        for row in rows:
+            row['timestamp'] = row['timestamp'].isoformat()
+            row['route'] = row.pop('route__route')
+            f.write(json.dumps(row, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+            max_id = row['id']
+
+    if count == 0:
+        tmp_path.unlink()
+        return None
+    os.replace(tmp_path, path)
+
+    # Delete only what was written, a chunk at a time, so locks stay short
+    archived = queryset.filter(id__lte=max_id)
+    deleted = 0
+    while True:
+        ids = list(archived.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+        deleted += RequestLog.objects.filter(id__in=ids).delete()[0]
+
+    logger.info(f"Archived {count} request logs for {day} to {path} ({deleted} deleted)")
+    return path, count
+
+
+def read_segment(path):
+    """
+    Yield the rows of a segment file as dicts with parsed timestamps.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            row['timestamp'] = parse_datetime(row['timestamp'])
+            yield row
+
+
+def query_segment(path, ip_address=None, path_prefix=None):
+    """
+    Yield the rows of a segment file matching an IP address and/or route
+    (or raw path) prefix.
+    """
+    for row in read_segment(path):
+        if ip_address and row['ip_address'] != ip_address:
+            continue
+        if path_prefix and not (row.get('route') or row['path'] or '').startswith(path_prefix):
+            continue
+        yield row
+
+
+def restore_segment(path, batch_size=5000):
+    """
+    Insert the rows of a segment file back into RequestLog, keeping their ids.
+    Rows that already exist are skipped. Returns the number of rows read.
+    Segments written before routes were logged get the route of their path.
+    """
+    normalizer = get_path_normalizer()
+    count = 0
+    batch = []
+    for row in read_segment(path):
+        route = row.pop('route', None) or normalizer.route(row['path'])
+        batch.append(RequestLog(route=normalizer.request_path(route), **row))
+        count += 1
+        if len(batch) >= batch_size:
+            RequestLog.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        RequestLog.objects.bulk_create(batch, ignore_conflicts=True)
+    return count
@@ -0,0 +1,367 @@
+import heapq
+import ipaddress
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BLOCKLIST_SETTINGS = {
+    'BACKEND': 'ip_tracking.blocklist.BlocklistSnapshot',
+    'COMPILED_PATH': None,  # Compiled blocklist file, recompiled on every change when set
+    'VERSION_CACHE_KEY': 'ip_tracking:blocklist_version',
+    'CHECK_INTERVAL': 1,  # Seconds between version checks per worker
+    'MAX_AGE': 30,  # Reload at least this often even if the version is unchanged
+}
+
+
+TTL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+TTL_PATTERN = re.compile(r'^(\d+)([smhd]?)$')
+
+
+def get_blocklist_settings():
+    """
+    Return the blocklist settings merged over the defaults.
+    """
+    return {**DEFAULT_BLOCKLIST_SETTINGS, **getattr(settings, 'IP_TRACKING_BLOCKLIST', {})}
+
+
+def parse_ttl(value):
+    """
+    Parse a block duration such as '3600', '30m', '12h' or '7d' into a timedelta.
+    """
+    match = TTL_PATTERN.match(value.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid duration: {value!r}")
+    return timedelta(seconds=int(match.group(1)) * TTL_UNITS[match.group(2) or 's'])
+
+
+def get_blocklist_version():
+    """
+    Return the current blocklist version from the shared cache.
+    """
+    key = get_blocklist_settings()['VERSION_CACHE_KEY']
+    return cache.get(key, 0)
+
+
+async def aget_blocklist_version():
+    """
+    Async version of get_blocklist_version.
+    """
+    key = get_blocklist_settings()['VERSION_CACHE_KEY']
+    return await cache.aget(key, 0)
+
+
+def bump_blocklist_version():
+    """
+    Increment the shared blocklist version so every worker reloads its snapshot.
+    """
+    key = get_blocklist_settings()['VERSION_CACHE_KEY']
+    try:
+        cache.add(key, 0, None)
+        return cache.incr(key)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(key, 1, None)
+        return 1
+
+
+def compile_blocklist_file():
+    """
+    Recompile the blocklist file at COMPILED_PATH, if one is configured.
+    """
+    path = get_blocklist_settings()['COMPILED_PATH']
+    if path is not None:
+        from .compiled_blocklist import compile_blocklist
+
+        compile_blocklist(path)
+
+
+def blocklist_changed():
+    """
+    Propagate a BlockedIP change to every worker: bump the shared version
+    and, when COMPILED_PATH is set, recompile the blocklist file once the
+    current transaction commits.
+    The compile is registered at most once per transaction, however many
+    rows change in it.
+    Call this after any change to BlockedIP that bypasses model signals
+    (e.g. QuerySet.update() or bulk_create()).
+    """
+    bump_blocklist_version()
+    if get_blocklist_settings()['COMPILED_PATH'] is None:
+        return
+    connection = transaction.get_connection()
+    if any(entry[1] is compile_blocklist_file for entry in connection.run_on_commit):
+        return
+    transaction.on_commit(compile_blocklist_file)
+
+
+class NetworkIndex:
+    """
+    Longest-prefix-match index over IPv4 and IPv6 networks.
+
+    Networks are stored as integers in one hash table per (family, prefix length).
+    A lookup masks the address once per distinct prefix length in use (at most
+    33 for IPv4 and 129 for IPv6) and probes the matching table, so its cost does
+    not depend on the number of networks in the index.
+
+    Networks are reference-counted: a network added twice stays in the
+    index until it has been discarded twice.
+    """
+
+    def __init__(self, networks=()):
+        # {version: {prefix_length: {network integer: reference count}}}
+        self._tables = {4: {}, 6: {}}
+        # {version: prefix lengths sorted longest first}
+        self._prefixes = {4: [], 6: []}
+        for network in networks:
+            self.add(network)
+
+    def __len__(self):
+        return sum(
+            len(table)
+            for tables in self._tables.values()
+            for table in tables.values()
+        )
+
+    def add(self, network):
+        """
+        Add an ipaddress network (or anything ip_network() accepts).
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        tables = self._tables[network.version]
+        if network.prefixlen not in tables:
+            tables[network.prefixlen] = {}
+            self._prefixes[network.version] = sorted(tables, reverse=True)
+        table = tables[network.prefixlen]
+        value = int(network.network_address)
+        table[value] = table.get(value, 0) + 1
+
+    def discard(self, network):
+        """
+        Drop one reference to a network, removing it from the index once
+        nothing else added it.
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        tables = self._tables[network.version]
+        table = tables.get(network.prefixlen)
+        value = int(network.network_address)
+        if table is None or value not in table:
+            return
+        if table[value] > 1:
+            table[value] -= 1
+            return
+        del table[value]
+        if not table:
+            del tables[network.prefixlen]
+            self._prefixes[network.version] = sorted(tables, reverse=True)
+
+    def lookup(self, ip_address):
+        """
+        Return the most specific network containing ip_address, or None.
+        """
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+
+        tables = self._tables[address.version]
+        max_prefixlen = address.max_prefixlen
+        value = int(address)
+        for prefixlen in self._prefixes[address.version]:
+            masked = value >> (max_prefixlen - prefixlen) << (max_prefixlen - prefixlen)
+            # A concurrent discard() may have just removed this prefix length
+            if masked in tables.get(prefixlen, ()):
+                network_class = ipaddress.IPv4Network if address.version == 4 else ipaddress.IPv6Network
+                return network_class((masked, prefixlen))
+        return None
+
+    def contains(self, ip_address):
+        """
+        Return True if any network in the index contains ip_address.
+        """
+        return self.lookup(ip_address) is not None
+
+
+class BlocklistSnapshot:
+    """
+    Per-worker snapshot of the active BlockedIP rows.
+
+    Lookups are answered from an in-memory NetworkIndex, which covers both
+    single addresses and CIDR blocks. The snapshot is reloaded from
+    the database only when the shared version counter changes, or when it is
+    older than MAX_AGE (a safety net for caches that are not shared between
+    processes, such as LocMemCache).
+
+    Blocks with an expiry time are also kept in a min-heap ordered by
+    expiry. Each lookup compares the current time with the head of the
+    heap and drops due entries' references from the index, so a temporary
+    block stops applying on time without a reload, while a network that
+    another active row also blocks stays blocked; the expire_blocked_ips
+    task later deactivates the rows in bulk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expire_lock = threading.Lock()
+        self._index = NetworkIndex()
+        # Heap of (expiry timestamp, network) for blocks with expires_at
+        self._expiries = []
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def is_blocked(self, ip_address):
+        """
+        Return True if the given IP address is covered by the active blocklist.
+        """
+        self.refresh()
+        self._expire()
+        return self._index.contains(ip_address)
+
+    def lookup(self, ip_address):
+        """
+        Return the most specific blocked network containing ip_address, or None.
+        """
+        self.refresh()
+        self._expire()
+        return self._index.lookup(ip_address)
+
+    async def ais_blocked(self, ip_address):
+        """
+        Async version of is_blocked.
+        """
+        await self.arefresh()
+        self._expire()
+        return self._index.contains(ip_address)
+
+    def refresh(self, force=False):
+        """
+        Reload the snapshot if the shared version changed or it has expired.
+        """
+        config = get_blocklist_settings()
+        now = time.monotonic()
+        if not force and now - self._checked_at < config['CHECK_INTERVAL']:
+            return
+
+        with self._lock:
+            if not force and now - self._checked_at < config['CHECK_INTERVAL']:
+                return
+            self._checked_at = now
+
+            version = get_blocklist_version()
+            if force or self._needs_reload(version, now, config):
+                self.load(version)
+
+    async def arefresh(self, force=False):
+        """
+        Async version of refresh using the async cache and ORM APIs.
+        """
+        config = get_blocklist_settings()
+        now = time.monotonic()
+        if not force and now - self._checked_at < config['CHECK_INTERVAL']:
+            return
+
+        # Claim the check before awaiting so concurrent coroutines skip it
+        self._checked_at = now
+        version = await aget_blocklist_version()
+        if force or self._needs_reload(version, now, config):
+            await self.aload(version)
+
+    def load(self, version=None):
+        """
+        Load the active blocked addresses and networks from the database.
+        """
+        index = NetworkIndex()
+        expiries = []
+        for ip_address, prefix_length, expires_at in self._active_rows().iterator():
+            self._add_row(index, expiries, ip_address, prefix_length, expires_at)
+        self._swap(index, expiries, version)
+
+    async def aload(self, version=None):
+        """
+        Async version of load.
+        """
+        index = NetworkIndex()
+        expiries = []
+        async for ip_address, prefix_length, expires_at in self._active_rows():
+            self._add_row(index, expiries, ip_address, prefix_length, expires_at)
+        self._swap(index, expiries, version)
+
+    def _needs_reload(self, version, now, config):
+        return version != self._version or now - self._loaded_at >= config['MAX_AGE']
+
+    def _active_rows(self):
+        from .models import BlockedIP
+
+        return (
+            BlockedIP.objects
+            .filter(is_active=True)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+            .values_list('ip_address', 'prefix_length', 'expires_at')
+        )
+
+    def _add_row(self, index, expiries, ip_address, prefix_length, expires_at):
+        network = ip_address if prefix_length is None else f"{ip_address}/{prefix_length}"
+        index.add(network)
+        if expires_at is not None:
+            expiries.append((expires_at.timestamp(), network))
+
+    def _swap(self, index, expiries, version):
+        heapq.heapify(expiries)
+        # Swap in the new index in one assignment so readers never see a partial load
+        with self._expire_lock:
+            self._index = index
+            self._expiries = expiries
+        self._version = version
+        self._loaded_at = time.monotonic()
+        logger.debug(f"Loaded blocklist snapshot v{version} with {len(index)} entries")
+
+    def _expire(self):
+        """
+        Remove blocks whose expiry time has passed from the index.
+        Costs one comparison when nothing is due.
+        """
+        expiries = self._expiries
+        if not expiries or expiries[0][0] > time.time():
+            return
+
+        with self._expire_lock:
+            now = time.time()
+            while self._expiries and self._expiries[0][0] <= now:
+                _, network = heapq.heappop(self._expiries)
+                self._index.discard(network)
+                logger.info(f"Blocklist entry {network} expired")
+
+    def invalidate(self):
+        """
+        Force the next lookup to reload the snapshot.
+        """
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+
+
+_blocklist = None
+_blocklist_lock = threading.Lock()
+
+
+def get_blocklist():
+    """
+    Return the shared per-process instance of the configured blocklist backend.
+    """
+    global _blocklist
+    if _blocklist is None:
+        with _blocklist_lock:
+            if _blocklist is None:
+                _blocklist = import_string(get_blocklist_settings()['BACKEND'])()
+    return _blocklist
@@ -0,0 +1,113 @@
+import ipaddress
+import logging
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from django.conf import settings
+from .blocklist import NetworkIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CLIENT_IP_SETTINGS = {
+    # Proxies whose X-Forwarded-For / X-Real-IP headers are believed.
+    # Requests from any other address are attributed to REMOTE_ADDR.
+    # The loopback default suits a reverse proxy on the same host; without
+    # one, a local client (or anything relaying through localhost) can
+    # claim any address, so set this to [] when nothing proxies requests.
+    'TRUSTED_PROXIES': ['127.0.0.0/8', '::1/128'],
+    'CACHE_SIZE': 4096,  # Distinct address strings whose classification is memoized
+}
+
+# address: normalised address string, or None if the value is not an IP
+# is_private: private, loopback or link-local (also True for invalid values)
+# is_trusted_proxy: inside one of TRUSTED_PROXIES
+IPClassification = namedtuple('IPClassification', ['address', 'is_private', 'is_trusted_proxy'])
+
+
+def get_client_ip_settings():
+    """
+    Return the client IP settings merged over the defaults.
+    """
+    return {**DEFAULT_CLIENT_IP_SETTINGS, **getattr(settings, 'IP_TRACKING_CLIENT_IP', {})}
+
+
+class ClientIPResolver:
+    """
+    Resolve the real client address of a request behind trusted proxies.
+
+    Only a trusted proxy can vouch for the address before it, so the
+    X-Forwarded-For chain is walked from the right (the hop closest to us)
+    and the first address that is not a trusted proxy is the client. Entries
+    further left were supplied by the client and are ignored.
+
+    The trusted networks are compiled into a NetworkIndex once, and each
+    raw address string is parsed and classified once, in a bounded LRU.
+    """
+
+    def __init__(self, trusted_proxies, cache_size=4096):
+        self.trusted_proxies = NetworkIndex(trusted_proxies)
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, value):
+        """
+        Parse and classify a raw address string.
+        """
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return IPClassification(None, True, False)
+        return IPClassification(
+            str(address),
+            address.is_private or address.is_loopback or address.is_link_local,
+            self.trusted_proxies.contains(address)
+        )
+
+    def resolve(self, meta):
+        """
+        Return the client IP address for a request's META dict.
+        """
+        remote_addr = meta.get('REMOTE_ADDR') or '127.0.0.1'
+        if not self.classify(remote_addr).is_trusted_proxy:
+            return remote_addr
+
+        x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            client = remote_addr
+            for entry in reversed(x_forwarded_for.split(',')):
+                classification = self.classify(entry.strip())
+                if classification.address is None:
+                    # Garbage from beyond the trusted hops; stop at the last known address
+                    logger.debug(f"Invalid X-Forwarded-For entry {entry!r} from {client}")
+                    return client
+                client = classification.address
+                if not classification.is_trusted_proxy:
+                    return client
+            # Every hop was a trusted proxy; the leftmost is the best we know
+            return client
+
+        x_real_ip = meta.get('HTTP_X_REAL_IP')
+        if x_real_ip:
+            classification = self.classify(x_real_ip.strip())
+            if classification.address is not None:
+                return classification.address
+
+        return remote_addr
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_client_ip_resolver():
+    """
+    Return the shared resolver built from IP_TRACKING_CLIENT_IP.
+    """
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                config = get_client_ip_settings()
+                _resolver = ClientIPResolver(config['TRUSTED_PROXIES'], config['CACHE_SIZE'])
+    return _resolver
@@ -0,0 +1,255 @@
+import heapq
+import ipaddress
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from django.db.models import Q
+from django.utils import timezone
+from .blocklist import get_blocklist_settings
+from .geolocation import RangeStarts, ip_to_int
+
+
+logger = logging.getLogger(__name__)
+
+
+# Compiled blocklist layout (all integers big-endian):
+#   header:  magic (8s), generation (Q), range count (Q)
+#   records: start (QQ), end (QQ), expires (Q, Unix seconds, 0 = never)
+# Ranges are sorted by start and disjoint. IPv4 is mapped into ::ffff:0:0/96.
+BLOCKLIST_DB_MAGIC = b'IPTBLK01'
+BLOCKLIST_DB_HEADER = struct.Struct('>8sQQ')
+BLOCKLIST_DB_RECORD = struct.Struct('>QQQQQ')
+
+NEVER = math.inf
+
+
+def merge_ranges(ranges):
+    """
+    Turn (start, end, expires) ranges that may overlap into sorted, disjoint
+    ranges. Where ranges overlap the latest expiry wins (NEVER beats any
+    time), and touching ranges with the same expiry are joined.
+    """
+    events = []
+    for start, end, expires in ranges:
+        events.append((start, 1, expires))
+        events.append((end + 1, -1, expires))
+    events.sort()
+
+    active = Counter()
+    latest = []  # Max-heap of active expiries, with lazy deletion
+    merged = []
+    i = 0
+    while i < len(events):
+        point = events[i][0]
+        while i < len(events) and events[i][0] == point:
+            _, change, expires = events[i]
+            active[expires] += change
+            if change > 0:
+                heapq.heappush(latest, -expires)
+            i += 1
+        while latest and active[-latest[0]] == 0:
+            heapq.heappop(latest)
+
+        if latest and i < len(events):
+            end, expires = events[i][0] - 1, -latest[0]
+            if merged and merged[-1][1] == point - 1 and merged[-1][2] == expires:
+                merged[-1] = (merged[-1][0], end, expires)
+            else:
+                merged.append((point, end, expires))
+    return merged
+
+
+def read_generation(path):
+    """
+    Return the generation number of a compiled blocklist, or 0 if there is none.
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic, generation, _ = BLOCKLIST_DB_HEADER.unpack(f.read(BLOCKLIST_DB_HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return generation if magic == BLOCKLIST_DB_MAGIC else 0
+
+
+@contextmanager
+def _compile_lock(path):
+    """
+    Serialise compiles on this host so generations are never reused.
+    """
+    import fcntl
+
+    with open(f"{path}.lock", 'wb') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def compile_blocklist(path=None):
+    """
+    Compile the active, unexpired BlockedIP rows into the blocklist file with
+    the next generation number. The file is written to a temporary path and
+    atomically moved into place. Returns (generation, range count).
+    """
+    from .models import BlockedIP
+
+    path = path or get_blocklist_settings()['COMPILED_PATH']
+    if path is None:
+        raise ValueError("IP_TRACKING_BLOCKLIST['COMPILED_PATH'] is not set")
+
+    with _compile_lock(path):
+        rows = (
+            BlockedIP.objects
+            .filter(is_active=True)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+            .values_list('ip_address', 'prefix_length', 'expires_at')
+        )
+        ranges = []
+        for ip_address, prefix_length, expires_at in rows.iterator():
+            network = ipaddress.ip_network(ip_address if prefix_length is None else f"{ip_address}/{prefix_length}")
+            expires = NEVER if expires_at is None else math.ceil(expires_at.timestamp())
+            ranges.append((ip_to_int(network.network_address), ip_to_int(network.broadcast_address), expires))
+        ranges = merge_ranges(ranges)
+
+        generation = read_generation(path) + 1
+        packed = bytearray(BLOCKLIST_DB_HEADER.pack(BLOCKLIST_DB_MAGIC, generation, len(ranges)))
+        for start, end, expires in ranges:
+            packed += BLOCKLIST_DB_RECORD.pack(
+                start >> 64, start & 0xFFFFFFFFFFFFFFFF,
+                end >> 64, end & 0xFFFFFFFFFFFFFFFF,
+                0 if expires == NEVER else expires,
+            )
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(packed)
+        os.replace(tmp_path, path)
+
+    logger.info(f"Compiled blocklist generation {generation} to {path} ({len(ranges)} ranges)")
+    return generation, len(ranges)
+
+
+class BlocklistDatabase:
+    """
+    Read-only, memory-mapped compiled blocklist.
+    Every process that maps the same file shares one page-cache copy.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+
+        magic, self.generation, self._count = BLOCKLIST_DB_HEADER.unpack_from(self._mmap, 0)
+        if magic != BLOCKLIST_DB_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a compiled blocklist")
+        self._starts = RangeStarts(self._mmap, self._count, BLOCKLIST_DB_HEADER.size, BLOCKLIST_DB_RECORD.size)
+
+    def __len__(self):
+        return self._count
+
+    def contains(self, ip_address, now=None):
+        """
+        Return True if an unexpired range contains the address.
+        """
+        try:
+            value = ip_to_int(ip_address)
+        except ValueError:
+            return False
+        index = bisect_right(self._starts, value) - 1
+        if index < 0:
+            return False
+
+        _, _, end_high, end_low, expires = BLOCKLIST_DB_RECORD.unpack_from(
+            self._mmap, BLOCKLIST_DB_HEADER.size + index * BLOCKLIST_DB_RECORD.size
+        )
+        if value > ((end_high << 64) | end_low):
+            return False
+        return expires == 0 or expires > (now or time.time())
+
+
+class CompiledBlocklist:
+    """
+    Blocklist backend that answers lookups from the file written by
+    `manage.py compile_blocklist` (IP_TRACKING_BLOCKLIST['COMPILED_PATH']).
+
+    Lookups binary-search the mapped file, so workers hold no private copy
+    of the blocklist. Every CHECK_INTERVAL seconds a worker stat()s the
+    path and re-maps it when a new generation has been moved into place.
+    BlockedIP changes recompile the file on the host that made them (see
+    blocklist_changed); other hosts need `manage.py compile_blocklist`.
+    Lookups never compile: while the file is missing an error is logged
+    and nothing is blocked.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._database = None
+        self._checked_at = 0.0
+
+    def is_blocked(self, ip_address):
+        """
+        Return True if the given IP address is covered by the compiled blocklist.
+        """
+        self.refresh()
+        database = self._database
+        return database is not None and database.contains(ip_address)
+
+    async def ais_blocked(self, ip_address):
+        """
+        Async version of is_blocked. A refresh is at most a stat() and an
+        mmap every CHECK_INTERVAL, so it runs on the event loop.
+        """
+        return self.is_blocked(ip_address)
+
+    def refresh(self, force=False):
+        """
+        Re-map the file if it has been replaced since it was last mapped.
+        """
+        config = get_blocklist_settings()
+        now = time.monotonic()
+        if not force and now - self._checked_at < config['CHECK_INTERVAL']:
+            return
+
+        with self._lock:
+            if not force and now - self._checked_at < config['CHECK_INTERVAL']:
+                return
+            self._checked_at = now
+
+            path = config['COMPILED_PATH']
+            if path is None:
+                raise ValueError("IP_TRACKING_BLOCKLIST['COMPILED_PATH'] is not set")
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Compiling needs the ORM, which is not safe from the request path
+                logger.error(
+                    f"Compiled blocklist {path} does not exist; "
+                    f"run `manage.py compile_blocklist` to create it"
+                )
+                return
+
+            if self._database is None or (stat.st_ino, stat.st_mtime_ns) != self._database.identity:
+                # Keep the old mapping open; in-flight lookups may still use it
+                self._database = BlocklistDatabase(path)
+                logger.info(
+                    f"Loaded compiled blocklist generation {self._database.generation} "
+                    f"from {path} ({len(self._database)} ranges)"
+                )
+
+    def invalidate(self):
+        """
+        Force the next lookup to check the file.
+        """
+        self._checked_at = 0.0
@@ -0,0 +1,209 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone as datetime_timezone
+from django.conf import settings
+from django.db.models import F
+from .models import BlockedIP, RequestLog, SuspiciousIP, TrafficCounter
+
+
+logger = logging.getLogger(__name__)
+
+
+REQUESTS = 'requests'
+SUSPICIOUS_IPS = 'suspicious_ips'
+BLOCKED_IPS = 'blocked_ips'
+# Unix time (whole seconds) before which reconcile_counters last counted
+# every request; request deltas from before it are already in the total
+REQUESTS_WATERMARK = 'requests_watermark'
+
+DEFAULT_COUNTER_SETTINGS = {
+    'FLUSH_INTERVAL': 5,  # Seconds between writes of a worker's pending request count
+}
+
+
+def get_counter_settings():
+    """
+    Return the counter settings merged over the defaults.
+    """
+    return {**DEFAULT_COUNTER_SETTINGS, **getattr(settings, 'IP_TRACKING_COUNTERS', {})}
+
+
+def increment_counter(name, amount):
+    """
+    Atomically add `amount` to a counter, creating it if needed.
+    """
+    if TrafficCounter.objects.filter(name=name).update(value=F('value') + amount):
+        return
+    TrafficCounter.objects.get_or_create(name=name)
+    TrafficCounter.objects.filter(name=name).update(value=F('value') + amount)
+
+
+def get_requests_watermark():
+    """
+    Return the time (Unix seconds) the request total was last reconciled up to.
+    """
+    return (
+        TrafficCounter.objects
+        .filter(name=REQUESTS_WATERMARK)
+        .values_list('value', flat=True)
+        .first()
+    ) or 0
+
+
+def increment_requests(seconds):
+    """
+    Add requests made at the given Unix times (whole seconds) to the request
+    total, leaving out those already counted by the last reconcile.
+    """
+    watermark = get_requests_watermark()
+    amount = sum(1 for second in seconds if second >= watermark)
+    if amount:
+        increment_counter(REQUESTS, amount)
+
+
+def set_counters(values):
+    """
+    Overwrite counters from a {name: value} dict in one upsert.
+    """
+    TrafficCounter.objects.bulk_create(
+        [TrafficCounter(name=name, value=value) for name, value in values.items()],
+        update_conflicts=True,
+        unique_fields=['name'],
+        update_fields=['value', 'updated_at']
+    )
+
+
+def refresh_active_counts():
+    """
+    Recount the active suspicious and blocked IPs. Both tables are small,
+    so they are recounted on change rather than tracked by deltas.
+    """
+    set_counters({
+        SUSPICIOUS_IPS: SuspiciousIP.objects.filter(is_active=True).count(),
+        BLOCKED_IPS: BlockedIP.objects.filter(is_active=True).count(),
+    })
+
+
+def reconcile_counters():
+    """
+    Reset every counter to the true count, correcting any drift (e.g. from
+    increments lost when a worker was killed). The request total comes from
+    the hourly rollup plus the un-rolled tail, so it still includes archived
+    request logs.
+
+    Requests are counted up to a whole-second watermark, stored with the
+    total in the same upsert. Deltas that workers flush afterwards only add
+    the requests made since the watermark, so requests that were pending in
+    any worker while the count was taken are not counted twice.
+    """
+    from .rollups import windowed_total
+
+    watermark = int(time.time())
+    since_watermark = RequestLog.objects.filter(
+        timestamp__gte=datetime.fromtimestamp(watermark, datetime_timezone.utc)
+    )
+    values = {
+        REQUESTS: windowed_total(None) - since_watermark.count(),
+        REQUESTS_WATERMARK: watermark,
+        SUSPICIOUS_IPS: SuspiciousIP.objects.filter(is_active=True).count(),
+        BLOCKED_IPS: BlockedIP.objects.filter(is_active=True).count(),
+    }
+    set_counters(values)
+    return values
+
+
+def get_counters():
+    """
+    Return {name: value} for every counter in a single query, including this
+    worker's request count that has not been written yet. Missing counters
+    are created by reconciling once.
+    """
+    counters = dict(TrafficCounter.objects.values_list('name', 'value'))
+    if not all(name in counters for name in (REQUESTS, SUSPICIOUS_IPS, BLOCKED_IPS)):
+        counters = reconcile_counters()
+    counters[REQUESTS] += pending_counters.pending(REQUESTS)
+    return counters
+
+
+class PendingCounters:
+    """
+    Per-worker counter deltas, written to TrafficCounter at most once per
+    FLUSH_INTERVAL instead of once per request. Remaining deltas are
+    written when the worker exits.
+
+    Deltas are kept per second, so that request deltas from before the
+    last reconcile's watermark can be left out when they are written.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {name: {Unix second: delta}}
+        self._deltas = {}
+        self._flushed_at = time.monotonic()
+
+    def add(self, name, amount=1):
+        """
+        Add to a counter, writing pending deltas if FLUSH_INTERVAL has passed.
+        """
+        if self._add(name, amount, int(time.time())):
+            self.flush()
+
+    def pending(self, name):
+        """
+        Return this worker's unwritten delta for a counter.
+        """
+        return sum(self._deltas.get(name, {}).values())
+
+    def flush(self):
+        """
+        Write all pending deltas.
+        """
+        deltas = self._take()
+        if not deltas:
+            return
+        watermark = 0
+        if REQUESTS in deltas:
+            try:
+                watermark = get_requests_watermark()
+            except Exception as e:
+                logger.error(f"Error reading the request counter watermark: {e}")
+        for name, seconds in deltas.items():
+            amount = sum(
+                delta for second, delta in seconds.items()
+                if name != REQUESTS or second >= watermark
+            )
+            if not amount:
+                continue
+            try:
+                increment_counter(name, amount)
+            except Exception as e:
+                logger.error(f"Error writing counter {name}: {e}")
+
+    def clear(self):
+        """
+        Forget all pending deltas without writing them, e.g. before the
+        database they would be written to goes away.
+        """
+        self._take()
+
+    def _add(self, name, amount, second):
+        """
+        Record a delta and return True if it is time to flush.
+        """
+        with self._lock:
+            seconds = self._deltas.setdefault(name, {})
+            seconds[second] = seconds.get(second, 0) + amount
+            return time.monotonic() - self._flushed_at >= get_counter_settings()['FLUSH_INTERVAL']
+
+    def _take(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+            self._flushed_at = time.monotonic()
+        return deltas
+
+
+# Shared per-process deltas used by the middleware
+pending_counters = PendingCounters()
+atexit.register(pending_counters.flush)
@@ -0,0 +1,153 @@
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .counters import refresh_active_counts
+from .models import SuspiciousIP
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DETECTION_SETTINGS = {
+    'ENABLED': True,  # Flag IPs from the middleware as requests arrive
+    'REQUEST_THRESHOLD': 100,  # Requests per window above which an IP is flagged
+    'WINDOW_SECONDS': 3600,  # Length of the sliding window
+    # Matched exactly against request routes (see IP_TRACKING_PATHS)
+    'SENSITIVE_PATHS': ['/admin/', '/login/', '/sensitive-data/', '/admin-dashboard/'],
+    'KEY_PREFIX': 'ip_tracking:detection',
+}
+
+
+def get_detection_settings():
+    """
+    Return the anomaly detection settings merged over the defaults.
+    """
+    return {**DEFAULT_DETECTION_SETTINGS, **getattr(settings, 'IP_TRACKING_DETECTION', {})}
+
+
+# SuspiciousIP fields refreshed when an already flagged IP is detected
+# again. The reason is refreshed too, unless an operator wrote it.
+DETECTION_UPDATE_FIELDS = ['request_count', 'sensitive_paths', 'detected_at', 'is_active']
+
+
+def save_suspicious_ips(flags):
+    """
+    Create or refresh SuspiciousIP records with at most three queries,
+    however many there are: one to find the flags whose reason an operator
+    wrote, and one bulk upsert each for those and the rest.
+    """
+    manual = set(
+        SuspiciousIP.objects
+        .filter(ip_address__in=[flag.ip_address for flag in flags], reason_is_manual=True)
+        .values_list('ip_address', flat=True)
+    )
+    groups = (
+        ([flag for flag in flags if flag.ip_address not in manual], DETECTION_UPDATE_FIELDS + ['reason']),
+        ([flag for flag in flags if flag.ip_address in manual], DETECTION_UPDATE_FIELDS),
+    )
+    for group, update_fields in groups:
+        if group:
+            SuspiciousIP.objects.bulk_create(
+                group,
+                update_conflicts=True,
+                unique_fields=['ip_address'],
+                update_fields=update_fields
+            )
+
+
+def flag_suspicious_ip(ip_address, reason, request_count, sensitive_paths=()):
+    """
+    Create or refresh the SuspiciousIP record for an address, then update
+    the dashboard counters.
+    """
+    save_suspicious_ips([_suspicious_ip(ip_address, reason, request_count, sensitive_paths)])
+    refresh_active_counts()
+
+
+def _suspicious_ip(ip_address, reason, request_count, sensitive_paths=()):
+    return SuspiciousIP(
+        ip_address=ip_address,
+        reason=reason[:255],
+        request_count=request_count,
+        sensitive_paths=list(sensitive_paths),
+        detected_at=timezone.now(),
+        is_active=True
+    )
+
+
+class SlidingWindowDetector:
+    """
+    Per-IP request counters in the shared cache, checked on every request.
+
+    Each IP has one counter per fixed window. The sliding count is the current
+    window's counter plus the previous window's counter weighted by how much
+    of it still overlaps the sliding window, so a request costs one increment
+    and one read whatever the window length. Crossing REQUEST_THRESHOLD or
+    requesting a SENSITIVE_PATHS entry flags the IP at once; a guard key
+    makes each flag happen once per window. The hourly detect_suspicious_ips
+    task remains the reconciliation pass over the stored logs.
+    """
+
+    def record(self, ip_address, path):
+        """
+        Count a request and flag the IP if it is suspicious.
+        """
+        config = get_detection_settings()
+        if not config['ENABLED']:
+            return
+
+        window, elapsed = self._window(config)
+        current_key = self._counter_key(config, ip_address, window)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            if cache.add(current_key, 1, config['WINDOW_SECONDS'] * 2):
+                current = 1
+            else:
+                current = cache.incr(current_key)
+
+        previous = cache.get(self._counter_key(config, ip_address, window - 1), 0)
+        request_count = self._sliding_count(config, current, previous, elapsed)
+
+        for reason, sensitive_paths, guard in self._flags(config, ip_address, path, request_count, window):
+            if cache.add(guard, True, config['WINDOW_SECONDS']):
+                flag_suspicious_ip(ip_address, reason, request_count, sensitive_paths)
+                logger.warning(f"Flagged suspicious IP {ip_address}: {reason}")
+
+    def _window(self, config):
+        """
+        Return (current window number, seconds elapsed in it).
+        """
+        window, elapsed = divmod(time.time(), config['WINDOW_SECONDS'])
+        return int(window), elapsed
+
+    def _counter_key(self, config, ip_address, window):
+        return f"{config['KEY_PREFIX']}:count:{ip_address}:{window}"
+
+    def _sliding_count(self, config, current, previous, elapsed):
+        overlap = 1 - elapsed / config['WINDOW_SECONDS']
+        return current + int(previous * overlap)
+
+    def _flags(self, config, ip_address, path, request_count, window):
+        """
+        Yield (reason, sensitive paths, guard key) for each reason to flag the IP.
+        """
+        prefix = f"{config['KEY_PREFIX']}:flagged:{ip_address}:{window}"
+        if request_count > config['REQUEST_THRESHOLD']:
+            yield (
+                f"High volume: {request_count} requests in the last {config['WINDOW_SECONDS'] // 60} minutes",
+                [],
+                f"{prefix}:volume"
+            )
+        if path in config['SENSITIVE_PATHS']:
+            # Guard by position, since paths may not be valid cache key characters
+            yield (
+                f"Accessed sensitive path: {path}",
+                [path],
+                f"{prefix}:path:{config['SENSITIVE_PATHS'].index(path)}"
+            )
+
+
+detector = SlidingWindowDetector()
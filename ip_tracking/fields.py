@@ -0,0 +1,105 @@
+import ipaddress
+from django.db import models
+
+
+def ip_to_int(ip_address):
+    """
+    Convert an IPv4 or IPv6 address to a 128-bit integer.
+    IPv4 addresses are mapped into ::ffff:0:0/96 so both families share one key space.
+    """
+    if isinstance(ip_address, str) and ip_address.isdigit():
+        ip_address = int(ip_address)
+    address = ipaddress.ip_address(ip_address)
+    if address.version == 4:
+        return 0xFFFF00000000 | int(address)
+    return int(address)
+
+
+def pack_ip(ip_address):
+    """
+    Return the 16-byte big-endian form of an address (see ip_to_int).
+    Byte order matches numeric order, so packed values can be range-scanned.
+    """
+    return ip_to_int(ip_address).to_bytes(16, 'big')
+
+
+def unpack_ip(value):
+    """
+    Return the address string for a packed value, as IPv4 if it is IPv4-mapped.
+    """
+    address = ipaddress.IPv6Address(bytes(value))
+    return str(address.ipv4_mapped or address)
+
+
+def network_range(network):
+    """
+    Return the packed (first, last) addresses of a network, given as a CIDR
+    string or an ipaddress network object.
+    """
+    network = ipaddress.ip_network(network, strict=False)
+    return pack_ip(network.network_address), pack_ip(network.broadcast_address)
+
+
+class PackedIPAddressField(models.BinaryField):
+    """
+    Fixed-width (16-byte) copy of an address kept alongside a text IP field,
+    so networks can be queried as an indexed range (see network_range).
+
+    The value is derived from `source` when the row is saved or bulk-created:
+    an attribute holding an address string, or an ipaddress network object,
+    in which case `bound` picks its 'first' or 'last' address. Nothing
+    derives it on QuerySet.update() or bulk_update(); use refresh_packed_fields.
+    """
+
+    def __init__(self, *args, source=None, bound='first', **kwargs):
+        self.source = source
+        self.bound = bound
+        kwargs.setdefault('max_length', 16)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        if self.bound != 'first':
+            kwargs['bound'] = self.bound
+        if kwargs.get('max_length') == 16:
+            del kwargs['max_length']
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        # BLOB columns can't be indexed without a prefix length on MySQL
+        if connection.vendor == 'mysql':
+            return 'varbinary(16)'
+        return super().db_type(connection)
+
+    def derive(self, instance):
+        """
+        Return the packed value for an instance's current source value.
+        """
+        value = getattr(instance, self.source)
+        if value is None or value == '':
+            return None
+        if isinstance(value, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            first, last = network_range(value)
+            return last if self.bound == 'last' else first
+        return pack_ip(value)
+
+    def pre_save(self, model_instance, add):
+        if self.source is None:
+            return super().pre_save(model_instance, add)
+        value = self.derive(model_instance)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def refresh_packed_fields(instance):
+    """
+    Re-derive every PackedIPAddressField of an instance, e.g. before
+    bulk_update(). Returns the names of the fields.
+    """
+    names = []
+    for field in instance._meta.concrete_fields:
+        if isinstance(field, PackedIPAddressField) and field.source is not None:
+            setattr(instance, field.attname, field.derive(instance))
+            names.append(field.name)
+    return names
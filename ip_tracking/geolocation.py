@@ -0,0 +1,379 @@
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from .client_ip import get_client_ip_resolver
+from .fields import ip_to_int
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_GEOLOCATION_SETTINGS = {
+    'BACKEND': 'ip_tracking.geolocation.IPGeolocationAPIBackend',
+    'DATABASE_PATH': None,  # Range database file used by LocalRangeDatabaseBackend
+    'RELOAD_INTERVAL': 60,  # Seconds between checks for a recompiled database file
+    'RESOLVE_IN_REQUEST': False,  # Resolve in the middleware instead of the backfill task
+    'CACHE_TIMEOUT': 86400,  # Seconds to cache successful lookups
+    'NEGATIVE_CACHE_TIMEOUT': 300,  # Seconds to cache failed lookups
+    'SINGLE_FLIGHT_TIMEOUT': 10,  # Seconds a caller waits for an in-flight lookup of the same IP
+}
+
+
+def get_geolocation_settings():
+    """
+    Return the geolocation settings merged over the defaults.
+    """
+    return {**DEFAULT_GEOLOCATION_SETTINGS, **getattr(settings, 'IP_TRACKING_GEOLOCATION', {})}
+
+
+class GeolocationBackend:
+    """
+    Base class for geolocation backends.
+    """
+
+    # Whether results should be stored in the Django cache. Backends that are
+    # faster than a cache round trip can disable it.
+    cacheable = True
+
+    def lookup(self, ip_address):
+        """
+        Return (country, city) for the address, or None if it could not be resolved.
+        """
+        raise NotImplementedError
+
+
+class IPGeolocationAPIBackend(GeolocationBackend):
+    """
+    Resolve addresses with the remote service configured in IPGEOLOCATION_SETTINGS.
+    A single API client is created lazily and reused for every lookup.
+    """
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ipgeolocation import IPGeolocationAPI
+
+            self._client = IPGeolocationAPI()
+        return self._client
+
+    def lookup(self, ip_address):
+        geolocation_data = self.client.get_geolocation(ip_address)
+        if geolocation_data and geolocation_data.get('status') == 'success':
+            return geolocation_data.get('country_name', ''), geolocation_data.get('city', '')
+        return None
+
+
+# Range database layout (all integers big-endian):
+#   header:  magic (8s), record count (Q), string table offset (Q)
+#   records: start (QQ), end (QQ), string offset (I) -- sorted by start, non-overlapping
+#   strings: country length (H), city length (H), country utf-8, city utf-8
+RANGE_DB_MAGIC = b'IPTGEO01'
+RANGE_DB_HEADER = struct.Struct('>8sQQ')
+RANGE_DB_RECORD = struct.Struct('>QQQQI')
+RANGE_DB_STRING = struct.Struct('>HH')
+
+
+def compile_range_database(ranges, path):
+    """
+    Write a range database file from an iterable of (start_ip, end_ip, country, city).
+    Ranges must not overlap. The file is written to a temporary path and
+    atomically moved into place so running readers never see a partial file.
+    Returns the number of ranges written.
+    """
+    records = []
+    for start, end, country, city in ranges:
+        start, end = ip_to_int(start), ip_to_int(end)
+        if end < start:
+            raise ValueError(f"Range end is before start: {start}-{end}")
+        records.append((start, end, country or '', city or ''))
+    records.sort()
+
+    strings = bytearray()
+    string_offsets = {}
+    packed_records = bytearray()
+    previous_end = -1
+    for start, end, country, city in records:
+        if start <= previous_end:
+            raise ValueError(f"Overlapping ranges at {ipaddress.ip_address(start)}")
+        previous_end = end
+
+        key = (country, city)
+        if key not in string_offsets:
+            string_offsets[key] = len(strings)
+            country_bytes, city_bytes = country.encode(), city.encode()
+            strings += RANGE_DB_STRING.pack(len(country_bytes), len(city_bytes))
+            strings += country_bytes + city_bytes
+
+        packed_records += RANGE_DB_RECORD.pack(
+            start >> 64, start & 0xFFFFFFFFFFFFFFFF,
+            end >> 64, end & 0xFFFFFFFFFFFFFFFF,
+            string_offsets[key],
+        )
+
+    strings_offset = RANGE_DB_HEADER.size + len(packed_records)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(RANGE_DB_HEADER.pack(RANGE_DB_MAGIC, len(records), strings_offset))
+        f.write(packed_records)
+        f.write(strings)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+class RangeStarts:
+    """
+    Sequence view over the start column of a mapped range file, for bisect.
+    Each record must begin with its 128-bit start as two big-endian Q values.
+    """
+
+    def __init__(self, buffer, count, offset=RANGE_DB_HEADER.size, record_size=RANGE_DB_RECORD.size):
+        self._buffer = buffer
+        self._count = count
+        self._offset = offset
+        self._record_size = record_size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        offset = self._offset + index * self._record_size
+        high, low = struct.unpack_from('>QQ', self._buffer, offset)
+        return (high << 64) | low
+
+
+class RangeDatabase:
+    """
+    Read-only, memory-mapped range database.
+    Lookups binary-search the sorted ranges directly in the mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+
+        magic, self._count, self._strings_offset = RANGE_DB_HEADER.unpack_from(self._mmap, 0)
+        if magic != RANGE_DB_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not an IP range database")
+        self._starts = RangeStarts(self._mmap, self._count)
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, ip_address):
+        """
+        Return (country, city) for the address, or None if no range contains it.
+        """
+        value = ip_to_int(ip_address)
+        index = bisect_right(self._starts, value) - 1
+        if index < 0:
+            return None
+
+        _, _, end_high, end_low, string_offset = RANGE_DB_RECORD.unpack_from(
+            self._mmap, RANGE_DB_HEADER.size + index * RANGE_DB_RECORD.size
+        )
+        if value > ((end_high << 64) | end_low):
+            return None
+
+        offset = self._strings_offset + string_offset
+        country_length, city_length = RANGE_DB_STRING.unpack_from(self._mmap, offset)
+        offset += RANGE_DB_STRING.size
+        country = self._mmap[offset:offset + country_length].decode()
+        city = self._mmap[offset + country_length:offset + country_length + city_length].decode()
+        return country, city
+
+    def close(self):
+        self._mmap.close()
+
+
+class LocalRangeDatabaseBackend(GeolocationBackend):
+    """
+    Resolve addresses offline from a range database compiled with
+    `manage.py compile_geolocation_db`. The file is re-opened when it is
+    replaced on disk.
+    """
+
+    cacheable = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._database = None
+        self._checked_at = 0.0
+
+    def lookup(self, ip_address):
+        database = self._get_database()
+        result = database.lookup(ip_address)
+        if result is None:
+            # Not in the database: resolved, but no location available
+            return '', ''
+        return result
+
+    def _get_database(self):
+        config = get_geolocation_settings()
+        now = time.monotonic()
+        if self._database is not None and now - self._checked_at < config['RELOAD_INTERVAL']:
+            return self._database
+
+        with self._lock:
+            self._checked_at = now
+            path = config['DATABASE_PATH']
+            if path is None:
+                raise ValueError("IP_TRACKING_GEOLOCATION['DATABASE_PATH'] is not set")
+            if self._database is None or os.stat(path).st_mtime_ns != self._database.mtime_ns:
+                # Keep the old mapping open; in-flight lookups may still use it
+                self._database = RangeDatabase(path)
+                logger.info(f"Loaded geolocation range database {path} ({len(self._database)} ranges)")
+        return self._database
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_geolocation_backend():
+    """
+    Return the shared instance of the configured geolocation backend.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(get_geolocation_settings()['BACKEND'])()
+    return _backend
+
+
+def is_private_ip(ip_address):
+    """
+    Check if the IP address is a private/local IP that doesn't need geolocation.
+    Invalid addresses are treated as private. Classification is memoized.
+    """
+    return get_client_ip_resolver().classify(ip_address).is_private
+
+
+class _InFlightLookup:
+    """
+    A lookup in progress that other callers for the same IP can wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+_stats = {
+    'hits': 0,
+    'negative_hits': 0,
+    'misses': 0,
+    'coalesced': 0,
+    'failures': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_geolocation_stats():
+    """
+    Return a copy of this worker's geolocation lookup counters.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def resolve_geolocation(ip_address):
+    """
+    Resolve (country, city) for an IP address using the configured backend.
+    Private addresses resolve to ('', ''). Returns None if the lookup failed
+    and should be retried later.
+
+    For cacheable (remote) backends, successful lookups are cached for
+    CACHE_TIMEOUT and failures for NEGATIVE_CACHE_TIMEOUT. Concurrent misses
+    for the same IP in this worker are coalesced into a single backend call.
+    """
+    if is_private_ip(ip_address):
+        return '', ''
+
+    backend = get_geolocation_backend()
+    if not backend.cacheable:
+        _count('misses')
+        return _lookup(backend, ip_address)
+
+    config = get_geolocation_settings()
+
+    # Check cache first
+    cache_key = f"geolocation_{ip_address}"
+    cached_data = cache.get(cache_key)
+
+    if cached_data:
+        if cached_data.get('failed'):
+            _count('negative_hits')
+            return None
+        _count('hits')
+        logger.debug(f"Using cached geolocation data for {ip_address}")
+        return cached_data.get('country'), cached_data.get('city')
+
+    # Join a lookup already in flight for this IP, or become its leader
+    with _in_flight_lock:
+        in_flight = _in_flight.get(ip_address)
+        leader = in_flight is None
+        if leader:
+            in_flight = _in_flight[ip_address] = _InFlightLookup()
+
+    if not leader:
+        _count('coalesced')
+        in_flight.done.wait(config['SINGLE_FLIGHT_TIMEOUT'])
+        return in_flight.result
+
+    _count('misses')
+    try:
+        result = _lookup(backend, ip_address)
+        if result is None:
+            cache.set(cache_key, {'failed': True}, config['NEGATIVE_CACHE_TIMEOUT'])
+        else:
+            cache_data = {'country': result[0], 'city': result[1]}
+            cache.set(cache_key, cache_data, config['CACHE_TIMEOUT'])
+        in_flight.result = result
+        return result
+    finally:
+        in_flight.done.set()
+        with _in_flight_lock:
+            _in_flight.pop(ip_address, None)
+
+
+def _lookup(backend, ip_address):
+    """
+    Call the backend, logging and counting failures.
+    """
+    try:
+        geolocation_data = backend.lookup(ip_address)
+    except Exception as e:
+        _count('failures')
+        logger.error(f"Error fetching geolocation data for {ip_address}: {e}")
+        return None
+
+    if geolocation_data is None:
+        _count('failures')
+        logger.warning(f"Failed to get geolocation data for {ip_address}")
+        return None
+
+    logger.debug(f"Fetched geolocation data for {ip_address}: {geolocation_data[1]}, {geolocation_data[0]}")
+    return geolocation_data
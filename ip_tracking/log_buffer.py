@@ -0,0 +1,219 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_LOG_BUFFER_SETTINGS = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,  # Maximum number of queued log entries per worker
+    'BATCH_SIZE': 500,  # Maximum rows per bulk_create
+    'FLUSH_INTERVAL': 1.0,  # Seconds to wait before flushing a partial batch
+    'BLOCK_TIMEOUT': 0.0,  # Seconds a request may wait for queue space before dropping
+}
+
+
+def get_log_buffer_settings():
+    """
+    Return the log buffer settings merged over the defaults.
+    """
+    return {**DEFAULT_LOG_BUFFER_SETTINGS, **getattr(settings, 'IP_TRACKING_LOG_BUFFER', {})}
+
+
+class RequestLogBuffer:
+    """
+    Bounded in-process queue of RequestLog instances written in batches.
+
+    The middleware enqueues unsaved RequestLog objects and a background thread
+    writes them with bulk_create whenever BATCH_SIZE entries are waiting or
+    FLUSH_INTERVAL seconds have passed. When the queue is full the request
+    waits up to BLOCK_TIMEOUT seconds for space and then drops the entry.
+    Remaining entries are flushed when the worker exits.
+
+    An entry may carry a `process` function, which the flusher thread calls
+    with it just before it is written. The async middleware uses this for
+    the per-request work that needs the database or the cache, so none of
+    it runs on the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._pid = None
+        # Updated from request threads and the flusher thread
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'flushes': 0,
+        }
+
+    @property
+    def enabled(self):
+        return get_log_buffer_settings()['ENABLED']
+
+    def enqueue(self, request_log, block=True, process=None):
+        """
+        Queue an unsaved RequestLog for writing, and optionally a function
+        to call with it in the flusher thread before it is written.
+        Pass block=False to drop immediately instead of waiting for space.
+        Returns False if the entry was dropped because the queue is full.
+        """
+        self._ensure_started()
+        config = get_log_buffer_settings()
+        try:
+            if block and config['BLOCK_TIMEOUT'] > 0:
+                self._queue.put((request_log, process), timeout=config['BLOCK_TIMEOUT'])
+            else:
+                self._queue.put_nowait((request_log, process))
+        except queue.Full:
+            dropped = self._count('dropped')
+            # Warn on the first drop and then periodically, not once per request
+            if dropped % 1000 == 1:
+                logger.warning(f"Request log buffer full, {dropped} entries dropped so far")
+            return False
+
+        self._count('enqueued')
+        return True
+
+    @property
+    def stats(self):
+        """
+        Return a consistent copy of this worker's buffer counters.
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name, amount=1):
+        """
+        Add to a counter and return its new value.
+        """
+        with self._stats_lock:
+            self._stats[name] += amount
+            return self._stats[name]
+
+    def pending(self):
+        """
+        Return the number of entries waiting to be written.
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stop(self, timeout=10):
+        """
+        Stop the flusher thread after writing all queued entries.
+        """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        """
+        Start the flusher thread in the current process if it is not running.
+        Threads do not survive fork(), so a new one is started per worker.
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            config = get_log_buffer_settings()
+            self._queue = queue.Queue(maxsize=config['MAX_SIZE'])
+            self._stopping = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='request-log-flusher',
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self):
+        """
+        Flusher loop: collect a batch, write it, repeat until stopped and drained.
+        """
+        while True:
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+            if self._stopping.is_set() and self._queue.empty():
+                break
+        close_old_connections()
+
+    def _collect(self):
+        """
+        Collect up to BATCH_SIZE entries, waiting at most FLUSH_INTERVAL seconds.
+        """
+        config = get_log_buffer_settings()
+        batch = []
+        deadline = time.monotonic() + config['FLUSH_INTERVAL']
+
+        while len(batch) < config['BATCH_SIZE']:
+            if self._stopping.is_set():
+                # Drain without waiting during shutdown
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                # Wake up periodically to notice a shutdown request
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+
+        return batch
+
+    def _write(self, batch):
+        """
+        Process a batch of (RequestLog, process) entries and write the
+        RequestLog instances with a single bulk_create.
+        """
+        from .counters import increment_requests
+        from .models import RequestLog
+
+        close_old_connections()
+        for request_log, process in batch:
+            if process is None:
+                continue
+            try:
+                process(request_log)
+            except Exception as e:
+                logger.error(f"Error processing buffered request log: {e}")
+
+        try:
+            RequestLog.objects.bulk_create([request_log for request_log, _ in batch])
+            self._count('written', len(batch))
+            self._count('flushes')
+        except Exception as e:
+            self._count('failed', len(batch))
+            logger.error(f"Error writing {len(batch)} buffered request logs: {e}")
+            return
+
+        try:
+            increment_requests(int(request_log.timestamp.timestamp()) for request_log, _ in batch)
+        except Exception as e:
+            logger.error(f"Error updating the request counter: {e}")
+
+
+# Shared per-process buffer used by the middleware
+request_log_buffer = RequestLogBuffer()
+atexit.register(request_log_buffer.stop)
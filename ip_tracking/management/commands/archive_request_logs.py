@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from ip_tracking.archive import archive_request_logs, get_retention_settings
+
+
+class Command(BaseCommand):
+    help = 'Archive request logs older than the retention window to compressed daily segments and delete them'
+
+    def add_arguments(self, parser):
+        config = get_retention_settings()
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=config['DAYS'],
+            help=f'Retention window in days (default: {config["DAYS"]})'
+        )
+        parser.add_argument(
+            '--dir',
+            type=str,
+            default=str(config['ARCHIVE_DIR']),
+            help=f'Archive directory (default: {config["ARCHIVE_DIR"]})'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=config['CHUNK_SIZE'],
+            help=f'Rows per read chunk and per DELETE (default: {config["CHUNK_SIZE"]})'
+        )
+
+    def handle(self, *args, **options):
+        segments = archive_request_logs(
+            retention_days=options['days'],
+            archive_dir=options['dir'],
+            chunk_size=options['chunk_size']
+        )
+
+        if not segments:
+            self.stdout.write(
+                self.style.WARNING('No request logs older than the retention window to archive.')
+            )
+            return
+
+        for path, count in segments:
+            self.stdout.write(f'{path}: {count} rows')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Archived {sum(count for _, count in segments)} request logs into {len(segments)} segment(s).'
+            )
+        )
@@ -0,0 +1,78 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ip_tracking.fields import pack_ip, refresh_packed_fields
+from ip_tracking.models import BlockedIP, RequestLog
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill in the packed IP columns of request logs and blocked IPs. Migration 0012 fills them in '
+        'on upgrade; use this for rows changed with QuerySet.update() or bulk_update() since'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Rows read and updated per transaction (default: 5000)'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every row, not only rows without a packed value'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        blocked = self.backfill_blocked_ips(options['chunk_size'], options['all'])
+        logs = self.backfill_request_logs(options['chunk_size'], options['all'])
+
+        elapsed = time.monotonic() - started
+        rate = (logs + blocked) / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Backfilled {logs} request logs and {blocked} blocked IPs '
+                f'in {elapsed:.1f}s ({rate:.0f}/s).'
+            )
+        )
+
+    def backfill_request_logs(self, chunk_size, recompute):
+        """
+        Walk RequestLog by id and write each chunk with one bulk_update.
+        Rows that are inserted meanwhile are packed on save.
+        """
+        queryset = RequestLog.objects.order_by('id')
+        if not recompute:
+            queryset = queryset.filter(ip_packed__isnull=True)
+
+        count = 0
+        last_id = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).values_list('id', 'ip_address')[:chunk_size])
+            if not rows:
+                break
+            with transaction.atomic():
+                RequestLog.objects.bulk_update(
+                    [RequestLog(id=row_id, ip_packed=pack_ip(ip_address)) for row_id, ip_address in rows],
+                    ['ip_packed']
+                )
+            count += len(rows)
+            last_id = rows[-1][0]
+            self.stdout.write(f'Request logs: {count} rows (up to id {last_id})')
+        return count
+
+    def backfill_blocked_ips(self, chunk_size, recompute):
+        """
+        Recompute the packed network bounds of BlockedIP rows.
+        """
+        queryset = BlockedIP.objects.only('id', 'ip_address', 'prefix_length').order_by('id')
+        if not recompute:
+            queryset = queryset.filter(network_start__isnull=True)
+
+        blocked_ips = list(queryset)
+        for blocked_ip in blocked_ips:
+            refresh_packed_fields(blocked_ip)
+        BlockedIP.objects.bulk_update(blocked_ips, ['network_start', 'network_end'], batch_size=chunk_size)
+        return len(blocked_ips)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils.deprecation import MiddlewareMixin
+from ip_tracking.log_buffer import request_log_buffer
+from ip_tracking.middleware import IPLoggingMiddleware
+from ip_tracking.models import RequestLog
+
+
+class LegacyIPLoggingMiddleware(MiddlewareMixin):
+    """
+    IPLoggingMiddleware driven through MiddlewareMixin, as it was before the
+    native async path existed: under ASGI every request runs process_request
+    in a thread via sync_to_async.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.ip_logging = IPLoggingMiddleware(get_response)
+
+    def process_request(self, request):
+        return self.ip_logging.process_request(request)
+
+
+MIDDLEWARE_VARIANTS = {
+    'legacy': 'ip_tracking.management.commands.benchmark_middleware.LegacyIPLoggingMiddleware',
+    'native': 'ip_tracking.middleware.IPLoggingMiddleware',
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark requests/sec of the IP logging middleware under ASGI (sync-adapted vs native async)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            help='Number of requests per variant (default: 2000)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Number of concurrent in-flight requests (default: 50)'
+        )
+        parser.add_argument(
+            '--path',
+            type=str,
+            default='/test/',
+            help='Request path (default: /test/)'
+        )
+        parser.add_argument(
+            '--keep-logs',
+            action='store_true',
+            help='Keep the RequestLog rows written during the benchmark'
+        )
+
+    def handle(self, *args, **options):
+        first_new_id = (RequestLog.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+        self.stdout.write(
+            f'Benchmarking {options["requests"]} requests to {options["path"]} '
+            f'with concurrency {options["concurrency"]}'
+        )
+        self.stdout.write('-' * 60)
+        self.stdout.write(f'{"Middleware":<12} {"Requests/sec":>14} {"Mean latency (ms)":>20}')
+        self.stdout.write('-' * 60)
+
+        for name, middleware_path in MIDDLEWARE_VARIANTS.items():
+            # Swap the IP logging middleware for the variant under test
+            middleware = [
+                middleware_path if entry == MIDDLEWARE_VARIANTS['native'] else entry
+                for entry in settings.MIDDLEWARE
+            ]
+            if middleware_path not in middleware:
+                middleware.insert(0, middleware_path)
+
+            with override_settings(MIDDLEWARE=middleware):
+                application = get_asgi_application()
+                elapsed, latencies = asyncio.run(self.run_load(application, options))
+
+            rps = options['requests'] / elapsed if elapsed else 0
+            mean_latency = sum(latencies) / len(latencies) * 1000 if latencies else 0
+            self.stdout.write(f'{name:<12} {rps:>14.1f} {mean_latency:>20.2f}')
+
+        # The native variant hands its writes to the log buffer; wait for them
+        request_log_buffer.stop()
+        if not options['keep_logs']:
+            RequestLog.objects.filter(id__gte=first_new_id).delete()
+
+    async def run_load(self, application, options):
+        """
+        Drive the ASGI application the way an ASGI server would, keeping
+        `concurrency` requests in flight until `requests` have completed.
+        """
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies = []
+
+        async def one_request(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await self.asgi_request(application, options['path'], i)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request(i) for i in range(options['requests'])))
+        return time.perf_counter() - start, latencies
+
+    async def asgi_request(self, application, path, i):
+        """
+        Send one HTTP GET through the ASGI application from a distinct client address.
+        """
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'headers': [(b'host', b'localhost')],
+            'client': (f'198.51.100.{i % 250 + 1}', 40000 + i % 20000),
+            'server': ('localhost', 80),
+        }
+        request_sent = False
+        disconnect = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Only disconnect once the response has been sent
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                disconnect.set()
+
+        await application(scope, receive, send)
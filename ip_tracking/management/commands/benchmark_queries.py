@@ -0,0 +1,244 @@
+import ipaddress
+import random
+import time
+from datetime import datetime, time as datetime_time, timedelta, timezone as datetime_timezone
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from ip_tracking import rollups
+from ip_tracking.archive import ARCHIVE_FIELDS
+from ip_tracking.models import RequestLog, RequestPath, RequestRollup
+from ip_tracking.views import LOGS_API_DEFAULT_LIMIT, LOGS_API_FIELDS
+
+
+SENSITIVE_PATHS = ['/admin/', '/login/', '/sensitive-data/', '/admin-dashboard/']
+OTHER_PATHS = ['/', '/test/', '/logs/', '/logout/', '/static/app.css', '/favicon.ico']
+COUNTRIES = ['United States', 'Germany', 'France', 'Brazil', 'India', 'Japan', 'Nigeria', '', None]
+
+# Queries timed with count() rather than by fetching their rows
+COUNT_QUERIES = {'rows not rolled up (windowed_total)'}
+
+
+class Rollback(Exception):
+    """Raised to roll back the synthetic data once the benchmark is done."""
+
+
+class Command(BaseCommand):
+    help = 'Print query plans and timings for the ip_tracking task and logs API queries on synthetic RequestLog data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'rows',
+            type=int,
+            nargs='*',
+            default=[1000000, 10000000],
+            help='Table sizes to benchmark (default: 1000000 10000000)'
+        )
+        parser.add_argument(
+            '--ips',
+            type=int,
+            default=50000,
+            help='Number of distinct client IPs in the synthetic data (default: 50000)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs per query; the best time is reported (default: 3)'
+        )
+        parser.add_argument(
+            '--no-compare',
+            action='store_true',
+            help='Skip the second pass with the RequestLog indexes dropped'
+        )
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            self.stdout.write(self.style.SUCCESS(f'=== {rows} rows ==='))
+            try:
+                # Everything happens in one transaction that is rolled back,
+                # so the synthetic rows and dropped indexes never persist
+                with transaction.atomic():
+                    self.populate(rows, options['ips'])
+                    self.run_queries('with indexes', options['repeat'])
+                    if not options['no_compare']:
+                        self.drop_indexes()
+                        self.run_queries('without indexes', options['repeat'])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def populate(self, rows, ip_count):
+        """
+        Insert synthetic request logs spread over the last 48 hours.
+        """
+        started = time.monotonic()
+        now = timezone.now()
+        ips = [f'{random.randint(1, 223)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}' for _ in range(ip_count)]
+        routes = {path: RequestPath.objects.get_or_create(route=path)[0] for path in SENSITIVE_PATHS + OTHER_PATHS}
+        paths = SENSITIVE_PATHS + OTHER_PATHS * 10
+        batch_size = 10000
+
+        for offset in range(0, rows, batch_size):
+            RequestLog.objects.bulk_create(
+                [
+                    RequestLog(
+                        ip_address=random.choice(ips),
+                        route=routes[random.choice(paths)],
+                        timestamp=now - timedelta(seconds=random.randint(0, 48 * 3600)),
+                        country=random.choice(COUNTRIES),
+                        city=None,
+                    )
+                    for _ in range(min(batch_size, rows - offset))
+                ],
+                batch_size=batch_size,
+            )
+
+        self.stdout.write(f'Inserted {rows} rows in {time.monotonic() - started:.1f}s')
+
+        # Fold the settled rows into the hourly rollup, as the tasks do
+        # before reading a window, so windows read the rollup
+        started = time.monotonic()
+        rolled_up = 0
+        while True:
+            processed = rollups.update_request_rollups()
+            if not processed:
+                break
+            rolled_up += processed
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {RequestLog._meta.db_table}')
+            cursor.execute(f'ANALYZE {RequestRollup._meta.db_table}')
+        self.stdout.write(f'Rolled up {rolled_up} rows in {time.monotonic() - started:.1f}s')
+
+    def drop_indexes(self):
+        """
+        Drop the RequestLog Meta.indexes inside the current transaction
+        (transactional DDL, as on SQLite and PostgreSQL).
+        """
+        with connection.cursor() as cursor:
+            for index in RequestLog._meta.indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+            cursor.execute(f'ANALYZE {RequestLog._meta.db_table}')
+
+    def queries(self):
+        """
+        The RequestLog and RequestRollup queries issued by the Celery tasks
+        and the logs API, keyed by description.
+        """
+        now = timezone.now()
+        one_hour_ago = now - timedelta(hours=1)
+        last_24_hours = now - timedelta(hours=24)
+        config = rollups.get_rollup_settings()
+        settled_before = now - timedelta(seconds=config['SETTLE_SECONDS'])
+        first_id, sample_ip = RequestLog.objects.order_by('id').values_list('id', 'ip_address').first()
+        sample_network = ipaddress.ip_network(f'{sample_ip}/16', strict=False)
+        cursor_timestamp, cursor_id = (
+            RequestLog.objects
+            .order_by('-timestamp', '-id')
+            .values_list('timestamp', 'id')[LOGS_API_DEFAULT_LIMIT * 100]
+        )
+        sensitive_routes = list(RequestPath.objects.filter(route__in=SENSITIVE_PATHS).values_list('id', flat=True))
+        rolled_up_1h, (head_1h, tail_1h) = rollups.window_sources(one_hour_ago)
+        rolled_up_24h, _ = rollups.window_sources(last_24_hours)
+        yesterday = datetime.combine(
+            now.astimezone(datetime_timezone.utc).date() - timedelta(days=1),
+            datetime_time.min,
+            tzinfo=datetime_timezone.utc
+        )
+
+        return {
+            'first unsettled row (update_request_rollups)': (
+                RequestLog.objects
+                .filter(id__gte=first_id, timestamp__gte=settled_before)
+                .order_by('id')
+                .values_list('id', flat=True)[:1]
+            ),
+            'rollup batch ids (update_request_rollups)': (
+                RequestLog.objects
+                .filter(id__gte=first_id)
+                .order_by('id')
+                .values('id')[:config['BATCH_SIZE']]
+            ),
+            'rollup batch counts (update_request_rollups)': (
+                RequestLog.objects
+                .filter(id__gte=first_id, id__lt=first_id + config['BATCH_SIZE'])
+                .annotate(hour=TruncHour('timestamp'))
+                .values('hour', 'ip_address', 'route', 'country')
+                .annotate(count=Count('id'))
+                .order_by()
+            ),
+            'IP activity, partial hour (detect_suspicious_ips)': (
+                head_1h
+                .values('ip_address')
+                .annotate(total=Count('id'), matched=Count('id', filter=Q(route__in=sensitive_routes)))
+                .order_by()
+            ),
+            'IP activity, whole hours (detect_suspicious_ips)': (
+                rolled_up_1h
+                .values('ip_address')
+                .annotate(total=Sum('count'), matched=Sum('count', filter=Q(route__in=sensitive_routes)))
+                .order_by()
+            ),
+            'rows not rolled up (windowed_total)': tail_1h,
+            'top countries, whole hours (24h)': (
+                rolled_up_24h
+                .values('country')
+                .annotate(total=Sum('count'))
+                .order_by()
+            ),
+            'unresolved IPs (backfill_geolocation)': (
+                RequestLog.objects
+                .filter(country__isnull=True, ip_address__gt=sample_ip)
+                .order_by('ip_address')
+                .values_list('ip_address', flat=True)
+                .distinct()[:500]
+            ),
+            'archive one day (archive_request_logs)': (
+                RequestLog.objects
+                .filter(
+                    timestamp__gte=yesterday,
+                    timestamp__lt=yesterday + timedelta(days=1),
+                    id__lte=rollups.get_watermark()
+                )
+                .order_by('id')
+                .values(*ARCHIVE_FIELDS)[:10000]
+            ),
+            'logs API first page': (
+                RequestLog.objects
+                .order_by('-timestamp', '-id')
+                .values(*LOGS_API_FIELDS)[:LOGS_API_DEFAULT_LIMIT + 1]
+            ),
+            'logs API page 100 (keyset cursor)': (
+                RequestLog.objects
+                .filter(Q(timestamp__lt=cursor_timestamp) | Q(timestamp=cursor_timestamp, id__lt=cursor_id))
+                .order_by('-timestamp', '-id')
+                .values(*LOGS_API_FIELDS)[:LOGS_API_DEFAULT_LIMIT + 1]
+            ),
+            'logs API by network (/16)': (
+                RequestLog.objects
+                .in_network(sample_network)
+                .order_by('-timestamp', '-id')
+                .values(*LOGS_API_FIELDS)[:LOGS_API_DEFAULT_LIMIT + 1]
+            ),
+            'latest 50 logs': RequestLog.objects.select_related('route')[:50],
+        }
+
+    def run_queries(self, label, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'--- {label} ---'))
+        for name, queryset in self.queries().items():
+            if name in COUNT_QUERIES:
+                run = queryset.count
+            else:
+                run = lambda qs=queryset: list(qs)  # noqa: E731
+
+            best = min(self.time_call(run) for _ in range(repeat))
+            self.stdout.write(self.style.SUCCESS(f'{name}: {best * 1000:.1f} ms'))
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f'    {line}')
+
+    def time_call(self, func):
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
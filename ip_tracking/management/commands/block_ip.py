@@ -1,17 +1,18 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from ip_tracking.blocklist import parse_ttl
 from ip_tracking.models import BlockedIP
-import ipaddress
 
 
 class Command(BaseCommand):
-    help = 'Add an IP address to the blacklist'
+    help = 'Add an IP address or CIDR network to the blacklist'
 
     def add_arguments(self, parser):
         parser.add_argument(
             'ip_address',
             type=str,
-            help='IP address to block'
+            help='IP address or CIDR network (e.g. 203.0.113.0/24) to block'
         )
         parser.add_argument(
             '--reason',
@@ -24,37 +25,57 @@ class Command(BaseCommand):
             action='store_true',
             help='Add the IP as inactive (not blocked)'
         )
+        parser.add_argument(
+            '--ttl',
+            type=str,
+            default=None,
+            help='Block only for this long, e.g. 3600, 30m, 12h or 7d (default: permanent)'
+        )
 
     def handle(self, *args, **options):
-        ip_address = options['ip_address']
         reason = options['reason']
         is_active = not options['inactive']
 
-        # Validate IP address format
+        expires_at = None
+        if options['ttl']:
+            try:
+                expires_at = timezone.now() + parse_ttl(options['ttl'])
+            except ValueError:
+                raise CommandError(f'Invalid --ttl value: {options["ttl"]}')
+
+        # Validate IP address or network format
         try:
-            ipaddress.ip_address(ip_address)
+            ip_address, prefix_length = BlockedIP.parse_network(options['ip_address'])
         except ValueError:
-            raise CommandError(f'Invalid IP address format: {ip_address}')
+            raise CommandError(f'Invalid IP address or network format: {options["ip_address"]}')
+
+        if prefix_length is not None:
+            ip_address_display = f'{ip_address}/{prefix_length}'
+        else:
+            ip_address_display = ip_address
 
-        # Check if IP is already blocked
-        if BlockedIP.objects.filter(ip_address=ip_address).exists():
-            existing = BlockedIP.objects.get(ip_address=ip_address)
-            if existing.is_active == is_active:
+        # Check if this exact address or network is already blocked; other
+        # networks with the same base address are separate blocks
+        existing = BlockedIP.objects.filter(ip_address=ip_address, prefix_length=prefix_length).first()
+        if existing is not None:
+            if (existing.is_active == is_active
+                    and existing.expires_at is None and expires_at is None):
                 status = "active" if is_active else "inactive"
                 self.stdout.write(
                     self.style.WARNING(
-                        f'IP {ip_address} is already {status} in the blacklist.'
+                        f'{ip_address_display} is already {status} in the blacklist.'
                     )
                 )
             else:
                 # Update existing record
                 existing.is_active = is_active
+                existing.expires_at = expires_at
                 existing.reason = reason or existing.reason
                 existing.save()
                 status = "activated" if is_active else "deactivated"
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f'Successfully {status} IP {ip_address} in the blacklist.'
+                        f'Successfully {status} {ip_address_display} in the blacklist.'
                     )
                 )
         else:
@@ -62,17 +83,21 @@ class Command(BaseCommand):
             try:
                 blocked_ip = BlockedIP.objects.create(
                     ip_address=ip_address,
+                    prefix_length=prefix_length,
                     reason=reason,
-                    is_active=is_active
+                    is_active=is_active,
+                    expires_at=expires_at
                 )
                 status = "blocked" if is_active else "added as inactive"
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f'Successfully {status} IP {ip_address} in the blacklist.'
+                        f'Successfully {status} {ip_address_display} in the blacklist.'
                     )
                 )
                 if reason:
                     self.stdout.write(f'Reason: {reason}')
+                if expires_at:
+                    self.stdout.write(f'Expires at: {expires_at:%Y-%m-%d %H:%M:%S %Z}')
             except ValidationError as e:
                 raise CommandError(f'Validation error: {e}')
             except Exception as e:
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.blocklist import get_blocklist_settings
+from ip_tracking.compiled_blocklist import compile_blocklist
+
+
+class Command(BaseCommand):
+    help = 'Compile the active blocklist into a memory-mappable file shared by all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help="Output file (default: IP_TRACKING_BLOCKLIST['COMPILED_PATH'])"
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or get_blocklist_settings()['COMPILED_PATH']
+        if not output:
+            raise CommandError(
+                "No output path given and IP_TRACKING_BLOCKLIST['COMPILED_PATH'] is not set."
+            )
+
+        started = time.monotonic()
+        try:
+            generation, count = compile_blocklist(output)
+        except OSError as e:
+            raise CommandError(f'Could not write {output}: {e}')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Compiled blocklist generation {generation} ({count} ranges) into {output} in {elapsed:.1f}s.'
+            )
+        )
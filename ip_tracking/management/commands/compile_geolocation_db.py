@@ -0,0 +1,74 @@
+import csv
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.geolocation import compile_range_database, get_geolocation_settings, ip_to_int
+
+
+class Command(BaseCommand):
+    help = 'Compile a CSV dump of IP ranges into a memory-mappable geolocation database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'csv_path',
+            type=str,
+            help='CSV file with start IP, end IP, country and city columns'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help="Output file (default: IP_TRACKING_GEOLOCATION['DATABASE_PATH'])"
+        )
+        parser.add_argument(
+            '--columns',
+            type=str,
+            default='0,1,2,3',
+            help='Zero-based column indexes of start,end,country,city (default: 0,1,2,3)'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or get_geolocation_settings()['DATABASE_PATH']
+        if not output:
+            raise CommandError(
+                "No output path given and IP_TRACKING_GEOLOCATION['DATABASE_PATH'] is not set."
+            )
+
+        try:
+            start_col, end_col, country_col, city_col = (
+                int(column) for column in options['columns'].split(',')
+            )
+        except ValueError:
+            raise CommandError(f'Invalid --columns value: {options["columns"]}')
+
+        started = time.monotonic()
+        try:
+            with open(options['csv_path'], newline='', encoding='utf-8') as f:
+                ranges = self.read_ranges(csv.reader(f), start_col, end_col, country_col, city_col)
+                count = compile_range_database(ranges, output)
+        except OSError as e:
+            raise CommandError(f'Could not read {options["csv_path"]}: {e}')
+        except ValueError as e:
+            raise CommandError(f'Invalid range data: {e}')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(f'Compiled {count} ranges into {output} in {elapsed:.1f}s.')
+        )
+
+    def read_ranges(self, reader, start_col, end_col, country_col, city_col):
+        """
+        Yield (start, end, country, city) rows, skipping a header row if present.
+        Start and end may be IP addresses or IPv4 integers.
+        """
+        for line_number, row in enumerate(reader, start=1):
+            if not row:
+                continue
+            try:
+                ip_to_int(row[start_col].strip())
+            except (ValueError, IndexError):
+                if line_number == 1:
+                    continue  # Header row
+                raise ValueError(f'line {line_number}: invalid start address {row!r}')
+
+            city = row[city_col].strip() if len(row) > city_col else ''
+            yield row[start_col].strip(), row[end_col].strip(), row[country_col].strip(), city
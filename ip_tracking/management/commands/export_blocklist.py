@@ -0,0 +1,67 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from ip_tracking.models import BlockedIP
+
+
+class Command(BaseCommand):
+    help = 'Stream the blacklist to a file or stdout, one IP address or CIDR network per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            type=str,
+            nargs='?',
+            default='-',
+            help="Output file ('-' or omitted for stdout)"
+        )
+        parser.add_argument(
+            '--include-inactive',
+            action='store_true',
+            help='Also export inactive and expired entries'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Rows fetched from the database per round trip (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        queryset = BlockedIP.objects.order_by('id')
+        if not options['include_inactive']:
+            queryset = queryset.filter(is_active=True).filter(
+                Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+            )
+        rows = queryset.values_list('ip_address', 'prefix_length').iterator(chunk_size=options['chunk_size'])
+
+        started = time.monotonic()
+        try:
+            if options['path'] == '-':
+                count = self.write_rows(rows, self.stdout)
+            else:
+                with open(options['path'], 'w', encoding='utf-8') as f:
+                    count = self.write_rows(rows, f)
+        except OSError as e:
+            raise CommandError(f'Could not write {options["path"]}: {e}')
+
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed else 0
+        # Keep stdout clean for the entries themselves
+        self.stderr.write(
+            self.style.SUCCESS(f'Exported {count} entries in {elapsed:.1f}s ({rate:.0f}/s).')
+        )
+
+    def write_rows(self, rows, output):
+        """
+        Write one entry per line and return the number written.
+        """
+        count = 0
+        for ip_address, prefix_length in rows:
+            if prefix_length is None:
+                output.write(f'{ip_address}\n')
+            else:
+                output.write(f'{ip_address}/{prefix_length}\n')
+            count += 1
+        return count
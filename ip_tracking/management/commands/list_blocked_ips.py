@@ -1,7 +1,13 @@
-from django.core.management.base import BaseCommand
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 from ip_tracking.models import BlockedIP
 
 
+FIELDS = ['id', 'ip_address', 'prefix_length', 'is_active', 'reason', 'created_at', 'expires_at']
+
+
 class Command(BaseCommand):
     help = 'List all blocked IP addresses'
 
@@ -16,43 +22,120 @@ class Command(BaseCommand):
             action='store_true',
             help='Show only inactive blocked IPs'
         )
+        parser.add_argument(
+            '--format',
+            choices=['table', 'json', 'csv'],
+            default='table',
+            help='Output format (default: table)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Show at most this many entries'
+        )
+        parser.add_argument(
+            '--after',
+            type=int,
+            default=None,
+            help='Only show entries with an ID greater than this (for paging with --limit)'
+        )
 
     def handle(self, *args, **options):
+        if options['limit'] is not None and options['limit'] <= 0:
+            raise CommandError(f'Invalid --limit value: {options["limit"]} (must be a positive integer)')
+
         active_only = options['active_only']
         inactive_only = options['inactive_only']
 
-        # Build queryset based on options
-        queryset = BlockedIP.objects.all()
-        
+        # Build queryset based on options, ordered by ID for keyset paging
+        queryset = BlockedIP.objects.order_by('id')
+
         if active_only and not inactive_only:
             queryset = queryset.filter(is_active=True)
         elif inactive_only and not active_only:
             queryset = queryset.filter(is_active=False)
 
-        blocked_ips = queryset.order_by('-created_at')
+        if options['after'] is not None:
+            queryset = queryset.filter(id__gt=options['after'])
+        if options['limit'] is not None:
+            queryset = queryset[:options['limit']]
+
+        # One query, streamed without building model instances
+        rows = queryset.values_list(*FIELDS).iterator(chunk_size=2000)
 
-        if not blocked_ips.exists():
+        write = getattr(self, f'write_{options["format"]}')
+        count, last_id = write(rows)
+
+        if options['format'] != 'table':
+            return
+        if count == 0:
             self.stdout.write(
                 self.style.WARNING('No blocked IPs found.')
             )
-            return
+        elif options['limit'] is not None and count == options['limit']:
+            self.stdout.write(f'Next page: --after {last_id}')
+
+    def write_table(self, rows):
+        now = timezone.now()
+        count = 0
+        last_id = None
+        for entry_id, ip_address, prefix_length, is_active, reason, created_at, expires_at in rows:
+            if count == 0:
+                # Display header
+                self.stdout.write('-' * 108)
+                self.stdout.write(
+                    f'{"ID":<7} {"IP Address":<18} {"Status":<8} {"Reason":<30} {"Created At":<19} {"Expires At"}'
+                )
+                self.stdout.write('-' * 108)
+
+            if not is_active:
+                status = "Inactive"
+            elif expires_at is not None and expires_at <= now:
+                status = "Expired"
+            else:
+                status = "Active"
+            cidr = ip_address if prefix_length is None else f'{ip_address}/{prefix_length}'
+            reason = reason or "No reason provided"
+            created_at = created_at.strftime('%Y-%m-%d %H:%M:%S')
+            expires_at = expires_at.strftime('%Y-%m-%d %H:%M:%S') if expires_at else "Never"
 
-        # Display header
-        self.stdout.write(
-            self.style.SUCCESS(f'Found {blocked_ips.count()} blocked IP(s):')
-        )
-        self.stdout.write('-' * 80)
-        self.stdout.write(
-            f'{"IP Address":<15} {"Status":<8} {"Reason":<30} {"Created At"}'
-        )
-        self.stdout.write('-' * 80)
-
-        # Display each blocked IP
-        for blocked_ip in blocked_ips:
-            status = "Active" if blocked_ip.is_active else "Inactive"
-            reason = blocked_ip.reason or "No reason provided"
-            created_at = blocked_ip.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            
             self.stdout.write(
-                f'{blocked_ip.ip_address:<15} {status:<8} {reason:<30} {created_at}'
+                f'{entry_id:<7} {cidr:<18} {status:<8} {reason:<30} {created_at:<19} {expires_at}'
             )
+            count += 1
+            last_id = entry_id
+
+        if count:
+            self.stdout.write('-' * 108)
+            self.stdout.write(self.style.SUCCESS(f'Listed {count} blocked IP(s).'))
+        return count, last_id
+
+    def write_json(self, rows):
+        """
+        Write a JSON array, one entry at a time.
+        """
+        count = 0
+        last_id = None
+        self.stdout.write('[', ending='')
+        for row in rows:
+            entry = dict(zip(FIELDS, row))
+            entry['created_at'] = entry['created_at'].isoformat()
+            if entry['expires_at'] is not None:
+                entry['expires_at'] = entry['expires_at'].isoformat()
+            self.stdout.write(('\n' if count == 0 else ',\n') + json.dumps(entry), ending='')
+            count += 1
+            last_id = entry['id']
+        self.stdout.write('\n]')
+        return count, last_id
+
+    def write_csv(self, rows):
+        count = 0
+        last_id = None
+        writer = csv.writer(self.stdout, lineterminator='\n')
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow(value.isoformat() if hasattr(value, 'isoformat') else value for value in row)
+            count += 1
+            last_id = row[0]
+        return count, last_id
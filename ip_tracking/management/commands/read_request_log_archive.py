@@ -0,0 +1,46 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.archive import query_segment, restore_segment
+
+
+class Command(BaseCommand):
+    help = 'Query an archived request log segment, or restore it into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'segment',
+            type=str,
+            help='Path to a requestlog-YYYY-MM-DD.jsonl.gz segment'
+        )
+        parser.add_argument(
+            '--ip',
+            type=str,
+            default=None,
+            help='Only show rows from this IP address'
+        )
+        parser.add_argument(
+            '--path-prefix',
+            type=str,
+            default=None,
+            help='Only show rows whose route (or raw path, for older segments) starts with this prefix'
+        )
+        parser.add_argument(
+            '--restore',
+            action='store_true',
+            help='Insert the segment rows back into RequestLog instead of printing them'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options['restore']:
+                count = restore_segment(options['segment'])
+                self.stdout.write(
+                    self.style.SUCCESS(f'Restored {count} request logs from {options["segment"]}.')
+                )
+                return
+
+            for row in query_segment(options['segment'], options['ip'], options['path_prefix']):
+                row['timestamp'] = row['timestamp'].isoformat()
+                self.stdout.write(json.dumps(row))
+        except OSError as e:
+            raise CommandError(f'Could not read {options["segment"]}: {e}')
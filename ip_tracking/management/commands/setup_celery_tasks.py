@@ -121,6 +121,160 @@ class Command(BaseCommand):
                 self.style.WARNING('Security report task already exists')
             )
         
+        # Create geolocation backfill task (run every minute)
+        minutely_schedule, created = CrontabSchedule.objects.get_or_create(
+            minute='*',  # Every minute
+            hour='*',
+            day_of_week='*',
+            day_of_month='*',
+            month_of_year='*',
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created minutely schedule')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Minutely schedule already exists')
+            )
+        
+        backfill_task, created = PeriodicTask.objects.get_or_create(
+            name='Backfill Geolocation',
+            defaults={
+                'task': 'ip_tracking.tasks.backfill_geolocation',
+                'crontab': minutely_schedule,
+                'enabled': True,
+                'kwargs': json.dumps({}),
+            }
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created geolocation backfill task')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Geolocation backfill task already exists')
+            )
+        
+        # Deactivate expired temporary blocks (every minute)
+        expire_task, created = PeriodicTask.objects.get_or_create(
+            name='Expire Blocked IPs',
+            defaults={
+                'task': 'ip_tracking.tasks.expire_blocked_ips',
+                'crontab': minutely_schedule,
+                'enabled': True,
+                'kwargs': json.dumps({}),
+            }
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created blocked IP expiry task')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Blocked IP expiry task already exists')
+            )
+        
+        # Create request rollup task (run every 5 minutes)
+        rollup_schedule, created = CrontabSchedule.objects.get_or_create(
+            minute='*/5',  # Every 5 minutes
+            hour='*',
+            day_of_week='*',
+            day_of_month='*',
+            month_of_year='*',
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created rollup schedule')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Rollup schedule already exists')
+            )
+        
+        rollup_task, created = PeriodicTask.objects.get_or_create(
+            name='Update Request Rollups',
+            defaults={
+                'task': 'ip_tracking.tasks.update_request_rollups',
+                'crontab': rollup_schedule,
+                'enabled': True,
+                'kwargs': json.dumps({}),
+            }
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created request rollup task')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Request rollup task already exists')
+            )
+        
+        # Reconcile dashboard counters (every 5 minutes, reusing the rollup schedule)
+        counters_task, created = PeriodicTask.objects.get_or_create(
+            name='Reconcile Counters',
+            defaults={
+                'task': 'ip_tracking.tasks.reconcile_counters',
+                'crontab': rollup_schedule,
+                'enabled': True,
+                'kwargs': json.dumps({}),
+            }
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created counter reconciliation task')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Counter reconciliation task already exists')
+            )
+        
+        # Create request log archival task (daily, reusing the midnight schedule)
+        archive_task, created = PeriodicTask.objects.get_or_create(
+            name='Archive Old Request Logs',
+            defaults={
+                'task': 'ip_tracking.tasks.archive_old_request_logs',
+                'crontab': daily_schedule,
+                'enabled': True,
+                'kwargs': json.dumps({}),
+            }
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created request log archival task')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Request log archival task already exists')
+            )
+        
+        # Create heavy-hitter sketch cleanup task (hourly)
+        sketch_task, created = PeriodicTask.objects.get_or_create(
+            name='Cleanup Old Sketches',
+            defaults={
+                'task': 'ip_tracking.tasks.cleanup_old_sketches',
+                'crontab': hourly_schedule,
+                'enabled': True,
+                'kwargs': json.dumps({}),
+            }
+        )
+        
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS('Created sketch cleanup task')
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING('Sketch cleanup task already exists')
+            )
+        
         self.stdout.write(
             self.style.SUCCESS('Celery periodic tasks setup completed!')
         )
@@ -9,7 +9,7 @@ class Command(BaseCommand):
         parser.add_argument(
             'ip_address',
             type=str,
-            help='IP address to unblock'
+            help='IP address or CIDR network to unblock'
         )
         parser.add_argument(
             '--delete',
@@ -18,24 +18,28 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        ip_address = options['ip_address']
         delete = options['delete']
 
         try:
-            blocked_ip = BlockedIP.objects.get(ip_address=ip_address)
+            ip_address, prefix_length = BlockedIP.parse_network(options['ip_address'])
+        except ValueError:
+            raise CommandError(f'Invalid IP address or network format: {options["ip_address"]}')
+
+        try:
+            blocked_ip = BlockedIP.objects.get(ip_address=ip_address, prefix_length=prefix_length)
             
             if delete:
                 blocked_ip.delete()
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f'Successfully deleted IP {ip_address} from the blacklist.'
+                        f'Successfully deleted {blocked_ip.cidr} from the blacklist.'
                     )
                 )
             else:
                 if not blocked_ip.is_active:
                     self.stdout.write(
                         self.style.WARNING(
-                            f'IP {ip_address} is already inactive in the blacklist.'
+                            f'{blocked_ip.cidr} is already inactive in the blacklist.'
                         )
                     )
                 else:
@@ -43,10 +47,10 @@ class Command(BaseCommand):
                     blocked_ip.save()
                     self.stdout.write(
                         self.style.SUCCESS(
-                            f'Successfully deactivated IP {ip_address} in the blacklist.'
+                            f'Successfully deactivated {blocked_ip.cidr} in the blacklist.'
                         )
                     )
         except BlockedIP.DoesNotExist:
-            raise CommandError(f'IP {ip_address} is not in the blacklist.')
+            raise CommandError(f'{options["ip_address"]} is not in the blacklist.')
         except Exception as e:
             raise CommandError(f'Unexpected error: {e}')
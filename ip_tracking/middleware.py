@@ -1,20 +1,54 @@
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.http import HttpResponseForbidden
-from django.utils.deprecation import MiddlewareMixin
-from django.core.cache import cache
-from ipgeolocation import IPGeolocationAPI
-from .models import RequestLog, BlockedIP
+from .blocklist import get_blocklist
+from .client_ip import get_client_ip_resolver
+from .counters import REQUESTS, pending_counters
+from .detection import detector
+from .geolocation import get_geolocation_settings, is_private_ip, resolve_geolocation
+from .log_buffer import request_log_buffer
+from .models import RequestLog
+from .paths import get_path_normalizer, get_path_settings
+from .sketches import heavy_hitters, unique_visitors
 
 
 logger = logging.getLogger(__name__)
 
 
-class IPLoggingMiddleware(MiddlewareMixin):
+class IPLoggingMiddleware:
     """
     Middleware to log IP address, timestamp, and path of every incoming request.
-    Also blocks requests from IPs in the blacklist.
+    Also blocks requests from IPs in the blacklist and flags suspicious IPs
+    as soon as they cross a detection threshold.
+
+    Supports both sync (WSGI) and async (ASGI) stacks. Under ASGI the block
+    check runs on the event loop against the in-memory blocklist, and
+    everything that needs the database or the cache is handed to the log
+    buffer's flusher thread, so requests don't hop to a thread just to pass
+    through this middleware.
     """
-    
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        self.client_ip_resolver = get_client_ip_resolver()
+        self.path_normalizer = get_path_normalizer()
+        self.blocklist = get_blocklist()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.process_request(request)
+        return response or self.get_response(request)
+
+    async def __acall__(self, request):
+        response = await self.aprocess_request(request)
+        return response or await self.get_response(request)
+
     def process_request(self, request):
         """
         Process the request and log IP address, timestamp, path, and geolocation data.
@@ -22,69 +56,157 @@ class IPLoggingMiddleware(MiddlewareMixin):
         This method is called for each request before the view is processed.
         """
         try:
-            # Get the client's IP address
+            # Get the client's IP address, and keep it for later middleware
             ip_address = self.get_client_ip(request)
+            request.client_ip = ip_address
             
             # Check if IP is blacklisted
             if self.is_ip_blocked(ip_address):
-                logger.warning(f"Blocked request from blacklisted IP: {ip_address}")
-                return HttpResponseForbidden(
-                    "Access denied. Your IP address has been blocked.",
-                    content_type="text/plain"
-                )
-            
-            # Get the request path
-            path = request.path
+                return self.blocked_response(ip_address)
             
-            # Get geolocation data
-            country, city = self.get_geolocation_data(ip_address)
-            
-            # Create and save the request log entry
-            RequestLog.objects.create(
+            # Get the request's route (its URL pattern), interned as a RequestPath
+            path = self.path_normalizer.route(request.path_info)
+            request_log = RequestLog(
                 ip_address=ip_address,
-                path=path,
-                country=country,
-                city=city
+                route=self.path_normalizer.request_path(path),
+                path=self.raw_path(request)
             )
             
-            # Also log to Django's logging system for debugging
-            location_info = f" ({city}, {country})" if city and country else ""
-            logger.info(f"Request logged: {ip_address}{location_info} - {path}")
+            # Get geolocation data, unless it is left to the backfill task
+            self.resolve_location(request_log)
+            
+            # Save the request log entry, either directly or through the
+            # buffered writer when it is enabled
+            if request_log_buffer.enabled:
+                request_log_buffer.enqueue(request_log)
+            else:
+                request_log.save()
+                pending_counters.add(REQUESTS)
+            
+            self.track_request(request_log)
             
         except Exception as e:
             # Log the error but don't break the request processing
             logger.error(f"Error processing request: {e}")
+
+    async def aprocess_request(self, request):
+        """
+        Async version of process_request used when running under ASGI.
+
+        Only in-memory work happens on the event loop. With the log buffer
+        enabled, its flusher thread resolves the entry's location, updates
+        the detection counters and sketches (process_buffered) and writes it,
+        so a request makes no database or cache call once the blocklist and
+        its route are loaded. Without it, the same work runs in a thread.
+        """
+        try:
+            ip_address = self.get_client_ip(request)
+            request.client_ip = ip_address
+
+            if await self.ais_ip_blocked(ip_address):
+                return self.blocked_response(ip_address)
+
+            path = self.path_normalizer.route(request.path_info)
+            request_log = RequestLog(
+                ip_address=ip_address,
+                route=await self.path_normalizer.arequest_path(path),
+                path=self.raw_path(request)
+            )
+
+            if not request_log_buffer.enabled:
+                await sync_to_async(self.resolve_location)(request_log)
+                await request_log.asave()
+                pending_counters.add(REQUESTS)
+                await sync_to_async(self.track_request)(request_log)
+            # Never wait for queue space on the event loop
+            elif not request_log_buffer.enqueue(request_log, block=False, process=self.process_buffered):
+                # A dropped entry still counts towards detection and the sketches
+                await sync_to_async(self.track_request)(request_log)
+
+        except Exception as e:
+            logger.error(f"Error processing request: {e}")
+
+    def process_buffered(self, request_log):
+        """
+        Finish an entry queued by aprocess_request, in the log buffer's
+        flusher thread just before it is written.
+        """
+        self.resolve_location(request_log)
+        self.track_request(request_log)
+
+    def resolve_location(self, request_log):
+        """
+        Fill in country and city, unless they are left to the backfill task.
+        """
+        if get_geolocation_settings()['RESOLVE_IN_REQUEST']:
+            request_log.country, request_log.city = self.get_geolocation_data(request_log.ip_address)
+
+    def track_request(self, request_log):
+        """
+        Log the request, update the sliding-window counters (flagging
+        anomalies right away) and count the request in this worker's top-K
+        and unique-visitor sketches.
+        """
+        path = request_log.route.route
+        self.log_request(request_log)
+        detector.record(request_log.ip_address, path)
+        heavy_hitters.record(request_log.ip_address, path, request_log.country)
+        unique_visitors.record(request_log.ip_address, path)
+
+    def blocked_response(self, ip_address):
+        """
+        Build the 403 response returned to blacklisted IPs.
+        """
+        logger.warning(f"Blocked request from blacklisted IP: {ip_address}")
+        return HttpResponseForbidden(
+            "Access denied. Your IP address has been blocked.",
+            content_type="text/plain"
+        )
+
+    def log_request(self, request_log):
+        """
+        Log the recorded request to Django's logging system for debugging.
+        """
+        location_info = f" ({request_log.city}, {request_log.country})" if request_log.city and request_log.country else ""
+        logger.info(f"Request logged: {request_log.ip_address}{location_info} - {request_log.request_path}")
+    
+    def raw_path(self, request):
+        """
+        Return the raw path to store alongside the route, if enabled.
+        """
+        if get_path_settings()['STORE_RAW_PATH']:
+            return request.path[:255]
+        return None
     
     def get_client_ip(self, request):
         """
         Get the real IP address of the client making the request.
-        Handles cases where the request goes through proxies or load balancers.
-        """
-        # Check for forwarded IP first
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            # X-Forwarded-For can contain multiple IPs, take the first one
-            ip = x_forwarded_for.split(',')[0].strip()
-            return ip
-        
-        # Check for real IP header
-        x_real_ip = request.META.get('HTTP_X_REAL_IP')
-        if x_real_ip:
-            return x_real_ip.strip()
-        
-        # Fall back to REMOTE_ADDR
-        return request.META.get('REMOTE_ADDR', '127.0.0.1')
+        Forwarded headers are only honoured from IP_TRACKING_CLIENT_IP's
+        trusted proxies, walking X-Forwarded-For from the nearest hop.
+        RateLimitMiddleware may already have resolved it.
+        """
+        return getattr(request, 'client_ip', None) or self.client_ip_resolver.resolve(request.META)
     
     def is_ip_blocked(self, ip_address):
         """
         Check if the given IP address is in the blacklist.
+        Uses the configured blocklist backend (IP_TRACKING_BLOCKLIST['BACKEND']),
+        so no database query is made unless the blocklist has changed.
         Returns True if the IP is blocked, False otherwise.
         """
         try:
-            return BlockedIP.objects.filter(
-                ip_address=ip_address,
-                is_active=True
-            ).exists()
+            return self.blocklist.is_blocked(ip_address)
+        except Exception as e:
+            logger.error(f"Error checking IP blacklist: {e}")
+            return False
+
+    async def ais_ip_blocked(self, ip_address):
+        """
+        Async version of is_ip_blocked. The snapshot backend reloads with the
+        async ORM when needed; lookups themselves never touch the database.
+        """
+        try:
+            return await self.blocklist.ais_blocked(ip_address)
         except Exception as e:
             logger.error(f"Error checking IP blacklist: {e}")
             return False
@@ -92,53 +214,19 @@ class IPLoggingMiddleware(MiddlewareMixin):
     def get_geolocation_data(self, ip_address):
         """
         Get geolocation data (country and city) for the given IP address.
-        Uses caching to avoid repeated API calls for the same IP.
         Returns tuple of (country, city) or (None, None) if not available.
         """
         # Skip geolocation for local/private IPs
         if self.is_private_ip(ip_address):
             return None, None
         
-        # Check cache first
-        cache_key = f"geolocation_{ip_address}"
-        cached_data = cache.get(cache_key)
-        
-        if cached_data:
-            logger.debug(f"Using cached geolocation data for {ip_address}")
-            return cached_data.get('country'), cached_data.get('city')
-        
-        try:
-            # Initialize IPGeolocationAPI
-            ip_geolocation = IPGeolocationAPI()
-            
-            # Get geolocation data
-            geolocation_data = ip_geolocation.get_geolocation(ip_address)
-            
-            if geolocation_data and geolocation_data.get('status') == 'success':
-                country = geolocation_data.get('country_name', '')
-                city = geolocation_data.get('city', '')
-                
-                # Cache the result for 24 hours
-                cache_data = {'country': country, 'city': city}
-                cache.set(cache_key, cache_data, 86400)  # 24 hours
-                
-                logger.debug(f"Fetched geolocation data for {ip_address}: {city}, {country}")
-                return country, city
-            else:
-                logger.warning(f"Failed to get geolocation data for {ip_address}")
-                return None, None
-                
-        except Exception as e:
-            logger.error(f"Error fetching geolocation data for {ip_address}: {e}")
+        geolocation_data = resolve_geolocation(ip_address)
+        if geolocation_data is None:
             return None, None
+        return geolocation_data
     
     def is_private_ip(self, ip_address):
         """
         Check if the IP address is a private/local IP that doesn't need geolocation.
         """
-        try:
-            import ipaddress
-            ip = ipaddress.ip_address(ip_address)
-            return ip.is_private or ip.is_loopback or ip.is_link_local
-        except ValueError:
-            return True  # Invalid IP, treat as private
+        return is_private_ip(ip_address)
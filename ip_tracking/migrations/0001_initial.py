@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedIP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address to block', unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When this IP was added to the blacklist')),
+                ('reason', models.CharField(blank=True, help_text='Reason for blocking this IP (optional)', max_length=255, null=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Whether this block is currently active')),
+            ],
+            options={
+                'verbose_name': 'Blocked IP',
+                'verbose_name_plural': 'Blocked IPs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address of the client making the request')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, help_text='Timestamp when the request was made')),
+                ('path', models.CharField(help_text='URL path of the request', max_length=255)),
+                ('country', models.CharField(blank=True, help_text='Country of the IP address', max_length=100, null=True)),
+                ('city', models.CharField(blank=True, help_text='City of the IP address', max_length=100, null=True)),
+            ],
+            options={
+                'verbose_name': 'Request Log',
+                'verbose_name_plural': 'Request Logs',
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SuspiciousIP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address flagged as suspicious', unique=True)),
+                ('reason', models.CharField(help_text='Reason for flagging this IP as suspicious', max_length=255)),
+                ('detected_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When this IP was flagged as suspicious')),
+                ('is_active', models.BooleanField(default=True, help_text='Whether this flag is currently active')),
+                ('request_count', models.PositiveIntegerField(default=0, help_text='Number of requests that triggered the flag')),
+                ('sensitive_paths', models.JSONField(blank=True, default=list, help_text='List of sensitive paths accessed by this IP')),
+            ],
+            options={
+                'verbose_name': 'Suspicious IP',
+                'verbose_name_plural': 'Suspicious IPs',
+                'ordering': ['-detected_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockedip',
+            name='prefix_length',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Network prefix length for CIDR blocks (empty for a single address)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='blockedip',
+            name='ip_address',
+            field=models.GenericIPAddressField(help_text='IP address to block (network address when blocking a network)'),
+        ),
+        migrations.AddConstraint(
+            model_name='blockedip',
+            constraint=models.UniqueConstraint(fields=('ip_address', 'prefix_length'), name='blockedip_unique_network'),
+        ),
+        migrations.AddConstraint(
+            model_name='blockedip',
+            constraint=models.UniqueConstraint(condition=models.Q(('prefix_length__isnull', True)), fields=('ip_address',), name='blockedip_unique_address'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0003_requestlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the rollup this watermark belongs to', max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0, help_text='Highest RequestLog id included in the rollup')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='When the rollup was last updated')),
+            ],
+            options={
+                'verbose_name': 'Rollup Watermark',
+                'verbose_name_plural': 'Rollup Watermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour the requests were made in')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address of the client')),
+                ('path', models.CharField(help_text='URL path of the requests', max_length=255)),
+                ('country', models.CharField(blank=True, default='', help_text='Country of the IP address (empty if unknown)', max_length=100)),
+                ('count', models.PositiveIntegerField(default=0, help_text='Number of requests in this hour')),
+            ],
+            options={
+                'verbose_name': 'Request Rollup',
+                'verbose_name_plural': 'Request Rollups',
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['hour', 'path'], name='requestrollup_hour_path_idx'), models.Index(fields=['hour', 'country'], name='requestrollup_hour_country_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='requestrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'ip_address', 'path', 'country'), name='requestrollup_unique_key'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0005_blockedip_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the counter', max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0, help_text='Current value of the counter')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='When the counter was last written')),
+            ],
+            options={
+                'verbose_name': 'Traffic Counter',
+                'verbose_name_plural': 'Traffic Counters',
+            },
+        ),
+    ]
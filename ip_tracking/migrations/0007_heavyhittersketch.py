@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0006_trafficcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeavyHitterSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(help_text='What the summary counts (ip_address, path or country)', max_length=20)),
+                ('hour', models.DateTimeField(help_text='Start of the hour the summary covers')),
+                ('worker', models.CharField(help_text='Host and process that wrote the summary', max_length=100)),
+                ('counters', models.JSONField(default=list, help_text='[value, count, error] triples, count being an upper bound')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='When the summary was last written')),
+            ],
+            options={
+                'verbose_name': 'Heavy Hitter Sketch',
+                'verbose_name_plural': 'Heavy Hitter Sketches',
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='heavyhittersketch',
+            constraint=models.UniqueConstraint(fields=('dimension', 'hour', 'worker'), name='heavyhittersketch_unique_key'),
+        ),
+    ]
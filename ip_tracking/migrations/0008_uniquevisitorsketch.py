@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0007_heavyhittersketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UniqueVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour the registers cover')),
+                ('path', models.CharField(blank=True, default='', help_text='URL path the registers cover (empty for all paths)', max_length=255)),
+                ('worker', models.CharField(help_text='Host and process that wrote the registers', max_length=100)),
+                ('registers', models.BinaryField(help_text='HyperLogLog registers, one byte each, zlib-compressed')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='When the registers were last written')),
+            ],
+            options={
+                'verbose_name': 'Unique Visitor Sketch',
+                'verbose_name_plural': 'Unique Visitor Sketches',
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='uniquevisitorsketch',
+            constraint=models.UniqueConstraint(fields=('hour', 'path', 'worker'), name='uniquevisitorsketch_unique_key'),
+        ),
+    ]
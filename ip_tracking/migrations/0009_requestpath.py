@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0008_uniquevisitorsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route', models.CharField(help_text='URL pattern of the requests', max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Request Path',
+                'verbose_name_plural': 'Request Paths',
+            },
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='route',
+            field=models.ForeignKey(help_text='URL pattern the request path resolved to', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='request_logs', to='ip_tracking.requestpath'),
+        ),
+        migrations.AddField(
+            model_name='requestrollup',
+            name='route',
+            field=models.ForeignKey(help_text='URL pattern of the requests', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='rollups', to='ip_tracking.requestpath'),
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='path',
+            field=models.CharField(blank=True, help_text="Raw URL path of the request (only stored with IP_TRACKING_PATHS['STORE_RAW_PATH'])", max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='heavyhittersketch',
+            name='dimension',
+            field=models.CharField(help_text='What the summary counts (ip_address, path or country; paths are routes)', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='uniquevisitorsketch',
+            name='path',
+            field=models.CharField(blank=True, default='', help_text='Route the registers cover (empty for all routes)', max_length=255),
+        ),
+    ]
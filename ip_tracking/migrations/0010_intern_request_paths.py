@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def intern_request_paths(apps, schema_editor):
+    """
+    Resolve the raw paths of existing RequestLog and RequestRollup rows to
+    their routes, intern them as RequestPath rows and fill in route_id.
+    Rollup rows whose paths share a route are merged into one.
+    """
+    from ip_tracking.paths import PathNormalizer, get_path_settings
+
+    RequestPath = apps.get_model('ip_tracking', 'RequestPath')
+    RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+    RequestRollup = apps.get_model('ip_tracking', 'RequestRollup')
+
+    config = get_path_settings()
+    normalizer = PathNormalizer(config['NORMALIZE'], config['CACHE_SIZE'])
+    route_ids = {}
+
+    def route_id(path):
+        route = normalizer.route(path or '/')
+        if route not in route_ids:
+            route_ids[route] = RequestPath.objects.get_or_create(route=route)[0].id
+        return route_ids[route]
+
+    # One UPDATE per distinct raw path, using the (path, timestamp) index
+    for model in (RequestLog, RequestRollup):
+        pending = model.objects.filter(route__isnull=True)
+        for path in list(pending.order_by().values_list('path', flat=True).distinct()):
+            pending.filter(path=path).update(route_id=route_id(path))
+
+    # Paths that resolved to the same route would collide on the new key
+    duplicates = (
+        RequestRollup.objects
+        .values('hour', 'ip_address', 'route', 'country')
+        .annotate(rows=Count('id'), total=Sum('count'), keep=Min('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for row in list(duplicates):
+        RequestRollup.objects.filter(id=row['keep']).update(count=row['total'])
+        (
+            RequestRollup.objects
+            .filter(hour=row['hour'], ip_address=row['ip_address'], route=row['route'], country=row['country'])
+            .exclude(id=row['keep'])
+            .delete()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0009_requestpath'),
+    ]
+
+    operations = [
+        migrations.RunPython(intern_request_paths, migrations.RunPython.noop),
+    ]
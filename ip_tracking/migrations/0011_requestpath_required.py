@@ -0,0 +1,55 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Switches to the interned routes once 0010 has filled them in. Kept
+# separate so on PostgreSQL the route updates are committed before the
+# tables are altered.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0010_intern_request_paths'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='requestrollup',
+            name='requestrollup_unique_key',
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='requestlog_path_ts_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='requestrollup',
+            name='requestrollup_hour_path_idx',
+        ),
+        migrations.RemoveField(
+            model_name='requestrollup',
+            name='path',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='route',
+            field=models.ForeignKey(help_text='URL pattern the request path resolved to', on_delete=django.db.models.deletion.PROTECT, related_name='request_logs', to='ip_tracking.requestpath'),
+        ),
+        migrations.AlterField(
+            model_name='requestrollup',
+            name='route',
+            field=models.ForeignKey(help_text='URL pattern of the requests', on_delete=django.db.models.deletion.PROTECT, related_name='rollups', to='ip_tracking.requestpath'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['route', 'timestamp'], name='requestlog_route_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestrollup',
+            index=models.Index(fields=['hour', 'route'], name='requestrollup_hour_route_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='requestrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'ip_address', 'route', 'country'), name='requestrollup_unique_key'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:12
+
+from django.db import migrations, models
+import ip_tracking.fields
+from ip_tracking.fields import network_range, pack_ip
+
+
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def backfill_packed_ips(apps, schema_editor):
+    """
+    Fill in the packed columns of existing rows, walking each table by id
+    and writing a chunk with one bulk_update.
+    """
+    RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+    BlockedIP = apps.get_model('ip_tracking', 'BlockedIP')
+
+    last_id = 0
+    while True:
+        rows = list(
+            RequestLog.objects
+            .filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'ip_address')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        RequestLog.objects.bulk_update(
+            [RequestLog(id=row_id, ip_packed=pack_ip(ip_address)) for row_id, ip_address in rows],
+            ['ip_packed']
+        )
+        last_id = rows[-1][0]
+
+    blocked_ips = list(BlockedIP.objects.only('id', 'ip_address', 'prefix_length'))
+    for blocked_ip in blocked_ips:
+        network = blocked_ip.ip_address
+        if blocked_ip.prefix_length is not None:
+            network = f'{network}/{blocked_ip.prefix_length}'
+        blocked_ip.network_start, blocked_ip.network_end = network_range(network)
+    BlockedIP.objects.bulk_update(blocked_ips, ['network_start', 'network_end'], batch_size=BACKFILL_CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0011_requestpath_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockedip',
+            name='network_end',
+            field=ip_tracking.fields.PackedIPAddressField(bound='last', help_text='Last address of the blocked network as 16 bytes (IPv4-mapped)', null=True, source='network'),
+        ),
+        migrations.AddField(
+            model_name='blockedip',
+            name='network_start',
+            field=ip_tracking.fields.PackedIPAddressField(help_text='First address of the blocked network as 16 bytes (IPv4-mapped)', null=True, source='network'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='ip_packed',
+            field=ip_tracking.fields.PackedIPAddressField(help_text='ip_address as 16 bytes (IPv4-mapped), for network range queries', null=True, source='ip_address'),
+        ),
+        # Before the indexes, so they are built once over the filled columns
+        migrations.RunPython(backfill_packed_ips, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='blockedip',
+            index=models.Index(fields=['network_start', 'network_end'], name='blockedip_network_range_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['ip_packed', 'timestamp'], name='requestlog_ippacked_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:16
+
+import ipaddress
+from django.db import migrations, models
+
+
+def normalize_full_length_prefixes(apps, schema_editor):
+    """
+    Store /32 and /128 blocks as single addresses. A block that duplicates
+    an existing single-address row is merged into it: the merged block is
+    active if either was, and permanent if an active one was.
+    """
+    BlockedIP = apps.get_model('ip_tracking', 'BlockedIP')
+
+    for block in BlockedIP.objects.filter(prefix_length__in=[32, 128]):
+        if block.prefix_length != ipaddress.ip_address(block.ip_address).max_prefixlen:
+            continue
+        single = BlockedIP.objects.filter(ip_address=block.ip_address, prefix_length__isnull=True).first()
+        if single is None:
+            # The packed bounds of /32 and /128 already match the single address
+            BlockedIP.objects.filter(id=block.id).update(prefix_length=None)
+            continue
+
+        active = [row for row in (single, block) if row.is_active]
+        expires_at = single.expires_at
+        if active:
+            expiries = [row.expires_at for row in active]
+            expires_at = None if None in expiries else max(expiries)
+        BlockedIP.objects.filter(id=single.id).update(
+            is_active=bool(active),
+            expires_at=expires_at,
+            reason=single.reason or block.reason,
+        )
+        block.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0012_packed_ips'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_full_length_prefixes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='blockedip',
+            constraint=models.CheckConstraint(check=models.Q(('prefix_length__isnull', True), ('prefix_length__lt', 32), models.Q(('ip_address__contains', ':'), ('prefix_length__lt', 128)), _connector='OR'), name='blockedip_no_full_length_prefix'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0013_blockedip_no_full_length_prefix'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='suspiciousip',
+            name='reason_is_manual',
+            field=models.BooleanField(default=False, help_text='Whether an operator wrote the reason, so detection leaves it as is'),
+        ),
+    ]
@@ -1,11 +1,45 @@
+import ipaddress
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
+from .fields import PackedIPAddressField, network_range, pack_ip
+
+
+class RequestPath(models.Model):
+    """
+    Dimension table of request routes, so RequestLog and RequestRollup
+    store a small integer instead of repeating the path string.
+    A route is the URL pattern a path resolved to (e.g. /users/<int:id>/),
+    or '<unmatched>' for paths that resolved to nothing.
+    """
+    route = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text="URL pattern of the requests"
+    )
+    
+    class Meta:
+        verbose_name = 'Request Path'
+        verbose_name_plural = 'Request Paths'
+    
+    def __str__(self):
+        return self.route
+
+
+class RequestLogQuerySet(models.QuerySet):
+    def in_network(self, network):
+        """
+        Filter to requests from inside a network (a CIDR string or ipaddress
+        network), as one range scan on the packed address.
+        """
+        first, last = network_range(network)
+        return self.filter(ip_packed__range=(first, last))
 
 
 class RequestLog(models.Model):
     """
     Model to store request logging information including IP address,
-    timestamp, path, and geolocation data for every incoming request.
+    timestamp, route, and geolocation data for every incoming request.
     """
     ip_address = models.GenericIPAddressField(
         help_text="IP address of the client making the request"
@@ -14,9 +48,17 @@ class RequestLog(models.Model):
         default=timezone.now,
         help_text="Timestamp when the request was made"
     )
+    route = models.ForeignKey(
+        RequestPath,
+        on_delete=models.PROTECT,
+        related_name='request_logs',
+        help_text="URL pattern the request path resolved to"
+    )
     path = models.CharField(
         max_length=255,
-        help_text="URL path of the request"
+        blank=True,
+        null=True,
+        help_text="Raw URL path of the request (only stored with IP_TRACKING_PATHS['STORE_RAW_PATH'])"
     )
     country = models.CharField(
         max_length=100,
@@ -30,24 +72,80 @@ class RequestLog(models.Model):
         null=True,
         help_text="City of the IP address"
     )
+    ip_packed = PackedIPAddressField(
+        source='ip_address',
+        null=True,
+        help_text="ip_address as 16 bytes (IPv4-mapped), for network range queries"
+    )
+    
+    objects = RequestLogQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
         verbose_name = 'Request Log'
         verbose_name_plural = 'Request Logs'
+        indexes = [
+            # Time-window scans grouped by IP (anomaly detection, top IPs),
+            # also serves the default -timestamp ordering
+            models.Index(fields=['timestamp', 'ip_address'], name='requestlog_ts_ip_idx'),
+            # Sensitive-route lookups within a time window
+            models.Index(fields=['route', 'timestamp'], name='requestlog_route_ts_idx'),
+            # Per-IP activity within a time window
+            models.Index(fields=['ip_address', 'timestamp'], name='requestlog_ip_ts_idx'),
+            # Network (range) scans within a time window
+            models.Index(fields=['ip_packed', 'timestamp'], name='requestlog_ippacked_ts_idx'),
+            # Time-window scans grouped by country (top countries)
+            models.Index(fields=['timestamp', 'country'], name='requestlog_ts_country_idx'),
+            # Rows still waiting for the geolocation backfill
+            models.Index(
+                fields=['ip_address'],
+                name='requestlog_unresolved_idx',
+                condition=models.Q(country__isnull=True),
+            ),
+        ]
     
     def __str__(self):
         location = f" ({self.city}, {self.country})" if self.city and self.country else ""
-        return f"{self.ip_address}{location} - {self.path} - {self.timestamp}"
+        return f"{self.ip_address}{location} - {self.request_path} - {self.timestamp}"
+    
+    @property
+    def request_path(self):
+        """The raw path if it was stored, else the route."""
+        if self.path:
+            return self.path
+        return self.route.route if self.route_id else ''
+
+
+class BlockedIPQuerySet(models.QuerySet):
+    def in_network(self, network):
+        """
+        Filter to blocks that lie entirely inside a network (a CIDR string or
+        ipaddress network), as a range scan on the packed network bounds.
+        """
+        first, last = network_range(network)
+        return self.filter(network_start__gte=first, network_end__lte=last)
+
+    def covering(self, ip_address):
+        """
+        Filter to blocks whose network contains an address.
+        """
+        packed = pack_ip(ip_address)
+        return self.filter(network_start__lte=packed, network_end__gte=packed)
 
 
 class BlockedIP(models.Model):
     """
     Model to store blocked IP addresses that should be denied access.
+    A row blocks a single address, or a whole network when prefix_length is set.
+    Blocks with expires_at stop applying at that time.
     """
     ip_address = models.GenericIPAddressField(
-        unique=True,
-        help_text="IP address to block"
+        help_text="IP address to block (network address when blocking a network)"
+    )
+    prefix_length = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        help_text="Network prefix length for CIDR blocks (empty for a single address)"
     )
     created_at = models.DateTimeField(
         default=timezone.now,
@@ -63,14 +161,128 @@ class BlockedIP(models.Model):
         default=True,
         help_text="Whether this block is currently active"
     )
+    expires_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="When this block stops applying (empty for a permanent block)"
+    )
+    network_start = PackedIPAddressField(
+        source='network',
+        null=True,
+        help_text="First address of the blocked network as 16 bytes (IPv4-mapped)"
+    )
+    network_end = PackedIPAddressField(
+        source='network',
+        bound='last',
+        null=True,
+        help_text="Last address of the blocked network as 16 bytes (IPv4-mapped)"
+    )
+    
+    objects = BlockedIPQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Blocked IP'
         verbose_name_plural = 'Blocked IPs'
+        constraints = [
+            # One row per network, so 10.0.0.0/8, 10.0.0.0/16 and the single
+            # address 10.0.0.0 are separate blocks
+            models.UniqueConstraint(
+                fields=['ip_address', 'prefix_length'],
+                name='blockedip_unique_network',
+            ),
+            # NULLs are distinct in the constraint above, so single addresses
+            # (prefix_length NULL) need their own
+            models.UniqueConstraint(
+                fields=['ip_address'],
+                condition=models.Q(prefix_length__isnull=True),
+                name='blockedip_unique_address',
+            ),
+            # Single addresses are only stored without a prefix length, so
+            # 192.0.2.5/32 cannot duplicate 192.0.2.5 (IPv6 addresses contain ':')
+            models.CheckConstraint(
+                check=(
+                    models.Q(prefix_length__isnull=True)
+                    | models.Q(prefix_length__lt=32)
+                    | models.Q(prefix_length__lt=128, ip_address__contains=':')
+                ),
+                name='blockedip_no_full_length_prefix',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['network_start', 'network_end'], name='blockedip_network_range_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.ip_address} - {self.reason or 'No reason provided'}"
+        return f"{self.cidr} - {self.reason or 'No reason provided'}"
+
+    @property
+    def network(self):
+        """
+        Return the blocked network as an ipaddress network object.
+        """
+        if self.prefix_length is None:
+            return ipaddress.ip_network(self.ip_address)
+        return ipaddress.ip_network(f"{self.ip_address}/{self.prefix_length}")
+
+    @property
+    def is_expired(self):
+        """
+        Return True if the block has an expiry time that has passed.
+        """
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+    @property
+    def cidr(self):
+        """
+        Return the block in CIDR notation, or the plain address for single IPs.
+        """
+        if self.prefix_length is None:
+            return self.ip_address
+        return f"{self.ip_address}/{self.prefix_length}"
+
+    def save(self, *args, **kwargs):
+        self.normalize_prefix_length()
+        super().save(*args, **kwargs)
+
+    def clean(self):
+        """
+        Validate that ip_address is the network address for the prefix length.
+        """
+        super().clean()
+        if self.ip_address and self.prefix_length is not None:
+            try:
+                ipaddress.ip_network(f"{self.ip_address}/{self.prefix_length}")
+            except ValueError as e:
+                raise ValidationError({'prefix_length': str(e)})
+        # Before the unique constraints are validated, so 192.0.2.5/32
+        # conflicts with an existing 192.0.2.5
+        self.normalize_prefix_length()
+
+    def normalize_prefix_length(self):
+        """
+        Store a full-length prefix (/32 for IPv4, /128 for IPv6) as a single
+        address (prefix_length None), as parse_network does.
+        """
+        if self.ip_address and self.prefix_length is not None:
+            try:
+                max_prefixlen = ipaddress.ip_address(self.ip_address).max_prefixlen
+            except ValueError:
+                return
+            if self.prefix_length == max_prefixlen:
+                self.prefix_length = None
+
+    @staticmethod
+    def parse_network(value):
+        """
+        Parse an IP address or CIDR string into (ip_address, prefix_length).
+        Host bits are masked off, and single-address networks are stored
+        with prefix_length None.
+        """
+        network = ipaddress.ip_network(value.strip(), strict=False)
+        if network.prefixlen == network.max_prefixlen:
+            return str(network.network_address), None
+        return str(network.network_address), network.prefixlen
 
 
 class SuspiciousIP(models.Model):
@@ -85,6 +297,10 @@ class SuspiciousIP(models.Model):
         max_length=255,
         help_text="Reason for flagging this IP as suspicious"
     )
+    reason_is_manual = models.BooleanField(
+        default=False,
+        help_text="Whether an operator wrote the reason, so detection leaves it as is"
+    )
     detected_at = models.DateTimeField(
         default=timezone.now,
         help_text="When this IP was flagged as suspicious"
@@ -110,3 +326,186 @@ class SuspiciousIP(models.Model):
     
     def __str__(self):
         return f"{self.ip_address} - {self.reason} ({self.request_count} requests)"
+
+
+class RequestRollup(models.Model):
+    """
+    Hourly request counts per IP address, route and country, maintained
+    incrementally from RequestLog by the update_request_rollups task.
+    """
+    hour = models.DateTimeField(
+        help_text="Start of the hour the requests were made in"
+    )
+    ip_address = models.GenericIPAddressField(
+        help_text="IP address of the client"
+    )
+    route = models.ForeignKey(
+        RequestPath,
+        on_delete=models.PROTECT,
+        related_name='rollups',
+        help_text="URL pattern of the requests"
+    )
+    country = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        help_text="Country of the IP address (empty if unknown)"
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of requests in this hour"
+    )
+    
+    class Meta:
+        ordering = ['-hour']
+        verbose_name = 'Request Rollup'
+        verbose_name_plural = 'Request Rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'ip_address', 'route', 'country'],
+                name='requestrollup_unique_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['hour', 'route'], name='requestrollup_hour_route_idx'),
+            models.Index(fields=['hour', 'country'], name='requestrollup_hour_country_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.ip_address} {self.route} ({self.count})"
+
+
+class RollupWatermark(models.Model):
+    """
+    Highest RequestLog id already folded into a rollup.
+    """
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        help_text="Name of the rollup this watermark belongs to"
+    )
+    last_id = models.BigIntegerField(
+        default=0,
+        help_text="Highest RequestLog id included in the rollup"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="When the rollup was last updated"
+    )
+    
+    class Meta:
+        verbose_name = 'Rollup Watermark'
+        verbose_name_plural = 'Rollup Watermarks'
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
+class TrafficCounter(models.Model):
+    """
+    Running totals shown on the dashboard, kept up to date incrementally
+    and corrected periodically by the reconcile_counters task.
+    """
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        help_text="Name of the counter"
+    )
+    value = models.BigIntegerField(
+        default=0,
+        help_text="Current value of the counter"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="When the counter was last written"
+    )
+    
+    class Meta:
+        verbose_name = 'Traffic Counter'
+        verbose_name_plural = 'Traffic Counters'
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class HeavyHitterSketch(models.Model):
+    """
+    One worker's Space-Saving summary of the most frequent values of a
+    dimension (IP address, path or country) within one hour. Summaries of
+    different workers and hours are merged when read.
+    """
+    dimension = models.CharField(
+        max_length=20,
+        help_text="What the summary counts (ip_address, path or country; paths are routes)"
+    )
+    hour = models.DateTimeField(
+        help_text="Start of the hour the summary covers"
+    )
+    worker = models.CharField(
+        max_length=100,
+        help_text="Host and process that wrote the summary"
+    )
+    counters = models.JSONField(
+        default=list,
+        help_text="[value, count, error] triples, count being an upper bound"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="When the summary was last written"
+    )
+    
+    class Meta:
+        ordering = ['-hour']
+        verbose_name = 'Heavy Hitter Sketch'
+        verbose_name_plural = 'Heavy Hitter Sketches'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dimension', 'hour', 'worker'],
+                name='heavyhittersketch_unique_key',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.dimension} {self.hour:%Y-%m-%d %H:00} ({self.worker})"
+
+
+class UniqueVisitorSketch(models.Model):
+    """
+    One worker's HyperLogLog registers of the distinct client IPs that
+    requested a path (or any path) within one hour. Registers of different
+    workers, hours and paths are unioned when read.
+    """
+    hour = models.DateTimeField(
+        help_text="Start of the hour the registers cover"
+    )
+    path = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        help_text="Route the registers cover (empty for all routes)"
+    )
+    worker = models.CharField(
+        max_length=100,
+        help_text="Host and process that wrote the registers"
+    )
+    registers = models.BinaryField(
+        help_text="HyperLogLog registers, one byte each, zlib-compressed"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="When the registers were last written"
+    )
+    
+    class Meta:
+        ordering = ['-hour']
+        verbose_name = 'Unique Visitor Sketch'
+        verbose_name_plural = 'Unique Visitor Sketches'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'path', 'worker'],
+                name='uniquevisitorsketch_unique_key',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.path or '*'} {self.hour:%Y-%m-%d %H:00} ({self.worker})"
@@ -0,0 +1,116 @@
+import logging
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from .models import RequestPath
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PATH_SETTINGS = {
+    # Log the URL pattern a path resolves to (e.g. /users/<int:id>/)
+    # instead of the raw path; unresolved paths are logged as UNMATCHED
+    'NORMALIZE': True,
+    'STORE_RAW_PATH': False,  # Also keep the raw path in RequestLog.path
+    'CACHE_SIZE': 4096,  # Distinct raw paths whose route is memoized
+}
+
+# Route of requests that match no URL pattern (404s)
+UNMATCHED = '<unmatched>'
+
+
+def get_path_settings():
+    """
+    Return the path settings merged over the defaults.
+    """
+    return {**DEFAULT_PATH_SETTINGS, **getattr(settings, 'IP_TRACKING_PATHS', {})}
+
+
+class PathNormalizer:
+    """
+    Map raw request paths to their route and intern routes as RequestPath rows.
+
+    Routes are resolved once per raw path in a bounded LRU. Routes are
+    bounded by the URLconf when normalizing, so every RequestPath row a
+    worker has used stays cached, and each route costs at most one
+    get_or_create per worker.
+    """
+
+    def __init__(self, normalize=True, cache_size=4096):
+        self.normalize = normalize
+        self.route = lru_cache(maxsize=cache_size)(self._route)
+        self._request_paths = {}
+        self._max_request_paths = cache_size
+        self._lock = threading.Lock()
+
+    def _route(self, path):
+        """
+        Return the route of a raw path (its path_info, without any script prefix).
+        """
+        if not self.normalize:
+            return path[:255]
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return UNMATCHED
+        return f"/{match.route}"[:255]
+
+    def request_path(self, route):
+        """
+        Return the RequestPath row for a route, creating it if needed.
+        """
+        request_path = self._request_paths.get(route)
+        if request_path is None:
+            request_path, _ = RequestPath.objects.get_or_create(route=route)
+            self._remember(request_path)
+        return request_path
+
+    async def arequest_path(self, route):
+        """
+        Async version of request_path.
+        """
+        request_path = self._request_paths.get(route)
+        if request_path is None:
+            request_path, _ = await RequestPath.objects.aget_or_create(route=route)
+            self._remember(request_path)
+        return request_path
+
+    def _remember(self, request_path):
+        with self._lock:
+            # Only raw (unnormalized) paths can grow without bound
+            if len(self._request_paths) >= self._max_request_paths:
+                self._request_paths = {}
+            self._request_paths[request_path.route] = request_path
+
+
+def route_ids(routes):
+    """
+    Return {id: route} for those of the given routes that have been logged, in one query.
+    """
+    return dict(RequestPath.objects.filter(route__in=routes).values_list('id', 'route'))
+
+
+def route_names(ids):
+    """
+    Return {id: route} for the given RequestPath ids in one query.
+    """
+    return dict(RequestPath.objects.filter(id__in=ids).values_list('id', 'route'))
+
+
+_normalizer = None
+_normalizer_lock = threading.Lock()
+
+
+def get_path_normalizer():
+    """
+    Return the shared normalizer built from IP_TRACKING_PATHS.
+    """
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                config = get_path_settings()
+                _normalizer = PathNormalizer(config['NORMALIZE'], config['CACHE_SIZE'])
+    return _normalizer
@@ -0,0 +1,268 @@
+import logging
+import math
+import re
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from .client_ip import get_client_ip_resolver
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RATELIMIT_SETTINGS = {
+    'ENABLED': True,
+    'STORE': 'ip_tracking.ratelimit.MemoryStore',
+    'STORE_OPTIONS': {},  # Keyword arguments for the store, e.g. {'url': 'redis://...'}
+    'KEY_PREFIX': 'ip_tracking:ratelimit',
+    # Checked in order; the first policy whose path prefix and method match
+    # applies. 'burst' is how many requests may arrive back to back
+    # (default: the full rate count).
+    'POLICIES': [],
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+
+def get_ratelimit_settings():
+    """
+    Return the rate limiting settings merged over the defaults.
+    """
+    return {**DEFAULT_RATELIMIT_SETTINGS, **getattr(settings, 'IP_TRACKING_RATELIMIT', {})}
+
+
+def parse_rate(rate):
+    """
+    Parse a rate such as '10/m' or '100/5m' into (count, period in seconds).
+    """
+    match = RATE_PATTERN.match(rate)
+    if not match:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+class Policy:
+    """
+    A rate limit applied to requests whose path starts with `path`.
+
+    Enforced with GCRA: requests are spaced `emission_interval` apart on
+    average, and up to `burst` may arrive back to back.
+    """
+
+    def __init__(self, name, path, rate, methods=None, burst=None):
+        count, period = parse_rate(rate)
+        self.name = name
+        self.path = path
+        self.rate = rate
+        self.methods = {method.upper() for method in methods} if methods else None
+        self.emission_interval = period / count
+        self.tolerance = self.emission_interval * (burst or count)
+
+    def matches(self, request):
+        if self.methods is not None and request.method not in self.methods:
+            return False
+        return request.path.startswith(self.path)
+
+
+class RateLimitStore:
+    """
+    Base class for GCRA state stores. Each store keeps the theoretical
+    arrival time (TAT) per key and updates it in one atomic step.
+    """
+
+    def hit(self, key, emission_interval, tolerance):
+        """
+        Record a request against the key.
+        Returns (allowed, seconds until a request would be allowed).
+        """
+        raise NotImplementedError
+
+    async def ahit(self, key, emission_interval, tolerance):
+        """
+        Async version of hit.
+        """
+        raise NotImplementedError
+
+
+class MemoryStore(RateLimitStore):
+    """
+    In-process store. Limits are per worker process, so the effective limit
+    is multiplied by the number of workers.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._tats = {}
+
+    def hit(self, key, emission_interval, tolerance):
+        now = time.monotonic()
+        with self._lock:
+            new_tat = max(self._tats.get(key, now), now) + emission_interval
+            if new_tat - now > tolerance:
+                return False, new_tat - now - tolerance
+            if len(self._tats) >= self.max_entries and key not in self._tats:
+                self._prune(now)
+            self._tats[key] = new_tat
+            return True, 0.0
+
+    async def ahit(self, key, emission_interval, tolerance):
+        # Never blocks on I/O, so it is safe to call on the event loop
+        return self.hit(key, emission_interval, tolerance)
+
+    def _prune(self, now):
+        """
+        Drop keys whose TAT has passed; they are indistinguishable from new keys.
+        """
+        self._tats = {key: tat for key, tat in self._tats.items() if tat > now}
+
+
+# KEYS[1]: TAT key. ARGV: emission interval, tolerance (microseconds).
+# Uses the Redis server clock so every worker shares one time source.
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+local new_tat = math.max(tat, now) + interval
+if new_tat - now > tolerance then
+    return {0, new_tat - now - tolerance}
+end
+-- Format explicitly: Lua 5.1 would write large numbers in exponent notation
+redis.call('SET', KEYS[1], string.format('%d', new_tat), 'PX', string.format('%d', math.ceil((new_tat - now) / 1000)))
+return {1, 0}
+"""
+
+
+class RedisStore(RateLimitStore):
+    """
+    Shared store backed by Redis (or any server that supports EVALSHA).
+    Each request is a single script call, so concurrent workers cannot
+    race between reading and writing the TAT.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0'):
+        self.url = url
+        self._script = None
+        self._async_script = None
+
+    def hit(self, key, emission_interval, tolerance):
+        if self._script is None:
+            import redis
+
+            self._script = redis.Redis.from_url(self.url).register_script(GCRA_SCRIPT)
+        allowed, retry_after = self._script(
+            keys=[key],
+            args=[int(emission_interval * 1000000), int(tolerance * 1000000)]
+        )
+        return bool(allowed), retry_after / 1000000
+
+    async def ahit(self, key, emission_interval, tolerance):
+        if self._async_script is None:
+            import redis.asyncio
+
+            self._async_script = redis.asyncio.Redis.from_url(self.url).register_script(GCRA_SCRIPT)
+        allowed, retry_after = await self._async_script(
+            keys=[key],
+            args=[int(emission_interval * 1000000), int(tolerance * 1000000)]
+        )
+        return bool(allowed), retry_after / 1000000
+
+
+class RateLimitMiddleware:
+    """
+    Apply the IP_TRACKING_RATELIMIT policies to every request, keyed by
+    client IP, and answer 429 with Retry-After when a limit is exceeded.
+
+    Place it first, before IPLoggingMiddleware, so rejected requests cost
+    one store operation and never reach the log write, anomaly detection,
+    sessions, authentication or the view. Store errors fail open.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+        config = get_ratelimit_settings()
+        self.enabled = config['ENABLED']
+        self.key_prefix = config['KEY_PREFIX']
+        self.policies = [Policy(**policy) for policy in config['POLICIES']]
+        self.store = import_string(config['STORE'])(**config['STORE_OPTIONS'])
+        self.client_ip_resolver = get_client_ip_resolver()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        policy = self.get_policy(request)
+        if policy is not None:
+            try:
+                allowed, retry_after = self.store.hit(
+                    self.get_key(request, policy), policy.emission_interval, policy.tolerance
+                )
+            except Exception as e:
+                logger.error(f"Error checking rate limit: {e}")
+            else:
+                if not allowed:
+                    return self.limited_response(request, policy, retry_after)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        policy = self.get_policy(request)
+        if policy is not None:
+            try:
+                allowed, retry_after = await self.store.ahit(
+                    self.get_key(request, policy), policy.emission_interval, policy.tolerance
+                )
+            except Exception as e:
+                logger.error(f"Error checking rate limit: {e}")
+            else:
+                if not allowed:
+                    return self.limited_response(request, policy, retry_after)
+        return await self.get_response(request)
+
+    def get_policy(self, request):
+        """
+        Return the first policy matching the request, or None.
+        """
+        if not self.enabled:
+            return None
+        for policy in self.policies:
+            if policy.matches(request):
+                return policy
+        return None
+
+    def get_key(self, request, policy):
+        return f"{self.key_prefix}:{policy.name}:{self.get_client_ip(request)}"
+
+    def get_client_ip(self, request):
+        """
+        Resolve the client IP through the trusted proxies and keep it on the
+        request, where IPLoggingMiddleware picks it up.
+        """
+        ip_address = getattr(request, 'client_ip', None)
+        if ip_address is None:
+            ip_address = request.client_ip = self.client_ip_resolver.resolve(request.META)
+        return ip_address
+
+    def limited_response(self, request, policy, retry_after):
+        """
+        Build the 429 response returned when a policy's limit is exceeded.
+        """
+        logger.warning(f"Rate limited {request.path} ({policy.name}, {policy.rate})")
+        response = HttpResponse(
+            "Too many requests. Please try again later.",
+            content_type="text/plain",
+            status=429
+        )
+        response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
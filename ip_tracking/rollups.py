@@ -0,0 +1,261 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from .models import RequestLog, RequestRollup, RollupWatermark
+
+
+logger = logging.getLogger(__name__)
+
+
+ROLLUP_NAME = 'request_rollup'
+
+# Rollup keys looked up per query when merging a batch into stored counts
+EXISTING_KEYS_CHUNK = 250
+
+DEFAULT_ROLLUP_SETTINGS = {
+    # Only fold in rows older than this, so the geolocation backfill has
+    # filled in their country first; newer rows are read from RequestLog
+    'SETTLE_SECONDS': 300,
+    'BATCH_SIZE': 100000,  # Maximum RequestLog rows folded in per update
+}
+
+
+def get_rollup_settings():
+    """
+    Return the rollup settings merged over the defaults.
+    """
+    return {**DEFAULT_ROLLUP_SETTINGS, **getattr(settings, 'IP_TRACKING_ROLLUPS', {})}
+
+
+def get_watermark():
+    """
+    Return the highest RequestLog id already included in the rollup.
+    """
+    return (
+        RollupWatermark.objects
+        .filter(name=ROLLUP_NAME)
+        .values_list('last_id', flat=True)
+        .first()
+    ) or 0
+
+
+def truncate_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def update_request_rollups():
+    """
+    Fold RequestLog rows newer than the watermark into RequestRollup, up
+    to the first row newer than SETTLE_SECONDS.
+    Returns the number of RequestLog rows processed.
+    """
+    config = get_rollup_settings()
+    settled_before = timezone.now() - timedelta(seconds=config['SETTLE_SECONDS'])
+
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+        last_id = watermark.last_id
+
+        # Rows are not written in timestamp order (e.g. through the log
+        # buffer), so stop before the first row that has not settled yet;
+        # the watermark must never pass a row that was not folded in
+        first_unsettled_id = (
+            RequestLog.objects
+            .filter(id__gt=last_id, timestamp__gte=settled_before)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        settled = RequestLog.objects.filter(id__gt=last_id)
+        if first_unsettled_id is not None:
+            settled = settled.filter(id__lt=first_unsettled_id)
+        settled_ids = settled.order_by('id').values('id')[:config['BATCH_SIZE']]
+        upper_id = (
+            RequestLog.objects
+            .filter(id__in=settled_ids)
+            .aggregate(upper_id=Max('id'))['upper_id']
+        )
+        if upper_id is None:
+            return 0
+
+        new_counts = (
+            RequestLog.objects
+            .filter(id__gt=last_id, id__lte=upper_id)
+            .annotate(hour=TruncHour('timestamp'))
+            .values('hour', 'ip_address', 'route', 'country')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+
+        merged = {}
+        processed = 0
+        for row in new_counts:
+            key = (row['hour'], row['ip_address'], row['route'], row['country'] or '')
+            merged[key] = merged.get(key, 0) + row['count']
+            processed += row['count']
+
+        # Add the counts already stored for the keys in this batch, looked
+        # up by the unique key, so the cost follows the batch and not the
+        # number of rollup rows in the touched hours
+        keys = list(merged)
+        for start in range(0, len(keys), EXISTING_KEYS_CHUNK):
+            condition = Q(
+                *[
+                    Q(hour=hour, ip_address=ip_address, route_id=route_id, country=country)
+                    for hour, ip_address, route_id, country in keys[start:start + EXISTING_KEYS_CHUNK]
+                ],
+                _connector=Q.OR
+            )
+            existing = (
+                RequestRollup.objects
+                .filter(condition)
+                .values_list('hour', 'ip_address', 'route', 'country', 'count')
+            )
+            for hour, ip_address, route_id, country, count in existing:
+                merged[(hour, ip_address, route_id, country)] += count
+
+        RequestRollup.objects.bulk_create(
+            [
+                RequestRollup(hour=hour, ip_address=ip_address, route_id=route_id, country=country, count=count)
+                for (hour, ip_address, route_id, country), count in merged.items()
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['hour', 'ip_address', 'route', 'country'],
+            update_fields=['count'],
+        )
+
+        watermark.last_id = upper_id
+        watermark.save(update_fields=['last_id', 'updated_at'])
+
+    logger.info(f"Rolled up RequestLog ids {last_id + 1}-{upper_id} into {len(merged)} rollup rows")
+    return processed
+
+
+def next_hour(value):
+    """
+    Return the first hour boundary at or after `value`.
+    """
+    hour = truncate_hour(value)
+    return hour if hour == value else hour + timedelta(hours=1)
+
+
+def window_sources(since, **filters):
+    """
+    Return (rollup queryset, list of RequestLog querysets) that together
+    cover every request since the given time (None for all time) exactly
+    once: the rollup for the whole hours in the window, RequestLog for the
+    partial hour at its start (a range scan on the timestamp index) and for
+    the rows not yet rolled up. `filters` are applied to both models.
+    """
+    watermark = get_watermark()
+    rolled_up = RequestRollup.objects.filter(**filters)
+    tail = RequestLog.objects.filter(id__gt=watermark, **filters)
+    if since is None:
+        return rolled_up, [tail]
+
+    first_hour = next_hour(since)
+    head = RequestLog.objects.filter(timestamp__gte=since, timestamp__lt=first_hour, **filters)
+    return rolled_up.filter(hour__gte=first_hour), [head, tail.filter(timestamp__gte=first_hour)]
+
+
+def windowed_counts(since, group_by, **filters):
+    """
+    Return {group key tuple: request count} for requests since the given time.
+
+    Whole hours are counted from the hourly rollup and the rest from
+    RequestLog (see window_sources), so the cost depends on the number of
+    hours and keys plus the requests in at most one partial hour, not on
+    the number of requests in the window. `filters` are applied to both
+    models (e.g. route__in=...). Routes are grouped by RequestPath id; see
+    paths.route_names().
+    """
+    group_by = list(group_by)
+    rolled_up, logs = window_sources(since, **filters)
+
+    counts = {}
+    querysets = [rolled_up.values(*group_by).annotate(total=Sum('count')).order_by()]
+    querysets += [queryset.values(*group_by).annotate(total=Count('id')).order_by() for queryset in logs]
+    for rows in querysets:
+        for row in rows:
+            # Unknown countries are NULL in RequestLog but '' in the rollup
+            key = tuple('' if row[field] is None else row[field] for field in group_by)
+            counts[key] = counts.get(key, 0) + row['total']
+    return counts
+
+
+def windowed_ip_activity(since, route_ids):
+    """
+    Return {ip_address: (total requests, requests to any of `route_ids`)} since
+    the given time, using one conditional aggregate over the rollup and one
+    over each RequestLog part of the window.
+    """
+    rolled_up, logs = window_sources(since)
+
+    querysets = [
+        rolled_up
+        .values('ip_address')
+        .annotate(
+            total=Sum('count'),
+            matched=Sum('count', filter=Q(route__in=route_ids))
+        )
+        .order_by()
+    ]
+    querysets += [
+        queryset
+        .values('ip_address')
+        .annotate(
+            total=Count('id'),
+            matched=Count('id', filter=Q(route__in=route_ids))
+        )
+        .order_by()
+        for queryset in logs
+    ]
+
+    activity = {}
+    for rows in querysets:
+        for row in rows:
+            total, matched = activity.get(row['ip_address'], (0, 0))
+            activity[row['ip_address']] = (total + row['total'], matched + (row['matched'] or 0))
+    return activity
+
+
+def windowed_total(since, **filters):
+    """
+    Return the total number of requests since the given time (None for all time).
+    """
+    rolled_up, logs = window_sources(since, **filters)
+    return (rolled_up.aggregate(total=Sum('count'))['total'] or 0) + sum(queryset.count() for queryset in logs)
+
+
+def top_counts(since, field, limit=10, **filters):
+    """
+    Return the `limit` most frequent values of `field` since the given time,
+    as a list of {field: value, 'count': n} dicts.
+    """
+    counts = windowed_counts(since, [field], **filters)
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{field: key[0], 'count': count} for key, count in top]
+
+
+def latest_countries(since, ip_addresses):
+    """
+    Return the most recently seen country of each IP address in the rollup
+    since the given time, read in one query. Addresses with no known
+    country are left out; the window starts at the top of the hour.
+    """
+    rows = (
+        RequestRollup.objects
+        .filter(hour__gte=truncate_hour(since), ip_address__in=ip_addresses)
+        .exclude(country='')
+        .order_by('ip_address', '-hour', '-count')
+        .values_list('ip_address', 'country')
+    )
+    countries = {}
+    for ip_address, country in rows:
+        countries.setdefault(ip_address, country)
+    return countries
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .blocklist import blocklist_changed, get_blocklist
+from .counters import refresh_active_counts
+from .models import BlockedIP, SuspiciousIP
+
+
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+def blocked_ip_changed(sender, **kwargs):
+    """
+    Invalidate the blocklist in every worker whenever a BlockedIP row changes.
+    Covers the admin, the management commands and any other ORM save/delete.
+    """
+    blocklist_changed()
+    get_blocklist().invalidate()
+
+
+@receiver(post_save, sender=SuspiciousIP)
+@receiver(post_delete, sender=SuspiciousIP)
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+def active_ip_counts_changed(sender, **kwargs):
+    """
+    Keep the dashboard's active suspicious/blocked IP counters current.
+    """
+    refresh_active_counts()
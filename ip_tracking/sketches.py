@@ -0,0 +1,476 @@
+import atexit
+import hashlib
+import heapq
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import HeavyHitterSketch, UniqueVisitorSketch
+from .rollups import truncate_hour
+
+
+logger = logging.getLogger(__name__)
+
+
+IP_ADDRESS = 'ip_address'
+PATH = 'path'
+COUNTRY = 'country'
+
+DEFAULT_SKETCH_SETTINGS = {
+    'ENABLED': True,  # Update the sketches from the middleware
+    'CAPACITY': 500,  # Values tracked per dimension, hour and worker
+    'FLUSH_INTERVAL': 10,  # Seconds between writes of a worker's sketches
+    'RETENTION_HOURS': 48,  # Stored sketches older than this are deleted
+    'HLL_PRECISION': 12,  # 2**p one-byte registers per unique-visitor sketch (~1.6% error at 12)
+    'MAX_PATHS': 100,  # Paths per hour and worker with their own unique-visitor sketch
+}
+
+# Unique-visitor sketch path covering every request
+ALL_PATHS = ''
+
+
+def get_sketch_settings():
+    """
+    Return the sketch settings merged over the defaults.
+    """
+    return {**DEFAULT_SKETCH_SETTINGS, **getattr(settings, 'IP_TRACKING_SKETCHES', {})}
+
+
+def worker_name():
+    """
+    Identify this process in stored per-worker rows. Evaluated on every
+    write, so forked workers don't share a name.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary of the most frequent values in a stream.
+
+    At most `capacity` values are counted. A new value replaces the one with
+    the smallest count and inherits that count as its error, so every count
+    is an upper bound that overestimates by at most `error`, and any value
+    seen more than N / capacity times out of N is guaranteed to be present.
+    Summaries are mergeable, so per-worker and per-hour summaries can be
+    combined into one for any window.
+    """
+
+    def __init__(self, capacity, counters=()):
+        self.capacity = capacity
+        # value -> [count, error]
+        self.counters = {value: [count, error] for value, count, error in counters}
+        self._rebuild_heap()
+
+    def __len__(self):
+        return len(self.counters)
+
+    def update(self, value, weight=1):
+        """
+        Count `weight` occurrences of a value.
+        """
+        counters = self.counters
+        entry = counters.get(value)
+        if entry is not None:
+            entry[0] += weight
+        elif len(counters) < self.capacity:
+            entry = counters[value] = [weight, 0]
+        else:
+            victim, floor = self._pop_min()
+            del counters[victim]
+            entry = counters[value] = [floor + weight, floor]
+
+        # Entries for older counts stay in the heap and are skipped when popped
+        heapq.heappush(self._heap, (entry[0], value))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def floor(self):
+        """
+        Return the largest count an untracked value can have had.
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def merge(self, other):
+        """
+        Add another summary's counts to this one. A value missing from a
+        full summary is charged that summary's floor as count and error.
+        """
+        own_floor, other_floor = self.floor(), other.floor()
+        merged = []
+        for value in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(value, (own_floor, own_floor))
+            other_count, other_error = other.counters.get(value, (other_floor, other_floor))
+            merged.append((value, count + other_count, error + other_error))
+
+        merged.sort(key=lambda item: item[1], reverse=True)
+        self.counters = {value: [count, error] for value, count, error in merged[:self.capacity]}
+        self._rebuild_heap()
+
+    def top(self, limit=10):
+        """
+        Return the `limit` most frequent values as (value, count, error) tuples.
+        """
+        top = heapq.nlargest(limit, self.counters.items(), key=lambda item: item[1][0])
+        return [(value, count, error) for value, (count, error) in top]
+
+    def to_list(self):
+        return [[value, count, error] for value, (count, error) in self.counters.items()]
+
+    def _pop_min(self):
+        while True:
+            count, value = heapq.heappop(self._heap)
+            entry = self.counters.get(value)
+            if entry is not None and entry[0] == count:
+                return value, count
+
+    def _rebuild_heap(self):
+        self._heap = [(count, value) for value, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog estimate of the number of distinct values in a stream.
+
+    A value's 64-bit hash picks one of 2**precision registers, which keeps
+    the longest run of leading zeros seen in the rest of the hash. The
+    standard error is about 1.04 / sqrt(2**precision), whatever the number
+    of values. Two sketches of the same precision are unioned by taking the
+    maximum of each register. Registers are stored zlib-compressed: most of
+    them stay small, so they compress well even for busy sketches.
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Load a sketch written by to_bytes(). Uncompressed registers written
+        by older versions are also accepted: a register never exceeds 64,
+        so raw data cannot start with a zlib header byte (0x78).
+        """
+        registers = zlib.decompress(data) if data[:1] == b'x' else data
+        return cls(int(math.log2(len(registers))), registers)
+
+    @staticmethod
+    def hash(value):
+        """
+        Return the 64-bit hash of a string value.
+        """
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        return self.add_hash(self.hash(value))
+
+    def add_hash(self, value_hash):
+        """
+        Add a value by its hash (see hash()), so it can be added to several
+        sketches. Returns True if a register changed.
+        """
+        bits = 64 - self.precision
+        index = value_hash >> bits
+        rank = bits - (value_hash & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        """
+        Union another sketch of the same precision into this one.
+        """
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge precision {other.precision} into {self.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        """
+        Return the estimated number of distinct values added.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        return zlib.compress(self.registers)
+
+
+class HourlySketches:
+    """
+    Base class for per-worker sketches kept in memory, one per name and hour.
+
+    Updates only touch memory. Every FLUSH_INTERVAL the sketches changed
+    (see _changed) since the last write are upserted as this worker's rows of `model`, and
+    sketches of past hours are then dropped. Remaining sketches are written
+    when the worker exits.
+    """
+    model = None
+    unique_fields = []
+    update_fields = []
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sketches = {}
+        self._dirty = set()
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        """
+        Write every sketch changed since the last flush.
+        """
+        rows = self._take()
+        if not rows:
+            return
+        try:
+            self.model.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=self.unique_fields,
+                update_fields=self.update_fields
+            )
+        except Exception as e:
+            logger.error(f"Error writing {self.model._meta.verbose_name_plural}: {e}")
+
+    def clear(self):
+        """
+        Forget every sketch without writing it, e.g. before the database
+        it would be written to goes away.
+        """
+        with self._lock:
+            self._sketches = {}
+            self._dirty = set()
+
+    def new_sketch(self, config):
+        raise NotImplementedError
+
+    def to_row(self, name, hour, worker, sketch):
+        """
+        Return the model instance storing a sketch.
+        """
+        raise NotImplementedError
+
+    def _sketch(self, config, name, hour):
+        """
+        Return the sketch for a name and hour, creating it if needed.
+        Must be called with the lock held.
+        """
+        key = (name, hour)
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = self.new_sketch(config)
+        return sketch
+
+    def _changed(self, name, hour):
+        """
+        Mark a sketch to be written by the next flush. Must be called with
+        the lock held.
+        """
+        self._dirty.add((name, hour))
+
+    def _due(self, config):
+        return time.monotonic() - self._flushed_at >= config['FLUSH_INTERVAL']
+
+    def _take(self):
+        """
+        Snapshot the changed sketches as model instances and forget past hours.
+        """
+        current_hour = truncate_hour(timezone.now())
+        worker = worker_name()
+        with self._lock:
+            rows = [
+                self.to_row(name, hour, worker, self._sketches[(name, hour)])
+                for name, hour in self._dirty
+            ]
+            self._dirty = set()
+            self._sketches = {key: sketch for key, sketch in self._sketches.items() if key[1] >= current_hour}
+            self._flushed_at = time.monotonic()
+        return rows
+
+
+class HeavyHitters(HourlySketches):
+    """
+    Per-worker Space-Saving summaries of request IP addresses, paths and
+    countries, one per dimension and hour, stored as HeavyHitterSketch rows.
+    """
+    model = HeavyHitterSketch
+    unique_fields = ['dimension', 'hour', 'worker']
+    update_fields = ['counters', 'updated_at']
+
+    def record(self, ip_address, path, country=None):
+        """
+        Count one request, writing the summaries if FLUSH_INTERVAL has passed.
+        """
+        if self._record(ip_address, path, country):
+            self.flush()
+
+    def add(self, dimension, value, weight=1, hour=None):
+        """
+        Count `weight` occurrences of a value in one dimension.
+        """
+        config = get_sketch_settings()
+        hour = hour or truncate_hour(timezone.now())
+        with self._lock:
+            self._sketch(config, dimension, hour).update(value, weight)
+            self._changed(dimension, hour)
+
+    def new_sketch(self, config):
+        return SpaceSaving(config['CAPACITY'])
+
+    def to_row(self, name, hour, worker, sketch):
+        return HeavyHitterSketch(dimension=name, hour=hour, worker=worker, counters=sketch.to_list())
+
+    def _record(self, ip_address, path, country):
+        """
+        Update the summaries and return True if it is time to flush.
+        """
+        config = get_sketch_settings()
+        if not config['ENABLED']:
+            return False
+        hour = truncate_hour(timezone.now())
+        with self._lock:
+            self._sketch(config, IP_ADDRESS, hour).update(ip_address)
+            self._changed(IP_ADDRESS, hour)
+            self._sketch(config, PATH, hour).update(path)
+            self._changed(PATH, hour)
+            if country:
+                self._sketch(config, COUNTRY, hour).update(country)
+                self._changed(COUNTRY, hour)
+            return self._due(config)
+
+
+class UniqueVisitors(HourlySketches):
+    """
+    Per-worker HyperLogLog sketches of distinct client IPs per hour, overall
+    and for each of the first MAX_PATHS paths requested in the hour, stored
+    as UniqueVisitorSketch rows. Later paths are only counted overall.
+    Most requests come from clients already counted and change no
+    register, so only sketches whose registers changed are rewritten.
+    """
+    model = UniqueVisitorSketch
+    unique_fields = ['hour', 'path', 'worker']
+    update_fields = ['registers', 'updated_at']
+
+    def __init__(self):
+        super().__init__()
+        self._paths = {}  # hour -> number of path sketches
+
+    def record(self, ip_address, path):
+        """
+        Count one request, writing the sketches if FLUSH_INTERVAL has passed.
+        """
+        if self._record(ip_address, path):
+            self.flush()
+
+    def new_sketch(self, config):
+        return HyperLogLog(config['HLL_PRECISION'])
+
+    def to_row(self, name, hour, worker, sketch):
+        return UniqueVisitorSketch(hour=hour, path=name, worker=worker, registers=sketch.to_bytes())
+
+    def _record(self, ip_address, path):
+        """
+        Update the sketches and return True if it is time to flush.
+        """
+        config = get_sketch_settings()
+        if not config['ENABLED']:
+            return False
+        hour = truncate_hour(timezone.now())
+        ip_hash = HyperLogLog.hash(ip_address)
+        with self._lock:
+            if self._sketch(config, ALL_PATHS, hour).add_hash(ip_hash):
+                self._changed(ALL_PATHS, hour)
+            tracked = (path, hour) in self._sketches
+            if not tracked and self._paths.get(hour, 0) < config['MAX_PATHS']:
+                self._paths[hour] = self._paths.get(hour, 0) + 1
+                tracked = True
+            if tracked and self._sketch(config, path, hour).add_hash(ip_hash):
+                self._changed(path, hour)
+            return self._due(config)
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self._paths = {}
+
+    def _take(self):
+        rows = super()._take()
+        current_hour = truncate_hour(timezone.now())
+        with self._lock:
+            self._paths = {hour: count for hour, count in self._paths.items() if hour >= current_hour}
+        return rows
+
+
+def top_values(dimension, since, limit=10):
+    """
+    Return the `limit` most frequent values of a dimension since the given
+    time as (value, count, error) tuples, by merging the stored summaries of
+    every worker for the hours since `since`. Counts are upper bounds that
+    overestimate by at most `error`; the window starts at the top of the hour.
+    """
+    capacity = get_sketch_settings()['CAPACITY']
+    rows = (
+        HeavyHitterSketch.objects
+        .filter(dimension=dimension, hour__gte=truncate_hour(since))
+        .values_list('counters', flat=True)
+    )
+    merged = SpaceSaving(capacity)
+    for counters in rows.iterator():
+        merged.merge(SpaceSaving(capacity, counters))
+    return merged.top(limit)
+
+
+def unique_clients(since, paths=(ALL_PATHS,)):
+    """
+    Return the estimated number of distinct client IPs that requested any of
+    `paths` (default: any path) since the given time, by unioning the stored
+    sketches of every worker, hour and path. The cost depends on the number
+    of stored sketches, not the number of requests; the window starts at the
+    top of the hour.
+    """
+    precision = get_sketch_settings()['HLL_PRECISION']
+    rows = (
+        UniqueVisitorSketch.objects
+        .filter(hour__gte=truncate_hour(since), path__in=paths)
+        .values_list('registers', flat=True)
+    )
+    union = HyperLogLog(precision)
+    for registers in rows.iterator():
+        sketch = HyperLogLog.from_bytes(bytes(registers))
+        if sketch.precision != precision:
+            # Written before HLL_PRECISION was changed
+            continue
+        union.merge(sketch)
+    return union.count()
+
+
+def delete_old_sketches():
+    """
+    Delete stored sketches older than RETENTION_HOURS. Returns the number deleted.
+    """
+    cutoff = truncate_hour(timezone.now() - timedelta(hours=get_sketch_settings()['RETENTION_HOURS']))
+    deleted, _ = HeavyHitterSketch.objects.filter(hour__lt=cutoff).delete()
+    deleted_visitors, _ = UniqueVisitorSketch.objects.filter(hour__lt=cutoff).delete()
+    return deleted + deleted_visitors
+
+
+# Shared per-process sketches used by the middleware
+heavy_hitters = HeavyHitters()
+atexit.register(heavy_hitters.flush)
+unique_visitors = UniqueVisitors()
+atexit.register(unique_visitors.flush)
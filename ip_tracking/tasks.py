@@ -1,137 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
 from celery import shared_task
+from django.core.cache import cache
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Count, Q
-from .models import RequestLog, SuspiciousIP
+from .geolocation import resolve_geolocation
+from .models import BlockedIP, RequestLog, SuspiciousIP
+from . import archive, counters, paths, rollups, sketches
+from .blocklist import blocklist_changed
+from .detection import get_detection_settings, save_suspicious_ips
 
 
 @shared_task
 def detect_suspicious_ips():
     """
     Celery task to detect suspicious IP addresses based on:
-    1. IPs exceeding 100 requests/hour
+    1. IPs exceeding REQUEST_THRESHOLD requests/hour
     2. IPs accessing sensitive paths (admin, login, etc.)
     
+    IPs are also flagged in real time by the middleware; this task is the
+    reconciliation pass over the stored logs, using the same thresholds
+    and sensitive paths (IP_TRACKING_DETECTION).
+    Whole hours are counted from the hourly rollup, and the partial hour at
+    the start of the window and the rows not yet rolled up from RequestLog,
+    so the window is exactly the last hour. Detection uses a
+    fixed number of aggregate queries and all flags are written with bulk
+    upserts (see save_suspicious_ips), however many IPs are flagged.
     This task should be run hourly.
     """
-    from django.utils import timezone
-    from datetime import timedelta
+    now = timezone.now()
     
     # Get the time range for the last hour
-    one_hour_ago = timezone.now() - timedelta(hours=1)
+    one_hour_ago = now - timedelta(hours=1)
     
-    # Define sensitive paths
-    sensitive_paths = ['/admin/', '/login/', '/sensitive-data/', '/admin-dashboard/']
+    # Thresholds and sensitive paths shared with the middleware, matched
+    # against the logged routes by RequestPath id
+    config = get_detection_settings()
+    request_threshold = config['REQUEST_THRESHOLD']
+    sensitive_routes = paths.route_ids(config['SENSITIVE_PATHS'])
     
-    # 1. Find IPs with more than 100 requests in the last hour
-    high_volume_ips = (
-        RequestLog.objects
-        .filter(timestamp__gte=one_hour_ago)
-        .values('ip_address')
-        .annotate(request_count=Count('id'))
-        .filter(request_count__gt=100)
-    )
+    # Bring the hourly rollup up to date; newer rows are read from RequestLog
+    rollups.update_request_rollups()
     
-    # 2. Find IPs accessing sensitive paths in the last hour
-    sensitive_access_ips = (
-        RequestLog.objects
-        .filter(
-            timestamp__gte=one_hour_ago,
-            path__in=sensitive_paths
-        )
-        .values('ip_address')
-        .annotate(sensitive_count=Count('id'))
-        .filter(sensitive_count__gt=0)
+    # Total and sensitive request counts per IP, in one conditional aggregate
+    activity = rollups.windowed_ip_activity(one_hour_ago, list(sensitive_routes))
+    
+    # Distinct sensitive paths accessed per IP
+    sensitive_paths_by_ip = {}
+    sensitive_counts = rollups.windowed_counts(
+        one_hour_ago,
+        ['ip_address', 'route'],
+        route__in=list(sensitive_routes)
     )
+    for ip_address, route_id in sensitive_counts:
+        sensitive_paths_by_ip.setdefault(ip_address, []).append(sensitive_routes[route_id])
     
-    # Process high volume IPs
-    for ip_data in high_volume_ips:
-        ip_address = ip_data['ip_address']
-        request_count = ip_data['request_count']
-        
-        # Get the sensitive paths accessed by this IP
-        sensitive_paths_accessed = list(
-            RequestLog.objects
-            .filter(
-                ip_address=ip_address,
-                timestamp__gte=one_hour_ago,
-                path__in=sensitive_paths
-            )
-            .values_list('path', flat=True)
-            .distinct()
-        )
-        
-        reason = f"High volume: {request_count} requests in 1 hour"
-        if sensitive_paths_accessed:
-            reason += f" + accessed sensitive paths: {', '.join(sensitive_paths_accessed)}"
-        
-        # Create or update SuspiciousIP record
-        suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-            ip_address=ip_address,
-            defaults={
-                'reason': reason,
-                'request_count': request_count,
-                'sensitive_paths': sensitive_paths_accessed,
-                'is_active': True
-            }
-        )
+    flagged = []
+    high_volume_count = 0
+    sensitive_access_count = 0
+    for ip_address, (request_count, sensitive_count) in activity.items():
+        sensitive_paths_accessed = sorted(sensitive_paths_by_ip.get(ip_address, []))
         
-        if not created:
-            # Update existing record
-            suspicious_ip.reason = reason
-            suspicious_ip.request_count = request_count
-            suspicious_ip.sensitive_paths = sensitive_paths_accessed
-            suspicious_ip.detected_at = timezone.now()
-            suspicious_ip.is_active = True
-            suspicious_ip.save()
-    
-    # Process IPs accessing sensitive paths (even if not high volume)
-    for ip_data in sensitive_access_ips:
-        ip_address = ip_data['ip_address']
-        sensitive_count = ip_data['sensitive_count']
-        
-        # Skip if already processed as high volume
-        if SuspiciousIP.objects.filter(ip_address=ip_address, is_active=True).exists():
+        if request_count > request_threshold:
+            # 1. High volume, possibly also accessing sensitive paths
+            high_volume_count += 1
+            reason = f"High volume: {request_count} requests in 1 hour"
+            if sensitive_paths_accessed:
+                reason += f" + accessed sensitive paths: {', '.join(sensitive_paths_accessed)}"
+        elif sensitive_count > 0:
+            # 2. Sensitive path access (even if not high volume)
+            reason = f"Accessed sensitive paths: {', '.join(sensitive_paths_accessed)} ({sensitive_count} times)"
+            request_count = sensitive_count
+        else:
             continue
         
-        # Get all paths accessed by this IP in the last hour
-        all_paths = list(
-            RequestLog.objects
-            .filter(
-                ip_address=ip_address,
-                timestamp__gte=one_hour_ago
-            )
-            .values_list('path', flat=True)
-            .distinct()
-        )
-        
-        # Get the sensitive paths accessed
-        sensitive_paths_accessed = [path for path in all_paths if path in sensitive_paths]
-        
-        reason = f"Accessed sensitive paths: {', '.join(sensitive_paths_accessed)} ({sensitive_count} times)"
+        if sensitive_count > 0:
+            sensitive_access_count += 1
         
-        # Create SuspiciousIP record
-        SuspiciousIP.objects.create(
+        flagged.append(SuspiciousIP(
             ip_address=ip_address,
-            reason=reason,
-            request_count=sensitive_count,
+            reason=reason[:255],
+            request_count=request_count,
             sensitive_paths=sensitive_paths_accessed,
+            detected_at=now,
             is_active=True
-        )
+        ))
+    
+    # Create or update all SuspiciousIP records in bulk, refreshing their
+    # reason unless an operator wrote it
+    save_suspicious_ips(flagged)
+    counters.refresh_active_counts()
     
     # Log the results
     total_suspicious = SuspiciousIP.objects.filter(is_active=True).count()
-    new_suspicious = SuspiciousIP.objects.filter(
-        detected_at__gte=one_hour_ago,
-        is_active=True
-    ).count()
     
     return {
         'status': 'success',
         'total_suspicious_ips': total_suspicious,
-        'new_suspicious_ips': new_suspicious,
-        'high_volume_count': len(high_volume_ips),
-        'sensitive_access_count': len(sensitive_access_ips)
+        'new_suspicious_ips': len(flagged),
+        'high_volume_count': high_volume_count,
+        'sensitive_access_count': sensitive_access_count
     }
 
 
@@ -151,6 +118,7 @@ def cleanup_old_suspicious_ips():
         detected_at__lt=twenty_four_hours_ago,
         is_active=True
     ).update(is_active=False)
+    counters.refresh_active_counts()
     
     return {
         'status': 'success',
@@ -162,6 +130,11 @@ def cleanup_old_suspicious_ips():
 def generate_security_report():
     """
     Generate a security report with statistics.
+    Request counts are read from the hourly rollup plus RequestLog for the
+    partial hours (see rollups.window_sources), and
+    the top IPs, paths and countries from the heavy-hitter sketches when
+    they are enabled, with the top IPs' countries looked up in the rollup in
+    one query. Unique-client counts are HyperLogLog estimates.
     """
     from django.utils import timezone
     from datetime import timedelta
@@ -170,30 +143,49 @@ def generate_security_report():
     last_24_hours = now - timedelta(hours=24)
     last_hour = now - timedelta(hours=1)
     
+    # Bring the hourly rollup up to date; newer rows are read from RequestLog
+    rollups.update_request_rollups()
+    
     # Get statistics
-    total_requests_24h = RequestLog.objects.filter(timestamp__gte=last_24_hours).count()
-    total_requests_1h = RequestLog.objects.filter(timestamp__gte=last_hour).count()
+    total_requests_24h = rollups.windowed_total(last_24_hours)
+    total_requests_1h = rollups.windowed_total(last_hour)
     
     active_suspicious = SuspiciousIP.objects.filter(is_active=True).count()
     active_blocked = BlockedIP.objects.filter(is_active=True).count()
     
-    # Top countries by request count
-    top_countries = (
-        RequestLog.objects
-        .filter(timestamp__gte=last_24_hours, country__isnull=False)
-        .values('country')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:10]
-    )
-    
-    # Top IPs by request count
-    top_ips = (
-        RequestLog.objects
-        .filter(timestamp__gte=last_24_hours)
-        .values('ip_address', 'country', 'city')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:10]
-    )
+    if sketches.get_sketch_settings()['ENABLED']:
+        # Top-K from the merged per-worker sketches; counts are upper bounds
+        top_countries = [
+            {'country': country, 'count': count}
+            for country, count, _ in sketches.top_values(sketches.COUNTRY, last_24_hours)
+        ]
+        top_paths = [
+            {'path': path, 'count': count, 'unique_clients': sketches.unique_clients(last_24_hours, [path])}
+            for path, count, _ in sketches.top_values(sketches.PATH, last_24_hours)
+        ]
+        top_ip_counts = sketches.top_values(sketches.IP_ADDRESS, last_24_hours)
+        countries = rollups.latest_countries(last_24_hours, [ip_address for ip_address, _, _ in top_ip_counts])
+        top_ips = [
+            {'ip_address': ip_address, 'country': countries.get(ip_address, ''), 'count': count}
+            for ip_address, count, _ in top_ip_counts
+        ]
+    else:
+        # Top countries by request count
+        top_countries = [
+            row for row in rollups.top_counts(last_24_hours, 'country', limit=11)
+            if row['country']
+        ][:10]
+        
+        route_counts = rollups.top_counts(last_24_hours, 'route')
+        route_names = paths.route_names([row['route'] for row in route_counts])
+        top_paths = [{'path': route_names[row['route']], 'count': row['count']} for row in route_counts]
+        
+        # Top IPs by request count
+        ip_counts = rollups.windowed_counts(last_24_hours, ['ip_address', 'country'])
+        top_ips = [
+            {'ip_address': ip_address, 'country': country, 'count': count}
+            for (ip_address, country), count in sorted(ip_counts.items(), key=lambda item: item[1], reverse=True)[:10]
+        ]
     
     return {
         'status': 'success',
@@ -203,7 +195,165 @@ def generate_security_report():
             'total_requests_1h': total_requests_1h,
             'active_suspicious_ips': active_suspicious,
             'active_blocked_ips': active_blocked,
+            'unique_clients_24h': sketches.unique_clients(last_24_hours),
+            'unique_clients_1h': sketches.unique_clients(last_hour),
         },
-        'top_countries': list(top_countries),
-        'top_ips': list(top_ips)
+        'top_countries': top_countries,
+        'top_paths': top_paths,
+        'top_ips': top_ips
+    }
+
+
+# Last address of the previous backfill batch
+BACKFILL_CURSOR_KEY = 'ip_tracking:geolocation_backfill_cursor'
+
+
+@shared_task
+def backfill_geolocation(batch_size=500, max_workers=8):
+    """
+    Fill in country and city for request logs written without geolocation.
+
+    Collects up to batch_size distinct unresolved IPs, resolves them with at
+    most max_workers concurrent lookups, and updates every matching row with
+    one UPDATE per IP. Addresses with no location (private IPs, unknown
+    ranges) are stored as empty strings so they are not selected again;
+    failed lookups stay NULL and are retried on the next pass. Resolved
+    requests are added to the current hour's country sketch.
+
+    Batches walk the unresolved IPs in address order from where the
+    previous run stopped (a cursor in the cache) and start over after the
+    last one, so addresses that keep failing cannot take up every batch.
+    """
+    cursor = cache.get(BACKFILL_CURSOR_KEY)
+    unresolved = (
+        RequestLog.objects
+        .filter(country__isnull=True)
+        .order_by('ip_address')
+        .values_list('ip_address', flat=True)
+        .distinct()
+    )
+    if cursor:
+        unresolved = unresolved.filter(ip_address__gt=cursor)
+    unresolved_ips = list(unresolved[:batch_size])
+    
+    # A short batch reached the last address; start over on the next run
+    cache.set(BACKFILL_CURSOR_KEY, unresolved_ips[-1] if len(unresolved_ips) == batch_size else None, None)
+    
+    if not unresolved_ips:
+        return {
+            'status': 'success',
+            'resolved_ips': 0,
+            'failed_ips': 0,
+            'updated_rows': 0
+        }
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(resolve_geolocation, unresolved_ips))
+    
+    resolved = 0
+    failed = 0
+    updated_rows = 0
+    for ip_address, geolocation_data in zip(unresolved_ips, results):
+        if geolocation_data is None:
+            failed += 1
+            continue
+        
+        country, city = geolocation_data
+        updated = (
+            RequestLog.objects
+            .filter(ip_address=ip_address, country__isnull=True)
+            .update(country=country or '', city=city or '')
+        )
+        if country and updated:
+            # Requests are counted by country once their location is known
+            sketches.heavy_hitters.add(sketches.COUNTRY, country, updated)
+        updated_rows += updated
+        resolved += 1
+    
+    sketches.heavy_hitters.flush()
+    
+    return {
+        'status': 'success',
+        'resolved_ips': resolved,
+        'failed_ips': failed,
+        'updated_rows': updated_rows
+    }
+
+
+@shared_task
+def update_request_rollups():
+    """
+    Fold new request logs into the hourly RequestRollup table.
+    """
+    processed = rollups.update_request_rollups()
+    
+    return {
+        'status': 'success',
+        'processed_rows': processed
+    }
+
+
+@shared_task
+def expire_blocked_ips():
+    """
+    Deactivate blocks whose expires_at has passed, in a single UPDATE.
+    Workers already stop enforcing them at expiry from their in-memory
+    snapshots; this keeps the table in step and lets snapshots drop them.
+    """
+    expired_count = BlockedIP.objects.filter(
+        is_active=True,
+        expires_at__lte=timezone.now()
+    ).update(is_active=False)
+    
+    # update() bypasses the model signals
+    if expired_count:
+        blocklist_changed()
+        counters.refresh_active_counts()
+    
+    return {
+        'status': 'success',
+        'expired_count': expired_count
+    }
+
+
+@shared_task
+def reconcile_counters():
+    """
+    Reset the dashboard counters to the true counts, correcting drift from
+    lost or double-counted increments.
+    """
+    values = counters.reconcile_counters()
+    
+    return {
+        'status': 'success',
+        'counters': values
+    }
+
+
+@shared_task
+def archive_old_request_logs():
+    """
+    Archive request logs older than the retention window to compressed
+    daily segments and delete them from the database.
+    """
+    segments = archive.archive_request_logs()
+    
+    return {
+        'status': 'success',
+        'segments': [str(path) for path, _ in segments],
+        'archived_rows': sum(count for _, count in segments)
+    }
+
+
+@shared_task
+def cleanup_old_sketches():
+    """
+    Delete stored heavy-hitter and unique-visitor sketches older than the
+    retention window.
+    """
+    deleted_count = sketches.delete_old_sketches()
+    
+    return {
+        'status': 'success',
+        'deleted_count': deleted_count
     }
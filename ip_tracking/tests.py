@@ -0,0 +1,1258 @@
+import gzip
+import json
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from .fields import pack_ip
+from . import archive, counters, detection, middleware, paths, ratelimit, rollups, sketches, tasks
+from .blocklist import BlocklistSnapshot, NetworkIndex, blocklist_changed, get_blocklist_version
+from .client_ip import ClientIPResolver
+from .admin import CountryFilter, EstimatedCountPaginator
+from .compiled_blocklist import CompiledBlocklist
+from .geolocation import RangeDatabase
+from .log_buffer import RequestLogBuffer
+from .models import (
+    BlockedIP, HeavyHitterSketch, RequestLog, RequestPath, RequestRollup, SuspiciousIP, TrafficCounter,
+    UniqueVisitorSketch,
+)
+
+
+def reset_worker_state():
+    """
+    Forget per-process state that refers to rows of earlier tests.
+    """
+    cache.clear()
+    # Interned RequestPath rows are rolled back with each test
+    paths._normalizer = None
+    discard_pending_writes()
+
+
+def discard_pending_writes():
+    """
+    Drop the shared counter deltas and sketches that requests in the tests
+    left pending. They are otherwise written at exit, when the test
+    database is gone.
+    """
+    counters.pending_counters.clear()
+    sketches.heavy_hitters.clear()
+    sketches.unique_visitors.clear()
+
+
+def tearDownModule():
+    discard_pending_writes()
+
+
+# URLconf with a parameterized route, for the path normalization tests
+urlpatterns = [
+    path('users/<int:user_id>/', lambda request, user_id: HttpResponse()),
+    path('', include('ip_tracking.urls')),
+]
+
+
+class BlockIPCommandTests(TestCase):
+    """
+    Networks sharing a base address are separate blocks.
+    """
+
+    def setUp(self):
+        reset_worker_state()
+
+    def call(self, *args):
+        call_command(*args, stdout=StringIO(), stderr=StringIO())
+
+    def blocks(self):
+        return set(BlockedIP.objects.values_list('ip_address', 'prefix_length', 'is_active'))
+
+    def test_overlapping_prefixes_are_separate_rows(self):
+        self.call('block_ip', '10.0.0.0/16')
+        self.call('block_ip', '10.0.0.0/8')
+        self.call('block_ip', '10.0.0.0')
+
+        self.assertEqual(self.blocks(), {
+            ('10.0.0.0', 16, True),
+            ('10.0.0.0', 8, True),
+            ('10.0.0.0', None, True),
+        })
+
+    def test_reblocking_updates_only_the_matching_network(self):
+        self.call('block_ip', '10.0.0.0/8')
+        self.call('block_ip', '10.0.0.0/16', '--inactive')
+        self.call('block_ip', '10.0.0.0/16')
+
+        self.assertEqual(self.blocks(), {('10.0.0.0', 8, True), ('10.0.0.0', 16, True)})
+
+    def test_unblock_matches_the_prefix(self):
+        self.call('block_ip', '10.0.0.0')
+        self.call('block_ip', '10.0.0.0/8')
+
+        with self.assertRaises(CommandError):
+            self.call('unblock_ip', '10.0.0.0/24')
+        self.assertEqual(self.blocks(), {('10.0.0.0', None, True), ('10.0.0.0', 8, True)})
+
+        self.call('unblock_ip', '10.0.0.0/32')
+        self.assertEqual(self.blocks(), {('10.0.0.0', None, False), ('10.0.0.0', 8, True)})
+
+        self.call('unblock_ip', '10.0.0.0/8', '--delete')
+        self.assertEqual(self.blocks(), {('10.0.0.0', None, False)})
+
+    def test_import_keeps_overlapping_prefixes(self):
+        self.call('block_ip', '10.0.0.0/16', '--inactive')
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('10.0.0.0/8\n10.0.0.0/16\n10.0.0.0\n10.0.0.0/8\n')
+        self.addCleanup(os.unlink, f.name)
+
+        self.call('import_blocklist', f.name)
+
+        self.assertEqual(self.blocks(), {
+            ('10.0.0.0', 8, True),
+            ('10.0.0.0', 16, True),
+            ('10.0.0.0', None, True),
+        })
+        # The reactivated row keeps its own network bounds
+        self.assertEqual(
+            BlockedIP.objects.get(ip_address='10.0.0.0', prefix_length=16).network_end,
+            pack_ip('10.0.255.255')
+        )
+
+    def test_list_rejects_non_positive_limits(self):
+        for limit in ('0', '-1'):
+            with self.assertRaisesMessage(CommandError, 'Invalid --limit value'):
+                self.call('list_blocked_ips', '--limit', limit)
+
+
+class BlocklistImportExportTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'blocklist.txt')
+
+    def export(self, *args):
+        stdout = StringIO()
+        call_command('export_blocklist', *args, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue().splitlines()
+
+    def import_lines(self, lines, *args):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(''.join(f'{line}\n' for line in lines))
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_blocklist', self.path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_round_trip(self):
+        BlockedIP.objects.create(ip_address='192.0.2.5')
+        BlockedIP.objects.create(ip_address='198.51.100.0', prefix_length=24)
+        BlockedIP.objects.create(ip_address='2001:db8::', prefix_length=64)
+        BlockedIP.objects.create(ip_address='203.0.113.9', is_active=False)
+        BlockedIP.objects.create(ip_address='203.0.113.10', expires_at=timezone.now() - timedelta(seconds=1))
+        exported = self.export()
+        self.assertEqual(exported, ['192.0.2.5', '198.51.100.0/24', '2001:db8::/64'])
+        self.assertEqual(len(self.export('--include-inactive')), 5)
+
+        BlockedIP.objects.all().delete()
+        self.import_lines(exported)
+        self.assertEqual(self.export(), exported)
+
+    def test_import_conflicts(self):
+        BlockedIP.objects.create(ip_address='192.0.2.5')
+        BlockedIP.objects.create(ip_address='203.0.113.9', is_active=False, reason='Old reason')
+
+        output, errors = self.import_lines([
+            '# Feed header',
+            '192.0.2.5/32',  # Already blocked, written as a /32
+            '203.0.113.9',  # Inactive: reactivated, keeping its reason
+            '198.51.100.7/24  # Host bits are masked off',
+            '198.51.100.0/24',
+            'not-an-ip',
+        ])
+
+        self.assertIn('1 created, 1 reactivated, 2 already blocked, 1 invalid', output)
+        self.assertIn("Line 6: invalid IP address or network 'not-an-ip'", errors)
+        self.assertEqual(
+            set(BlockedIP.objects.values_list('ip_address', 'prefix_length', 'is_active', 'reason')),
+            {
+                ('192.0.2.5', None, True, None),
+                ('203.0.113.9', None, True, 'Old reason'),
+                ('198.51.100.0', 24, True, ''),
+            }
+        )
+
+    def test_import_counts_rows_inserted_by_another_writer_as_unchanged(self):
+        bulk_update = BlockedIP.objects.bulk_update
+
+        def insert_concurrently(*args, **kwargs):
+            # Another import inserts one of the new networks after the lookup
+            BlockedIP.objects.bulk_create([BlockedIP(ip_address='198.51.100.0', prefix_length=24)])
+            return bulk_update(*args, **kwargs)
+
+        with mock.patch.object(BlockedIP.objects, 'bulk_update', side_effect=insert_concurrently):
+            output, _ = self.import_lines(['198.51.100.0/24', '192.0.2.5'])
+
+        self.assertIn('1 created, 0 reactivated, 1 already blocked, 0 invalid', output)
+        self.assertEqual(BlockedIP.objects.count(), 2)
+
+
+class RequestLogBufferTests(SimpleTestCase):
+
+    def test_stats_are_exact_under_concurrent_enqueues(self):
+        log_buffer = RequestLogBuffer()
+        # No flusher thread, so the queue only fills up
+        log_buffer._queue = queue.Queue(maxsize=100)
+        log_buffer._ensure_started = lambda: None
+
+        def enqueue_many():
+            for _ in range(5000):
+                log_buffer.enqueue(object(), block=False)
+
+        threads = [threading.Thread(target=enqueue_many) for _ in range(8)]
+        with self.assertLogs('ip_tracking.log_buffer', 'WARNING'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        stats = log_buffer.stats
+        self.assertEqual(stats['enqueued'], 100)
+        self.assertEqual(stats['dropped'], 8 * 5000 - 100)
+
+
+class AsyncMiddlewareTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_async_path_defers_work_to_the_log_buffer(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        ip_logging = middleware.IPLoggingMiddleware(get_response)
+        log_buffer = mock.Mock()
+        detector = mock.Mock()
+        with mock.patch.multiple(
+            middleware,
+            request_log_buffer=log_buffer,
+            detector=detector,
+            heavy_hitters=mock.Mock(),
+            unique_visitors=mock.Mock(),
+        ):
+            request = RequestFactory().get('/test/', REMOTE_ADDR='198.51.100.7')
+            async_to_sync(ip_logging)(request)
+
+            # Nothing was written or counted on the event loop
+            self.assertFalse(RequestLog.objects.exists())
+            detector.record.assert_not_called()
+            log_buffer.enqueue.assert_called_once()
+            request_log = log_buffer.enqueue.call_args.args[0]
+            process = log_buffer.enqueue.call_args.kwargs['process']
+            self.assertEqual(request_log.ip_address, '198.51.100.7')
+
+            # The flusher thread does it before writing the entry
+            process(request_log)
+            detector.record.assert_called_once_with('198.51.100.7', '/test/')
+
+    def request(self, ip_address, log_buffer):
+        async def get_response(request):
+            return HttpResponse()
+
+        ip_logging = middleware.IPLoggingMiddleware(get_response)
+        detector = mock.Mock()
+        with mock.patch.multiple(
+            middleware,
+            request_log_buffer=log_buffer,
+            detector=detector,
+            heavy_hitters=mock.Mock(),
+            unique_visitors=mock.Mock(),
+        ):
+            async_to_sync(ip_logging)(RequestFactory().get('/test/', REMOTE_ADDR=ip_address))
+        return detector
+
+    def test_writes_and_tracks_directly_without_the_log_buffer(self):
+        detector = self.request('198.51.100.7', mock.Mock(enabled=False))
+
+        self.assertEqual(RequestLog.objects.get().ip_address, '198.51.100.7')
+        detector.record.assert_called_once_with('198.51.100.7', '/test/')
+
+    def test_tracks_entries_dropped_by_a_full_log_buffer(self):
+        log_buffer = mock.Mock(enabled=True)
+        log_buffer.enqueue.return_value = False
+        detector = self.request('198.51.100.7', log_buffer)
+
+        self.assertFalse(RequestLog.objects.exists())
+        detector.record.assert_called_once_with('198.51.100.7', '/test/')
+
+
+class BackfillGeolocationTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        route = RequestPath.objects.create(route='/test/')
+        for ip_address in ['198.51.100.1', '198.51.100.2', '198.51.100.3', '198.51.100.4']:
+            RequestLog.objects.create(ip_address=ip_address, route=route)
+
+    def test_failing_addresses_do_not_starve_the_rest(self):
+        def resolve(ip_address):
+            if ip_address in ('198.51.100.1', '198.51.100.2'):
+                return None
+            return 'Testland', 'Testville'
+
+        with mock.patch.object(tasks, 'resolve_geolocation', side_effect=resolve):
+            first = tasks.backfill_geolocation(batch_size=2)
+            second = tasks.backfill_geolocation(batch_size=2)
+
+        self.assertEqual((first['resolved_ips'], first['failed_ips']), (0, 2))
+        self.assertEqual((second['resolved_ips'], second['failed_ips']), (2, 0))
+        self.assertEqual(
+            set(RequestLog.objects.filter(country='Testland').values_list('ip_address', flat=True)),
+            {'198.51.100.3', '198.51.100.4'}
+        )
+
+        # Once past the last address, the failed ones are retried
+        with mock.patch.object(tasks, 'resolve_geolocation', return_value=('Testland', '')):
+            tasks.backfill_geolocation(batch_size=2)
+            tasks.backfill_geolocation(batch_size=2)
+        self.assertFalse(RequestLog.objects.filter(country__isnull=True).exists())
+
+
+class MetricsViewTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_allowed_networks_and_staff_only(self):
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.5').status_code, 200)
+
+
+class LogsAPIViewTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/logs/api/').status_code, 302)
+
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.client.get('/logs/api/').status_code, 302)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get('/logs/api/').status_code, 200)
+
+    def test_invalid_datetimes_are_bad_requests(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        for value in ('yesterday', '2024-13-01T00:00', '2024-02-30T00:00'):
+            with self.subTest(value=value):
+                response = self.client.get('/logs/api/', {'since': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': "Invalid since: expected an ISO 8601 datetime"})
+
+
+class WindowedCountTests(TestCase):
+
+    def setUp(self):
+        self.route = RequestPath.objects.create(route='/test/')
+
+    def log(self, ip_address, hour, minute):
+        RequestLog.objects.create(
+            ip_address=ip_address,
+            route=self.route,
+            timestamp=datetime(2024, 1, 1, hour, minute, tzinfo=dt_timezone.utc)
+        )
+
+    @override_settings(IP_TRACKING_ROLLUPS={'SETTLE_SECONDS': 0})
+    def test_window_starts_exactly_at_since(self):
+        self.log('198.51.100.1', 10, 10)
+        self.log('198.51.100.1', 10, 40)
+        self.log('198.51.100.2', 11, 15)
+        rollups.update_request_rollups()
+        # Not rolled up yet
+        self.log('198.51.100.2', 10, 50)
+
+        since = datetime(2024, 1, 1, 10, 30, tzinfo=dt_timezone.utc)
+        self.assertEqual(rollups.windowed_total(since), 3)
+        self.assertEqual(
+            rollups.windowed_counts(since, ['ip_address']),
+            {('198.51.100.1',): 1, ('198.51.100.2',): 2}
+        )
+        self.assertEqual(
+            rollups.windowed_ip_activity(since, [self.route.id]),
+            {'198.51.100.1': (1, 1), '198.51.100.2': (2, 2)}
+        )
+        self.assertEqual(rollups.windowed_total(None), 4)
+
+    @override_settings(IP_TRACKING_ROLLUPS={'SETTLE_SECONDS': 300})
+    def test_watermark_stops_before_unsettled_rows(self):
+        now = timezone.now()
+        settled = now - timedelta(minutes=10)
+        RequestLog.objects.create(ip_address='198.51.100.1', route=self.route, timestamp=settled)
+        # Written out of timestamp order: a recent row between settled ones
+        recent = RequestLog.objects.create(ip_address='198.51.100.2', route=self.route, timestamp=now)
+        RequestLog.objects.create(ip_address='198.51.100.3', route=self.route, timestamp=settled)
+
+        self.assertEqual(rollups.update_request_rollups(), 1)
+        self.assertEqual(rollups.get_watermark(), recent.id - 1)
+        self.assertEqual(set(RequestRollup.objects.values_list('ip_address', flat=True)), {'198.51.100.1'})
+        self.assertEqual(rollups.windowed_total(None), 3)
+
+        # Once the row has settled, it is folded in with its country
+        RequestLog.objects.filter(pk=recent.pk).update(country='Testland')
+        with mock.patch('ip_tracking.rollups.timezone.now', return_value=now + timedelta(minutes=6)):
+            self.assertEqual(rollups.update_request_rollups(), 2)
+        self.assertEqual(
+            RequestRollup.objects.get(ip_address='198.51.100.2').country,
+            'Testland'
+        )
+        self.assertEqual(rollups.windowed_total(None), 3)
+
+    @override_settings(IP_TRACKING_ROLLUPS={'SETTLE_SECONDS': 0})
+    def test_update_merges_into_stored_counts(self):
+        self.log('198.51.100.1', 10, 10)
+        self.log('198.51.100.2', 10, 20)
+        self.assertEqual(rollups.update_request_rollups(), 2)
+        self.log('198.51.100.1', 10, 30)
+        self.log('198.51.100.1', 10, 40)
+        self.assertEqual(rollups.update_request_rollups(), 2)
+
+        self.assertEqual(
+            dict(RequestRollup.objects.values_list('ip_address', 'count')),
+            {'198.51.100.1': 3, '198.51.100.2': 1}
+        )
+
+
+@override_settings(IP_TRACKING_DETECTION={'REQUEST_THRESHOLD': 2, 'SENSITIVE_PATHS': ['/admin/']})
+class DetectSuspiciousIPsTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        self.route = RequestPath.objects.create(route='/test/')
+        self.admin_route = RequestPath.objects.create(route='/admin/')
+
+    def log_requests(self, count, first_ip=1):
+        """
+        Log three requests, one of them to /admin/, for each of `count` IPs.
+        """
+        logs = []
+        for n in range(first_ip, first_ip + count):
+            ip_address = f'10.{n // 65536}.{n // 256 % 256}.{n % 256}'
+            logs += [
+                RequestLog(ip_address=ip_address, route=self.route),
+                RequestLog(ip_address=ip_address, route=self.route),
+                RequestLog(ip_address=ip_address, route=self.admin_route),
+            ]
+        RequestLog.objects.bulk_create(logs)
+
+    def detect(self):
+        with CaptureQueriesContext(connection) as context:
+            result = tasks.detect_suspicious_ips()
+        return result, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_flagged_ips(self):
+        # Create the rollup watermark and counters once
+        tasks.detect_suspicious_ips()
+
+        self.log_requests(1)
+        result, one_ip_queries = self.detect()
+        self.assertEqual(result['new_suspicious_ips'], 1)
+
+        SuspiciousIP.objects.all().delete()
+        RequestLog.objects.all().delete()
+        # Few enough for one bulk INSERT within SQLite's parameter limit
+        self.log_requests(100)
+        result, many_ip_queries = self.detect()
+        self.assertEqual(result['new_suspicious_ips'], 100)
+
+        self.assertEqual(many_ip_queries, one_ip_queries)
+        with self.assertNumQueries(one_ip_queries):
+            tasks.detect_suspicious_ips()
+
+    def test_flags_high_volume_and_sensitive_paths(self):
+        self.log_requests(1)
+        tasks.detect_suspicious_ips()
+
+        flag = SuspiciousIP.objects.get()
+        self.assertEqual(flag.ip_address, '10.0.0.1')
+        self.assertEqual(flag.request_count, 3)
+        self.assertEqual(flag.sensitive_paths, ['/admin/'])
+        self.assertTrue(flag.reason.startswith('High volume: 3 requests'))
+
+    def test_keeps_reasons_written_by_an_operator(self):
+        SuspiciousIP.objects.create(
+            ip_address='10.0.0.1', reason='Known scanner', reason_is_manual=True, is_active=False
+        )
+        self.log_requests(1)
+        tasks.detect_suspicious_ips()
+
+        flag = SuspiciousIP.objects.get()
+        self.assertEqual(flag.reason, 'Known scanner')
+        self.assertEqual(flag.request_count, 3)
+        self.assertTrue(flag.is_active)
+
+    def test_refreshes_detected_reasons(self):
+        SuspiciousIP.objects.create(ip_address='10.0.0.1', reason='Accessed sensitive path: /admin/')
+        self.log_requests(1)
+        tasks.detect_suspicious_ips()
+
+        self.assertTrue(SuspiciousIP.objects.get().reason.startswith('High volume: 3 requests'))
+
+    def test_admin_edits_mark_the_reason_manual(self):
+        flag = SuspiciousIP.objects.create(ip_address='10.0.0.1', reason='High volume', request_count=3)
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.post(f'/admin/ip_tracking/suspiciousip/{flag.id}/change/', {
+            'ip_address': '10.0.0.1',
+            'is_active': 'on',
+            'reason': 'Known scanner',
+            'request_count': 3,
+            'sensitive_paths': '[]',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(SuspiciousIP.objects.get().reason_is_manual)
+
+
+@override_settings(IP_TRACKING_DETECTION={
+    'REQUEST_THRESHOLD': 3,
+    'WINDOW_SECONDS': 60,
+    'SENSITIVE_PATHS': ['/admin/'],
+})
+class SlidingWindowDetectorTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        self.detector = detection.SlidingWindowDetector()
+        self.now = 60 * 1000.0  # Start of window 1000
+        patcher = mock.patch('ip_tracking.detection.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, count, path='/test/'):
+        """
+        Record `count` requests and return how many times the IP was flagged.
+        """
+        with mock.patch('ip_tracking.detection.flag_suspicious_ip', wraps=detection.flag_suspicious_ip) as flag:
+            for _ in range(count):
+                self.detector.record('10.0.0.1', path)
+        return flag.call_count
+
+    def test_flags_once_when_crossing_the_threshold(self):
+        self.assertEqual(self.record(3), 0)
+        self.assertFalse(SuspiciousIP.objects.exists())
+
+        with self.assertLogs('ip_tracking.detection', 'WARNING'):
+            self.assertEqual(self.record(1), 1)
+        flag = SuspiciousIP.objects.get()
+        self.assertEqual(flag.request_count, 4)
+        self.assertTrue(flag.reason.startswith('High volume: 4 requests'))
+
+        # Once per window, however many more requests arrive
+        self.assertEqual(self.record(10), 0)
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        with self.assertLogs('ip_tracking.detection', 'WARNING'):
+            self.record(4)
+
+        # Half way through the next window, 4 previous requests count as 2
+        self.now += 90
+        self.assertEqual(self.record(1), 0)
+        with self.assertLogs('ip_tracking.detection', 'WARNING'):
+            self.assertEqual(self.record(1), 1)
+        self.assertEqual(SuspiciousIP.objects.get().request_count, 4)
+
+        # Two windows later the old counts no longer apply
+        self.now += 120
+        self.assertEqual(self.record(3), 0)
+
+    def test_sensitive_paths_flag_once_per_window(self):
+        with self.assertLogs('ip_tracking.detection', 'WARNING'):
+            self.assertEqual(self.record(2, '/admin/'), 1)
+        flag = SuspiciousIP.objects.get()
+        self.assertEqual(flag.sensitive_paths, ['/admin/'])
+        self.assertEqual(flag.reason, 'Accessed sensitive path: /admin/')
+
+        self.now += 60
+        with self.assertLogs('ip_tracking.detection', 'WARNING'):
+            self.assertEqual(self.record(1, '/admin/'), 1)
+
+
+class ClientIPResolverTests(SimpleTestCase):
+
+    def setUp(self):
+        self.resolver = ClientIPResolver(['127.0.0.0/8', '::1/128', '10.0.0.0/8', '2001:db8:ffff::/48'])
+
+    def resolve(self, remote_addr, **headers):
+        return self.resolver.resolve({'REMOTE_ADDR': remote_addr, **headers})
+
+    def test_untrusted_remote_addr_ignores_forwarded_headers(self):
+        self.assertEqual(
+            self.resolve('203.0.113.9', HTTP_X_FORWARDED_FOR='198.51.100.1', HTTP_X_REAL_IP='198.51.100.2'),
+            '203.0.113.9'
+        )
+
+    def test_walks_forwarded_for_from_the_right_past_trusted_hops(self):
+        # The client's own entry (spoofed) is left of the first untrusted hop
+        self.assertEqual(
+            self.resolve('127.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4, 198.51.100.1, 10.0.0.2,10.0.0.3'),
+            '198.51.100.1'
+        )
+        # Only trusted hops: the leftmost is the best known address
+        self.assertEqual(self.resolve('127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.2, 10.0.0.3'), '10.0.0.2')
+
+    def test_stops_at_malformed_entries(self):
+        self.assertEqual(self.resolve('127.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.1, unknown, 10.0.0.2'), '10.0.0.2')
+        self.assertEqual(self.resolve('127.0.0.1', HTTP_X_FORWARDED_FOR='not-an-ip'), '127.0.0.1')
+        self.assertEqual(self.resolve('127.0.0.1', HTTP_X_REAL_IP='garbage'), '127.0.0.1')
+
+    def test_x_real_ip_from_a_trusted_proxy(self):
+        self.assertEqual(self.resolve('10.1.2.3', HTTP_X_REAL_IP=' 198.51.100.4 '), '198.51.100.4')
+        # X-Forwarded-For takes precedence
+        self.assertEqual(
+            self.resolve('10.1.2.3', HTTP_X_FORWARDED_FOR='198.51.100.1', HTTP_X_REAL_IP='198.51.100.4'),
+            '198.51.100.1'
+        )
+
+    def test_ipv6_hops_are_normalized(self):
+        self.assertEqual(
+            self.resolve('::1', HTTP_X_FORWARDED_FOR='2001:DB8:0:0::1, 2001:db8:ffff::5'),
+            '2001:db8::1'
+        )
+        self.assertEqual(self.resolve('2001:db8::7', HTTP_X_FORWARDED_FOR='198.51.100.1'), '2001:db8::7')
+
+
+class RateLimitMiddlewareTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    @override_settings(IP_TRACKING_RATELIMIT={
+        'POLICIES': [{'name': 'test', 'path': '/test/', 'rate': '1/m'}],
+    })
+    def test_limited_requests_are_not_logged(self):
+        self.assertEqual(self.client.get('/test/', REMOTE_ADDR='203.0.113.5').status_code, 200)
+        with self.assertLogs('ip_tracking.ratelimit', 'WARNING'):
+            response = self.client.get('/test/', REMOTE_ADDR='203.0.113.5')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(RequestLog.objects.count(), 1)
+        self.assertEqual(response['Retry-After'], '60')
+
+    @override_settings(IP_TRACKING_RATELIMIT={
+        'POLICIES': [
+            {'name': 'login', 'path': '/accounts/login/', 'rate': '5/m', 'methods': ['post']},
+            {'name': 'accounts', 'path': '/accounts/', 'rate': '30/m'},
+        ],
+    })
+    def test_first_matching_policy_applies(self):
+        rate_limit = ratelimit.RateLimitMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+
+        self.assertEqual(rate_limit.get_policy(factory.post('/accounts/login/')).name, 'login')
+        self.assertEqual(rate_limit.get_policy(factory.get('/accounts/login/')).name, 'accounts')
+        self.assertEqual(rate_limit.get_policy(factory.get('/accounts/')).name, 'accounts')
+        self.assertIsNone(rate_limit.get_policy(factory.get('/account/')))
+
+
+class FakeRedis:
+    """
+    Stand-in for a Redis client that runs GCRA_SCRIPT's logic in Python,
+    with a settable server clock (microseconds) and key expiry.
+    """
+
+    def __init__(self):
+        self.now = 1000000000
+        self.data = {}
+
+    def register_script(self, script):
+        assert script == ratelimit.GCRA_SCRIPT
+        return self.run_script
+
+    def run_script(self, keys, args):
+        interval, tolerance = args
+        tat, expires = self.data.get(keys[0], (None, None))
+        if tat is None or expires <= self.now:
+            tat = self.now
+        new_tat = max(tat, self.now) + interval
+        if new_tat - self.now > tolerance:
+            return [0, new_tat - self.now - tolerance]
+        self.data[keys[0]] = (new_tat, self.now + math.ceil((new_tat - self.now) / 1000) * 1000)
+        return [1, 0]
+
+
+class AsyncFakeRedis(FakeRedis):
+
+    def register_script(self, script):
+        super().register_script(script)
+
+        async def run_script(keys, args):
+            return self.run_script(keys, args)
+        return run_script
+
+
+class RateLimitStoreTests(SimpleTestCase):
+    # 3/m with a burst of 2: one request every 20 seconds, two at once
+    policy = ratelimit.Policy('test', '/', '3/m', burst=2)
+
+    def hits(self, hit, count):
+        return [hit('key', self.policy.emission_interval, self.policy.tolerance) for _ in range(count)]
+
+    def test_memory_store_burst_and_refill(self):
+        store = ratelimit.MemoryStore()
+        with mock.patch('ip_tracking.ratelimit.time.monotonic', return_value=100.0) as monotonic:
+            self.assertEqual(self.hits(store.hit, 3), [(True, 0.0), (True, 0.0), (False, 20.0)])
+
+            # One emission interval frees one slot
+            monotonic.return_value = 120.0
+            self.assertEqual(self.hits(store.hit, 2), [(True, 0.0), (False, 20.0)])
+
+            # After a full idle period the whole burst is available again
+            monotonic.return_value = 200.0
+            self.assertEqual(self.hits(store.hit, 3), [(True, 0.0), (True, 0.0), (False, 20.0)])
+
+    def test_redis_store_burst_and_refill(self):
+        fake_redis = FakeRedis()
+        store = ratelimit.RedisStore()
+        with mock.patch('redis.Redis.from_url', return_value=fake_redis):
+            self.assertEqual(self.hits(store.hit, 3), [(True, 0.0), (True, 0.0), (False, 20.0)])
+
+            fake_redis.now += 20000000
+            self.assertEqual(self.hits(store.hit, 2), [(True, 0.0), (False, 20.0)])
+
+            # The key expires once its TAT has passed
+            fake_redis.now += 40000000
+            self.assertEqual(fake_redis.data['key'][1], fake_redis.now)
+            self.assertEqual(self.hits(store.hit, 3), [(True, 0.0), (True, 0.0), (False, 20.0)])
+
+    def test_async_redis_store(self):
+        store = ratelimit.RedisStore()
+        with mock.patch('redis.asyncio.Redis.from_url', return_value=AsyncFakeRedis()):
+            self.assertEqual(
+                self.hits(async_to_sync(store.ahit), 3),
+                [(True, 0.0), (True, 0.0), (False, 20.0)]
+            )
+
+
+class CompiledBlocklistTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'blocklist.db')
+        self.override = override_settings(IP_TRACKING_BLOCKLIST={'COMPILED_PATH': self.path})
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def test_changes_compile_once_per_transaction(self):
+        with mock.patch('ip_tracking.compiled_blocklist.compile_blocklist') as compile_blocklist:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                for i in range(5):
+                    BlockedIP.objects.create(ip_address=f'10.0.0.{i}')
+
+        self.assertEqual(len(callbacks), 1)
+        compile_blocklist.assert_called_once_with(self.path)
+
+    def test_missing_file_is_not_compiled_on_lookup(self):
+        blocklist = CompiledBlocklist()
+        with mock.patch('ip_tracking.compiled_blocklist.compile_blocklist') as compile_blocklist:
+            with self.assertLogs('ip_tracking.compiled_blocklist', 'ERROR'):
+                self.assertFalse(blocklist.is_blocked('10.0.0.1'))
+            self.assertFalse(async_to_sync(blocklist.ais_blocked)('10.0.0.1'))
+
+        compile_blocklist.assert_not_called()
+
+    def test_lookups_use_the_compiled_file(self):
+        BlockedIP.objects.create(ip_address='10.0.0.0', prefix_length=8)
+        call_command('compile_blocklist', stdout=StringIO())
+
+        blocklist = CompiledBlocklist()
+        self.assertTrue(blocklist.is_blocked('10.1.2.3'))
+        self.assertFalse(blocklist.is_blocked('11.0.0.1'))
+
+
+@override_settings(ROOT_URLCONF='ip_tracking.tests', IP_TRACKING_ROLLUPS={'SETTLE_SECONDS': 0})
+class RequestLogArchiveTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_dir = directory.name
+
+    def test_archive_and_restore_round_trip(self):
+        route = RequestPath.objects.create(route='/test/')
+        old = timezone.now() - timedelta(days=40)
+        archived = [
+            RequestLog.objects.create(ip_address='198.51.100.1', route=route, timestamp=old, country='Testland', city='Testville'),
+            RequestLog.objects.create(ip_address='2001:db8::1', route=route, timestamp=old + timedelta(minutes=5), path='/test/?q=1'),
+        ]
+        recent = RequestLog.objects.create(ip_address='198.51.100.2', route=route)
+        rollups.update_request_rollups()
+        # Rows not rolled up yet are never archived
+        RequestLog.objects.create(ip_address='198.51.100.3', route=route, timestamp=old)
+
+        segments = archive.archive_request_logs(retention_days=30, archive_dir=self.archive_dir)
+        self.assertEqual(len(segments), 1)
+        segment, count = segments[0]
+        self.assertEqual(count, 2)
+        self.assertEqual(RequestLog.objects.count(), 2)
+        self.assertEqual(
+            [row['ip_address'] for row in archive.query_segment(segment, path_prefix='/test/')],
+            ['198.51.100.1', '2001:db8::1']
+        )
+
+        # Restoring twice does not duplicate rows
+        self.assertEqual(archive.restore_segment(segment), 2)
+        self.assertEqual(archive.restore_segment(segment), 2)
+        self.assertEqual(RequestLog.objects.count(), 4)
+        for original in archived:
+            restored = RequestLog.objects.get(pk=original.pk)
+            self.assertEqual(
+                (restored.ip_address, restored.timestamp, restored.route_id, restored.path, restored.country, restored.city),
+                (original.ip_address, original.timestamp, original.route_id, original.path, original.country, original.city)
+            )
+            self.assertEqual(restored.ip_packed, pack_ip(original.ip_address))
+        self.assertTrue(RequestLog.objects.filter(pk=recent.pk).exists())
+
+    def test_restores_segments_written_before_routes(self):
+        segment = os.path.join(self.archive_dir, 'requestlog-2024-01-01.jsonl.gz')
+        with gzip.open(segment, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'id': 7, 'ip_address': '198.51.100.1', 'timestamp': '2024-01-01T10:00:00+00:00',
+                'path': '/users/42/', 'country': None, 'city': None,
+            }) + '\n')
+
+        self.assertEqual([row['id'] for row in archive.query_segment(segment, path_prefix='/users/')], [7])
+        self.assertEqual(archive.restore_segment(segment), 1)
+        restored = RequestLog.objects.select_related('route').get(pk=7)
+        self.assertEqual((restored.route.route, restored.path), ('/users/<int:user_id>/', '/users/42/'))
+        self.assertEqual(restored.timestamp, datetime(2024, 1, 1, 10, tzinfo=dt_timezone.utc))
+
+
+class RangeDatabaseTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = os.path.join(directory.name, 'ranges.csv')
+        self.path = os.path.join(directory.name, 'ranges.db')
+
+    def compile(self, rows):
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write('start,end,country,city\n')
+            f.writelines(f'{row}\n' for row in rows)
+        call_command('compile_geolocation_db', self.csv_path, '--output', self.path, stdout=StringIO())
+        database = RangeDatabase(self.path)
+        self.addCleanup(database.close)
+        return database
+
+    def test_lookups_across_address_family_boundaries(self):
+        database = self.compile([
+            '0.0.0.0,0.0.0.255,Zeroland,',
+            '16777216,16777471,Oneland,One City',  # 1.0.0.0/24 as integers
+            '255.255.255.0,255.255.255.255,Topland,Top City',
+            '::1:0:0:0,::1:ffff:ffff:ffff,Sixland,Six City',
+            '::,::fffe:ffff:ffff,Lowland,',
+        ])
+        self.assertEqual(len(database), 5)
+
+        self.assertEqual(database.lookup('0.0.0.0'), ('Zeroland', ''))
+        self.assertEqual(database.lookup('1.0.0.255'), ('Oneland', 'One City'))
+        self.assertIsNone(database.lookup('1.0.1.0'))
+        self.assertEqual(database.lookup('255.255.255.255'), ('Topland', 'Top City'))
+        # IPv4-mapped IPv6 addresses share the IPv4 ranges
+        self.assertEqual(database.lookup('::ffff:255.255.255.255'), ('Topland', 'Top City'))
+        # Right after the IPv4 space, and right before it
+        self.assertEqual(database.lookup('::1:0:0:0'), ('Sixland', 'Six City'))
+        self.assertEqual(database.lookup('::fffe:ffff:ffff'), ('Lowland', ''))
+        self.assertIsNone(database.lookup('2001:db8::1'))
+
+    def test_overlapping_ranges_are_rejected(self):
+        with self.assertRaisesMessage(CommandError, 'Overlapping ranges'):
+            self.compile(['10.0.0.0,10.0.0.255,A,', '10.0.0.128,10.0.1.0,B,'])
+
+
+class UniqueVisitorsTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_flush_writes_only_changed_sketches(self):
+        visitors = sketches.UniqueVisitors()
+        visitors.record('10.0.0.1', '/a/')
+        visitors.record('10.0.0.1', '/b/')
+        visitors.flush()
+        self.assertEqual(UniqueVisitorSketch.objects.count(), 3)
+
+        # A client already counted changes no register
+        visitors.record('10.0.0.1', '/a/')
+        with self.assertNumQueries(0):
+            visitors.flush()
+
+        visitors.record('10.0.0.2', '/a/')
+        with CaptureQueriesContext(connection) as queries:
+            visitors.flush()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(sketches.unique_clients(timezone.now()), 2)
+        self.assertEqual(sketches.unique_clients(timezone.now(), ['/b/']), 1)
+
+    def test_registers_are_compressed(self):
+        sketch = sketches.HyperLogLog()
+        for i in range(100):
+            sketch.add(f'10.0.0.{i}')
+
+        data = sketch.to_bytes()
+        self.assertLess(len(data), len(sketch.registers) // 4)
+        self.assertEqual(sketches.HyperLogLog.from_bytes(data).registers, sketch.registers)
+        # Uncompressed registers from older rows are still read
+        self.assertEqual(sketches.HyperLogLog.from_bytes(bytes(sketch.registers)).registers, sketch.registers)
+
+
+class RequestLogAdminTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.route = RequestPath.objects.create(route='/test/')
+        self.other_route = RequestPath.objects.create(route='/other/')
+        now = timezone.now()
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='198.51.100.1', route=self.route, country='Testland', timestamp=now),
+            RequestLog(ip_address='198.51.100.2', route=self.other_route, country='Otherland', timestamp=now),
+            RequestLog(ip_address='198.51.100.3', route=self.route, country='Testland', timestamp=now - timedelta(hours=3)),
+        ])
+        RequestRollup.objects.bulk_create([
+            RequestRollup(hour=rollups.truncate_hour(now), ip_address='198.51.100.1', route=self.route, country='Testland', count=1),
+            RequestRollup(hour=rollups.truncate_hour(now), ip_address='198.51.100.4', route=self.route, country='', count=1),
+        ])
+
+    def changelist(self, **params):
+        response = self.client.get('/admin/ip_tracking/requestlog/', params, REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 200)
+        # The admin request itself is logged too
+        return set(response.context['cl'].queryset.exclude(ip_address='192.0.2.1').values_list('ip_address', flat=True))
+
+    def test_time_window_defaults_to_the_last_hour(self):
+        self.assertEqual(self.changelist(), {'198.51.100.1', '198.51.100.2'})
+        self.assertEqual(self.changelist(window='6h'), {'198.51.100.1', '198.51.100.2', '198.51.100.3'})
+        self.assertEqual(self.changelist(window='all'), {'198.51.100.1', '198.51.100.2'})
+
+    def test_country_and_route_filters(self):
+        self.assertEqual(self.changelist(window='6h', country='Testland'), {'198.51.100.1', '198.51.100.3'})
+        self.assertEqual(self.changelist(route=self.other_route.id), {'198.51.100.2'})
+
+    def test_country_choices_come_from_cached_rollups(self):
+        country_filter = CountryFilter(None, {}, RequestLog, None)
+        self.assertEqual(country_filter.lookup_choices, [('Testland', 'Testland')])
+
+        RequestRollup.objects.update(country='Otherland')
+        with self.assertNumQueries(0):
+            self.assertEqual(CountryFilter(None, {}, RequestLog, None).lookup_choices, [('Testland', 'Testland')])
+
+    def test_paginator_caps_the_exact_count(self):
+        queryset = RequestLog.objects.order_by('id')
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 2):
+            self.assertEqual(EstimatedCountPaginator(queryset, 1).count, 2)
+            self.assertEqual(EstimatedCountPaginator(queryset.filter(country='Otherland'), 1).count, 1)
+            self.assertEqual(EstimatedCountPaginator(queryset, 1).page(2).object_list[0].ip_address, '198.51.100.2')
+
+
+class TrafficCounterTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        self.route = RequestPath.objects.create(route='/test/')
+        self.now = 1700000000
+
+    def request(self, worker):
+        # As the middleware does: save the entry, then count it
+        RequestLog.objects.create(
+            ip_address='198.51.100.1',
+            route=self.route,
+            timestamp=datetime.fromtimestamp(self.now, dt_timezone.utc)
+        )
+        with mock.patch('ip_tracking.counters.time.time', return_value=self.now):
+            worker.add(counters.REQUESTS)
+
+    def requests_counter(self):
+        return TrafficCounter.objects.get(name=counters.REQUESTS).value
+
+    def test_reconcile_does_not_count_pending_deltas_twice(self):
+        first, second = counters.PendingCounters(), counters.PendingCounters()
+        self.request(first)
+        self.request(second)
+        self.request(second)
+
+        self.now += 1
+        with mock.patch('ip_tracking.counters.time.time', return_value=self.now):
+            counters.reconcile_counters()
+        self.assertEqual(self.requests_counter(), 3)
+
+        # Deltas pending during the reconcile are already in the total
+        self.request(first)
+        first.flush()
+        second.flush()
+        self.assertEqual(self.requests_counter(), 4)
+        self.assertEqual(counters.reconcile_counters()[counters.REQUESTS], 4)
+
+    def test_log_buffer_counts_only_requests_after_the_watermark(self):
+        with mock.patch('ip_tracking.counters.time.time', return_value=self.now):
+            counters.reconcile_counters()
+
+        counters.increment_requests([self.now - 1, self.now, self.now + 5])
+        self.assertEqual(self.requests_counter(), 2)
+
+
+class SecurityReportTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        self.hour = rollups.truncate_hour(timezone.now())
+        self.route = RequestPath.objects.create(route='/test/')
+
+    def report(self, ip_addresses):
+        HeavyHitterSketch.objects.update_or_create(
+            dimension=sketches.IP_ADDRESS,
+            hour=self.hour,
+            worker='test',
+            defaults={'counters': [[ip_address, 10, 0] for ip_address in ip_addresses]},
+        )
+        with CaptureQueriesContext(connection) as context:
+            report = tasks.generate_security_report()
+        return report['top_ips'], len(context.captured_queries)
+
+    def test_top_ip_countries_come_from_the_rollup(self):
+        RequestRollup.objects.bulk_create([
+            RequestRollup(hour=self.hour - timedelta(hours=1), ip_address='198.51.100.1', route=self.route, country='Oldland', count=1),
+            RequestRollup(hour=self.hour, ip_address='198.51.100.1', route=self.route, country='Testland', count=1),
+            RequestRollup(hour=self.hour, ip_address='198.51.100.2', route=self.route, country='', count=1),
+        ])
+        # Create the rollup watermark once
+        self.report([])
+
+        top_ips, one_ip_queries = self.report(['198.51.100.1'])
+        self.assertEqual(top_ips, [{'ip_address': '198.51.100.1', 'country': 'Testland', 'count': 10}])
+
+        top_ips, three_ip_queries = self.report(['198.51.100.1', '198.51.100.2', '198.51.100.3'])
+        self.assertEqual(
+            {row['ip_address']: row['country'] for row in top_ips},
+            {'198.51.100.1': 'Testland', '198.51.100.2': '', '198.51.100.3': ''}
+        )
+        self.assertEqual(three_ip_queries, one_ip_queries)
+
+
+@override_settings(ROOT_URLCONF='ip_tracking.tests')
+class PathNormalizerTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_paths_resolve_to_their_route(self):
+        normalizer = paths.PathNormalizer()
+        self.assertEqual(normalizer.route('/users/42/'), '/users/<int:user_id>/')
+        self.assertEqual(normalizer.route('/users/7/'), '/users/<int:user_id>/')
+        self.assertEqual(normalizer.route('/test/'), '/test/')
+        self.assertEqual(normalizer.route('/users/alice/'), paths.UNMATCHED)
+        self.assertEqual(normalizer.route('/wp-login.php'), paths.UNMATCHED)
+
+        # Each route is interned once
+        first = normalizer.request_path(normalizer.route('/users/42/'))
+        self.assertEqual(normalizer.request_path(normalizer.route('/users/7/')), first)
+        self.assertEqual(RequestPath.objects.filter(route='/users/<int:user_id>/').count(), 1)
+
+    def test_raw_paths_without_normalization(self):
+        normalizer = paths.PathNormalizer(normalize=False)
+        self.assertEqual(normalizer.route('/users/42/'), '/users/42/')
+
+    def test_middleware_logs_the_route(self):
+        self.client.get('/users/42/', REMOTE_ADDR='203.0.113.5')
+
+        log = RequestLog.objects.select_related('route').get()
+        self.assertEqual(log.route.route, '/users/<int:user_id>/')
+        self.assertIsNone(log.path)
+        self.assertEqual(log.request_path, '/users/<int:user_id>/')
+
+    @override_settings(IP_TRACKING_PATHS={'STORE_RAW_PATH': True})
+    def test_store_raw_path(self):
+        self.client.get('/users/42/', REMOTE_ADDR='203.0.113.5')
+        self.client.get('/missing/', REMOTE_ADDR='203.0.113.5')
+
+        self.assertEqual(
+            set(RequestLog.objects.values_list('route__route', 'path')),
+            {('/users/<int:user_id>/', '/users/42/'), (paths.UNMATCHED, '/missing/')}
+        )
+
+
+class PackedIPQueryTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+        route = RequestPath.objects.create(route='/test/')
+        for ip_address in [
+            '9.255.255.255', '10.0.0.0', '10.255.255.255', '11.0.0.0', '::ffff:10.1.2.3',
+            '::1', '2001:db8::', '2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', '2001:db9::',
+        ]:
+            RequestLog.objects.create(ip_address=ip_address, route=route)
+
+    def logs_in(self, network):
+        return set(RequestLog.objects.in_network(network).values_list('ip_address', flat=True))
+
+    def test_ipv4_network_boundaries(self):
+        # IPv4-mapped IPv6 addresses fall in the IPv4 network
+        self.assertEqual(self.logs_in('10.0.0.0/8'), {'10.0.0.0', '10.255.255.255', '::ffff:10.1.2.3'})
+        self.assertEqual(self.logs_in('10.0.0.0/32'), {'10.0.0.0'})
+        self.assertEqual(self.logs_in('::ffff:10.0.0.0/104'), {'10.0.0.0', '10.255.255.255', '::ffff:10.1.2.3'})
+
+    def test_ipv6_network_boundaries(self):
+        self.assertEqual(self.logs_in('2001:db8::/32'), {'2001:db8::', '2001:db8:ffff:ffff:ffff:ffff:ffff:ffff'})
+        self.assertEqual(self.logs_in('::1/128'), {'::1'})
+        # IPv4 occupies ::ffff:0:0/96, so 0.0.0.0/0 excludes native IPv6
+        self.assertEqual(len(self.logs_in('0.0.0.0/0')), 5)
+        self.assertEqual(len(self.logs_in('::/0')), 9)
+
+    def test_blocked_networks(self):
+        BlockedIP.objects.create(ip_address='10.0.0.0', prefix_length=8)
+        BlockedIP.objects.create(ip_address='2001:db8::', prefix_length=32)
+        BlockedIP.objects.create(ip_address='192.0.2.1')
+
+        def covering(ip_address):
+            return set(BlockedIP.objects.covering(ip_address).values_list('ip_address', flat=True))
+
+        def inside(network):
+            return set(BlockedIP.objects.in_network(network).values_list('ip_address', flat=True))
+
+        self.assertEqual(covering('10.0.0.0'), {'10.0.0.0'})
+        self.assertEqual(covering('10.255.255.255'), {'10.0.0.0'})
+        self.assertEqual(covering('::ffff:10.0.0.1'), {'10.0.0.0'})
+        self.assertEqual(covering('11.0.0.0'), set())
+        self.assertEqual(covering('192.0.2.1'), {'192.0.2.1'})
+        self.assertEqual(covering('192.0.2.2'), set())
+        self.assertEqual(covering('2001:db8:ffff:ffff:ffff:ffff:ffff:ffff'), {'2001:db8::'})
+        self.assertEqual(covering('2001:db9::'), set())
+
+        self.assertEqual(inside('10.0.0.0/7'), {'10.0.0.0'})
+        self.assertEqual(inside('10.0.0.0/9'), set())
+        self.assertEqual(inside('192.0.2.0/24'), {'192.0.2.1'})
+        self.assertEqual(inside('2001:db8::/16'), {'2001:db8::'})
+
+
+@override_settings(IP_TRACKING_BLOCKLIST={'CHECK_INTERVAL': 0})
+class BlocklistSnapshotTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_changes_bump_the_version_and_reload(self):
+        snapshot = BlocklistSnapshot()
+        self.assertFalse(snapshot.is_blocked('192.0.2.5'))
+
+        version = get_blocklist_version()
+        block = BlockedIP.objects.create(ip_address='192.0.2.0', prefix_length=24)
+        self.assertEqual(get_blocklist_version(), version + 1)
+        self.assertTrue(snapshot.is_blocked('192.0.2.5'))
+
+        # Bulk updates skip the signals until blocklist_changed() is called
+        BlockedIP.objects.filter(pk=block.pk).update(is_active=False)
+        self.assertTrue(snapshot.is_blocked('192.0.2.5'))
+        blocklist_changed()
+        self.assertFalse(snapshot.is_blocked('192.0.2.5'))
+
+    def test_unchanged_version_does_not_query(self):
+        BlockedIP.objects.create(ip_address='192.0.2.5')
+        snapshot = BlocklistSnapshot()
+        self.assertTrue(snapshot.is_blocked('192.0.2.5'))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(snapshot.is_blocked('192.0.2.5'))
+            self.assertTrue(async_to_sync(snapshot.ais_blocked)('192.0.2.5'))
+
+
+class BlocklistExpiryTests(TestCase):
+
+    def setUp(self):
+        reset_worker_state()
+
+    def test_full_length_prefixes_are_single_addresses(self):
+        BlockedIP.objects.create(ip_address='192.0.2.5')
+
+        block = BlockedIP(ip_address='192.0.2.5', prefix_length=32)
+        with self.assertRaises(ValidationError):
+            block.full_clean()
+        self.assertIsNone(block.prefix_length)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BlockedIP.objects.create(ip_address='192.0.2.5', prefix_length=32)
+
+        self.assertIsNone(BlockedIP.objects.create(ip_address='2001:db8::1', prefix_length=128).prefix_length)
+        self.assertEqual(BlockedIP.objects.create(ip_address='2001:db8::', prefix_length=32).prefix_length, 32)
+
+    def test_expired_block_keeps_networks_other_rows_block(self):
+        now = time.time()
+        expires_at = datetime.fromtimestamp(now + 2, dt_timezone.utc)
+        snapshot = BlocklistSnapshot()
+        index, expiries = NetworkIndex(), []
+        # As loaded from rows written before /32 was stored as a single address
+        snapshot._add_row(index, expiries, '192.0.2.5', None, None)
+        snapshot._add_row(index, expiries, '192.0.2.5', 32, expires_at)
+        snapshot._add_row(index, expiries, '198.51.100.0', 24, expires_at)
+        snapshot._swap(index, expiries, None)
+
+        with mock.patch('ip_tracking.blocklist.time.time', return_value=now + 3):
+            snapshot._expire()
+
+        self.assertTrue(snapshot._index.contains('192.0.2.5'))
+        self.assertFalse(snapshot._index.contains('198.51.100.7'))
+
+    def test_temporary_block_expires_on_time(self):
+        BlockedIP.objects.create(ip_address='192.0.2.5')
+        BlockedIP.objects.create(
+            ip_address='192.0.2.0', prefix_length=24,
+            expires_at=timezone.now() + timedelta(seconds=2)
+        )
+        snapshot = BlocklistSnapshot()
+        self.assertTrue(snapshot.is_blocked('192.0.2.6'))
+
+        with mock.patch('ip_tracking.blocklist.time.time', return_value=time.time() + 3):
+            self.assertFalse(snapshot.is_blocked('192.0.2.6'))
+            self.assertTrue(snapshot.is_blocked('192.0.2.5'))
+
+
+class NetworkIndexTests(SimpleTestCase):
+
+    def test_longest_prefix_match(self):
+        index = NetworkIndex(['10.0.0.0/8', '10.1.0.0/16', '2001:db8::/32'])
+        self.assertEqual(str(index.lookup('10.1.2.3')), '10.1.0.0/16')
+        self.assertEqual(str(index.lookup('10.2.0.1')), '10.0.0.0/8')
+        self.assertEqual(str(index.lookup('2001:db8::5')), '2001:db8::/32')
+        self.assertIsNone(index.lookup('11.0.0.1'))
+        self.assertIsNone(index.lookup('not an address'))
+
+    def test_networks_are_reference_counted(self):
+        index = NetworkIndex(['192.0.2.5', '192.0.2.5/32'])
+        index.discard('192.0.2.5/32')
+        self.assertTrue(index.contains('192.0.2.5'))
+        index.discard('192.0.2.5')
+        self.assertFalse(index.contains('192.0.2.5'))
+        # Discarding a missing network is a no-op
+        index.discard('192.0.2.5')
+        self.assertEqual(len(index), 0)
@@ -1,12 +1,41 @@
+import base64
+import json
+from datetime import timedelta
+from django.conf import settings
 from django.http import JsonResponse, HttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
-from django_ratelimit.decorators import ratelimit
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .blocklist import NetworkIndex
+from .client_ip import get_client_ip_resolver
+from .counters import BLOCKED_IPS, REQUESTS, SUSPICIOUS_IPS, get_counters
+from .geolocation import get_geolocation_stats
+from .log_buffer import request_log_buffer
 from .models import RequestLog, SuspiciousIP, BlockedIP
+from .sketches import unique_clients
+
+
+LOGS_API_FIELDS = ['id', 'ip_address', 'timestamp', 'route__route', 'path', 'country', 'city']
+LOGS_API_DEFAULT_LIMIT = 50
+LOGS_API_MAX_LIMIT = 500
+
+DEFAULT_METRICS_SETTINGS = {
+    # Networks allowed to read /metrics/ without logging in as staff
+    'ALLOWED_NETWORKS': ['127.0.0.0/8', '::1/128'],
+}
+
+
+def get_metrics_settings():
+    """
+    Return the metrics settings merged over the defaults.
+    """
+    return {**DEFAULT_METRICS_SETTINGS, **getattr(settings, 'IP_TRACKING_METRICS', {})}
 
 
 def test_view(request):
@@ -20,19 +49,135 @@ def test_view(request):
     })
 
 
+def metrics_view(request):
+    """
+    Expose this worker's in-process counters as JSON for scraping.
+    Only staff users and clients in IP_TRACKING_METRICS['ALLOWED_NETWORKS']
+    may read them.
+    """
+    if not can_read_metrics(request):
+        return JsonResponse({'error': "Forbidden"}, status=403)
+    return JsonResponse({
+        'geolocation': get_geolocation_stats(),
+        'log_buffer': {
+            **request_log_buffer.stats,
+            'pending': request_log_buffer.pending(),
+        },
+    })
+
+
+def can_read_metrics(request):
+    """
+    Return True if the request comes from a staff user or an allowed network.
+    """
+    if request.user.is_active and request.user.is_staff:
+        return True
+    # IPLoggingMiddleware has usually resolved the client IP already
+    ip_address = getattr(request, 'client_ip', None) or get_client_ip_resolver().resolve(request.META)
+    return NetworkIndex(get_metrics_settings()['ALLOWED_NETWORKS']).contains(ip_address)
+
+
 def logs_view(request):
     """
     View to display recent request logs.
     """
-    recent_logs = RequestLog.objects.all()[:50]  # Get last 50 logs
+    recent_logs = RequestLog.objects.select_related('route')[:50]  # Get last 50 logs
     return render(request, 'ip_tracking/logs.html', {'logs': recent_logs})
 
 
-@ratelimit(key='ip', rate='5/m', method='POST', block=True)
-@ratelimit(key='ip', rate='10/m', method='GET', block=True)
+@staff_member_required
+def logs_api_view(request):
+    """
+    JSON API over the request logs, newest first. Staff users only.
+
+    Query parameters: ip, network (CIDR), path (route prefix), country, since and until (ISO 8601),
+    limit (default 50, max 500) and cursor (the next_cursor of the previous
+    page). Pages continue from a (timestamp, id) cursor instead of an
+    OFFSET, so deep pages cost the same as the first one.
+    """
+    params = request.GET
+    queryset = RequestLog.objects.order_by('-timestamp', '-id')
+
+    if params.get('ip'):
+        queryset = queryset.filter(ip_address=params['ip'])
+    if params.get('network'):
+        try:
+            queryset = queryset.in_network(params['network'])
+        except ValueError:
+            return JsonResponse({'error': "Invalid network: expected CIDR notation"}, status=400)
+    if params.get('path'):
+        queryset = queryset.filter(route__route__startswith=params['path'])
+    if params.get('country'):
+        queryset = queryset.filter(country=params['country'])
+
+    for name, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+        if params.get(name):
+            try:
+                # None for malformed input, ValueError for out-of-range fields
+                value = parse_datetime(params[name])
+            except ValueError:
+                value = None
+            if value is None:
+                return JsonResponse({'error': f"Invalid {name}: expected an ISO 8601 datetime"}, status=400)
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            queryset = queryset.filter(**{lookup: value})
+
+    try:
+        limit = min(int(params.get('limit', LOGS_API_DEFAULT_LIMIT)), LOGS_API_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': "Invalid limit"}, status=400)
+    if limit < 1:
+        return JsonResponse({'error': "Invalid limit"}, status=400)
+
+    if params.get('cursor'):
+        try:
+            timestamp, last_id = decode_logs_cursor(params['cursor'])
+        except ValueError:
+            return JsonResponse({'error': "Invalid cursor"}, status=400)
+        queryset = queryset.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=last_id)
+        )
+
+    # Fetch one extra row to know whether there is another page
+    rows = list(queryset.values(*LOGS_API_FIELDS)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_logs_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+
+    for row in rows:
+        row['timestamp'] = row['timestamp'].isoformat()
+        row['route'] = row.pop('route__route')
+
+    return JsonResponse({'results': rows, 'next_cursor': next_cursor})
+
+
+def encode_logs_cursor(timestamp, last_id):
+    """
+    Encode a (timestamp, id) position as an opaque URL-safe cursor.
+    """
+    value = json.dumps([timestamp.isoformat(), last_id])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_logs_cursor(cursor):
+    """
+    Decode a cursor from encode_logs_cursor. Raises ValueError if it is invalid.
+    """
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    timestamp = parse_datetime(value) if isinstance(value, str) else None
+    if timestamp is None or not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
+    return timestamp, last_id
+
+
 def login_view(request):
     """
-    Login view with rate limiting:
+    Login view, rate limited by RateLimitMiddleware:
     - 5 requests/minute for POST (login attempts)
     - 10 requests/minute for GET (login page views)
     """
@@ -55,35 +200,43 @@ def login_view(request):
 
 
 @login_required
-@ratelimit(key='ip', rate='10/m', block=True)
 def admin_dashboard(request):
     """
-    Admin dashboard view with rate limiting:
-    - 10 requests/minute for authenticated users
+    Admin dashboard view, rate limited by RateLimitMiddleware:
+    - 10 requests/minute
     """
     # Get recent statistics
-    recent_logs = RequestLog.objects.all()[:20]
+    recent_logs = RequestLog.objects.select_related('route')[:20]
     suspicious_ips = SuspiciousIP.objects.filter(is_active=True)[:10]
     blocked_ips = BlockedIP.objects.filter(is_active=True)[:10]
     
+    # Totals come from the maintained counters in one query, not COUNT(*)
+    counters = get_counters()
+    
+    # Distinct client IPs from the unique-visitor sketches, not COUNT(DISTINCT)
+    now = timezone.now()
+    unique_clients_1h = unique_clients(now - timedelta(hours=1))
+    unique_clients_24h = unique_clients(now - timedelta(hours=24))
+    
     context = {
         'recent_logs': recent_logs,
         'suspicious_ips': suspicious_ips,
         'blocked_ips': blocked_ips,
-        'total_requests': RequestLog.objects.count(),
-        'suspicious_count': SuspiciousIP.objects.filter(is_active=True).count(),
-        'blocked_count': BlockedIP.objects.filter(is_active=True).count(),
+        'total_requests': counters[REQUESTS],
+        'suspicious_count': counters[SUSPICIOUS_IPS],
+        'blocked_count': counters[BLOCKED_IPS],
+        'unique_clients_1h': unique_clients_1h,
+        'unique_clients_24h': unique_clients_24h,
     }
     
     return render(request, 'ip_tracking/admin_dashboard.html', context)
 
 
 @login_required
-@ratelimit(key='ip', rate='10/m', block=True)
 def sensitive_data_view(request):
     """
-    Sensitive data view with rate limiting:
-    - 10 requests/minute for authenticated users
+    Sensitive data view, rate limited by RateLimitMiddleware:
+    - 10 requests/minute
     """
     return JsonResponse({
         'message': 'This is sensitive data that requires authentication.',